@@ -0,0 +1,196 @@
+import sys
+from array import array
+
+try:
+    import numpy  # Optional, used for the widest vectorized paths when installed
+except ImportError:
+    numpy = None
+
+# PCMU/PCMA/L16 conversion with precomputed G.711 tables.
+#
+# Decoding maps each 8-bit code through a 256-entry table. Without NumPy the table is split
+# into low- and high-byte translation tables so a whole chunk is converted with two
+# bytes.translate calls and two strided slice assignments, all in C. Linear PCM is
+# little-endian 16-bit, as WAV files and the recognizers expect. Nothing here depends on
+# audioop, which was removed in Python 3.13.
+
+SAMPLE_WIDTH = {'PCMU': 1, 'PCMA': 1, 'L16': 2, 'LINEAR16': 2}
+G711_ENCODINGS = ('PCMU', 'PCMA')
+SILENCE_CODES = {'PCMU': 0xFF, 'PCMA': 0xD5}  # Codes that decode to (near) zero
+
+
+def _ulaw_to_linear(code):
+    code = ~code & 0xFF
+    exponent = (code >> 4) & 0x07
+    sample = ((((code & 0x0F) << 3) + 0x84) << exponent) - 0x84
+    return -sample if code & 0x80 else sample
+
+
+def _alaw_to_linear(code):
+    code ^= 0x55
+    exponent = (code >> 4) & 0x07
+    mantissa = code & 0x0F
+    if exponent == 0:
+        sample = (mantissa << 4) + 8
+    else:
+        sample = ((mantissa << 4) + 0x108) << (exponent - 1)
+    return sample if code & 0x80 else -sample
+
+
+def _linear_to_ulaw(sample):
+    value = sample >> 2  # 14-bit
+    if value < 0:
+        value, mask = -value, 0x7F
+    else:
+        mask = 0xFF
+    value = min(value, 8159) + 33
+    segment = max(value.bit_length() - 6, 0)
+    if segment >= 8:
+        return 0x7F ^ mask
+    return ((segment << 4) | ((value >> (segment + 1)) & 0x0F)) ^ mask
+
+
+def _linear_to_alaw(sample):
+    value = sample >> 3  # 13-bit
+    if value >= 0:
+        mask = 0xD5
+    else:
+        mask = 0x55
+        value = -value - 1
+    segment = max(value.bit_length() - 5, 0)
+    if segment >= 8:
+        return 0x7F ^ mask
+    code = segment << 4
+    code |= (value >> 1) & 0x0F if segment < 2 else (value >> segment) & 0x0F
+    return code ^ mask
+
+
+def _translation_tables(decode):
+    samples = [decode(code) & 0xFFFF for code in range(256)]
+    return bytes(s & 0xFF for s in samples), bytes(s >> 8 for s in samples)
+
+
+DECODE_TABLES = {
+    'PCMU': _translation_tables(_ulaw_to_linear),
+    'PCMA': _translation_tables(_alaw_to_linear),
+}
+# Direct A-law <-> μ-law transcoding through linear, one translate per chunk
+ALAW_TO_ULAW = bytes(_linear_to_ulaw(_alaw_to_linear(code)) for code in range(256))
+ULAW_TO_ALAW = bytes(_linear_to_alaw(_ulaw_to_linear(code)) for code in range(256))
+
+if numpy is not None:
+    NUMPY_DECODE_TABLES = {
+        'PCMU': numpy.array([_ulaw_to_linear(code) for code in range(256)], dtype='<i2'),
+        'PCMA': numpy.array([_alaw_to_linear(code) for code in range(256)], dtype='<i2'),
+    }
+
+_encode_tables = {}  # 65536-entry tables, built on first use
+
+
+def decode(encoding, data):
+    """Decode a PCMU/PCMA chunk to 16-bit little-endian linear PCM; L16 passes through"""
+    tables = DECODE_TABLES.get(encoding)
+    if tables is None:
+        return data
+    if numpy is not None and len(data) >= 1024:
+        return NUMPY_DECODE_TABLES[encoding].take(numpy.frombuffer(data, dtype=numpy.uint8)).tobytes()
+    low, high = tables
+    out = bytearray(2 * len(data))
+    out[0::2] = data.translate(low)
+    out[1::2] = data.translate(high)
+    return bytes(out)
+
+
+def decode_many(encoding, chunks):
+    """Decode a batch of chunks with a single table pass"""
+    return decode(encoding, b''.join(chunks))
+
+
+def encode(encoding, data):
+    """Encode 16-bit little-endian linear PCM to PCMU/PCMA; L16 passes through"""
+    if encoding not in G711_ENCODINGS:
+        return data
+    table = _encode_tables.get(encoding)
+    if table is None:
+        to_code = _linear_to_ulaw if encoding == 'PCMU' else _linear_to_alaw
+        # Indexed by the sample's unsigned 16-bit value
+        table = bytes(to_code(value - 65536 if value >= 32768 else value) for value in range(65536))
+        _encode_tables[encoding] = table
+    samples = array('H', data)
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    if numpy is not None:
+        return numpy.frombuffer(table, dtype=numpy.uint8).take(numpy.frombuffer(samples, dtype=numpy.uint16)).tobytes()
+    return bytes(map(table.__getitem__, samples))
+
+
+def transcode(source, target, data):
+    """Convert between PCMU, PCMA and 16-bit linear (L16/LINEAR16)"""
+    if source == target or {source, target} <= {'L16', 'LINEAR16'}:
+        return data
+    if source == 'PCMA' and target == 'PCMU':
+        return data.translate(ALAW_TO_ULAW)
+    if source == 'PCMU' and target == 'PCMA':
+        return data.translate(ULAW_TO_ALAW)
+    return encode(target, decode(source, data))
+
+
+def levels(encoding, data, frame_samples):
+    """Mean absolute sample value of each `frame_samples` frame of a PCMU/PCMA/L16 chunk.
+
+    The last frame is shorter when the chunk isn't a whole number of frames. With NumPy all
+    frames are decoded and averaged in a few array operations.
+    """
+    if numpy is not None:
+        if encoding in NUMPY_DECODE_TABLES:
+            samples = NUMPY_DECODE_TABLES[encoding].take(numpy.frombuffer(data, dtype=numpy.uint8))
+        else:
+            samples = numpy.frombuffer(data, dtype='<i2', count=len(data) // 2)
+        magnitudes = numpy.abs(samples.astype(numpy.int32))
+        whole = len(magnitudes) // frame_samples * frame_samples
+        result = magnitudes[:whole].reshape(-1, frame_samples).mean(axis=1).tolist()
+        if whole < len(magnitudes):
+            result.append(float(magnitudes[whole:].mean()))
+        return result
+    samples = array('h', decode(encoding, data) if encoding in DECODE_TABLES else data[:len(data) // 2 * 2])
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    frames = (samples[i:i + frame_samples] for i in range(0, len(samples), frame_samples))
+    return [sum(map(abs, frame)) / len(frame) for frame in frames]
+
+
+def audio_format(encoding, sample_rate, ptime=20, channels=1):
+    """Format dict of a stream in `encoding`, as the pipeline stages and recognizers take it"""
+    audio_format = {'encoding': encoding, 'sample_rate': sample_rate, 'ptime': ptime, 'channels': channels}
+    if encoding in SAMPLE_WIDTH:
+        audio_format['sample_width'] = SAMPLE_WIDTH[encoding]
+    return audio_format
+
+
+def silence(encoding, samples):
+    """`samples` samples of digital silence in the given encoding"""
+    if encoding in G711_ENCODINGS:
+        return bytes([SILENCE_CODES[encoding]]) * samples
+    return bytes(2 * samples)
+
+
+def negotiate(source, accepted):
+    """Pick the cheapest encoding in `accepted` to send `source` audio as.
+
+    Returns (encoding, convert) where convert maps one chunk to the chosen encoding. Audio
+    passes through untouched when the source codec is accepted; otherwise 8-bit G.711 is
+    preferred over 16-bit linear, which doubles the bytes on the wire.
+    """
+    source = 'LINEAR16' if source == 'L16' else source
+    accepted = ['LINEAR16' if encoding == 'L16' else encoding for encoding in accepted]
+    if source in accepted:
+        return source, _passthrough
+    if source in G711_ENCODINGS or source == 'LINEAR16':
+        for target in ('PCMU', 'PCMA', 'LINEAR16'):
+            if target in accepted:
+                return target, lambda chunk, target=target: transcode(source, target, chunk)
+    raise ValueError(f"Cannot convert {source} audio to any of {accepted}")
+
+
+def _passthrough(chunk):
+    return chunk
@@ -0,0 +1,726 @@
+import time
+import queue
+import asyncio
+import logging
+import threading
+import collections
+import audio_codec
+
+logger = logging.getLogger(__name__)
+
+# Per-segment audio stages between the Stream loop and the recognizer.
+
+
+class FrameAggregator:
+    """Coalesces small media frames into larger recognizer requests.
+
+    Frames are joined until `target_ms` of audio (rounded to whole ptime frames) or
+    `max_bytes` is buffered, or until the oldest buffered frame has waited `max_latency_ms`.
+    Durations are derived from byte counts and the segment's rate and sample width; a
+    target of 0 passes frames through one by one.
+    """
+    def __init__(self, audio_format, target_ms=100, max_bytes=0, max_latency_ms=150):
+        bytes_per_ms = audio_format.get('sample_rate', 8000) * audio_format.get('sample_width', 1) * audio_format.get('channels', 1) / 1000
+        ptime = audio_format.get('ptime') or 20
+        if target_ms > 0:
+            target_ms = max(ptime, target_ms // ptime * ptime)
+        self.target_bytes = int(target_ms * bytes_per_ms)
+        if max_bytes:
+            self.target_bytes = min(self.target_bytes, max_bytes)
+        self.max_latency = max(max_latency_ms, target_ms) / 1000
+        self.messages = 0
+        self.frames = 0
+
+    def batches(self, audio_buffer):
+        """Yield coalesced chunks from a queue until its None end marker"""
+        parts = []
+        size = 0
+        deadline = None
+        while True:
+            try:
+                chunk = audio_buffer.get(timeout=max(0, deadline - time.monotonic()) if parts else None)
+            except queue.Empty:
+                chunk = b''  # Deadline passed, flush what we have
+            if chunk is None:  # End of stream
+                if parts:
+                    yield self._join(parts)
+                return
+            if chunk:
+                if not parts:
+                    deadline = time.monotonic() + self.max_latency
+                parts.append(chunk)
+                size += len(chunk)
+            if parts and (size >= self.target_bytes or time.monotonic() >= deadline):
+                yield self._join(parts)
+                parts = []
+                size = 0
+
+    async def batches_async(self, audio_buffer):
+        """Async variant of batches() for an asyncio.Queue"""
+        parts = []
+        size = 0
+        deadline = None
+        while True:
+            try:
+                if parts:
+                    chunk = await asyncio.wait_for(audio_buffer.get(), max(0, deadline - time.monotonic()))
+                else:
+                    chunk = await audio_buffer.get()
+            except asyncio.TimeoutError:
+                chunk = b''
+            if chunk is None:
+                if parts:
+                    yield self._join(parts)
+                return
+            if chunk:
+                if not parts:
+                    deadline = time.monotonic() + self.max_latency
+                parts.append(chunk)
+                size += len(chunk)
+            if parts and (size >= self.target_bytes or time.monotonic() >= deadline):
+                yield self._join(parts)
+                parts = []
+                size = 0
+
+    def coalesce(self, chunks):
+        """Coalesce a plain iterator of chunks; the deadline is checked as frames arrive"""
+        parts = []
+        size = 0
+        deadline = None
+        for chunk in chunks:
+            if not parts:
+                deadline = time.monotonic() + self.max_latency
+            parts.append(chunk)
+            size += len(chunk)
+            if size >= self.target_bytes or time.monotonic() >= deadline:
+                yield self._join(parts)
+                parts = []
+                size = 0
+        if parts:
+            yield self._join(parts)
+
+    def _join(self, parts):
+        self.messages += 1
+        self.frames += len(parts)
+        return parts[0] if len(parts) == 1 else b''.join(parts)
+
+
+SEQ_MODULUS = 1 << 32  # AudioContent.seq is a uint32
+
+
+class ReorderBuffer:
+    """Restores AudioContent.seq order for one segment within a small window.
+
+    Packets are held in a fixed array of `window` slots indexed by seq modulo the window;
+    a slot remembers its last seq after release so repeats are recognized.
+    The first packets are held for `max_delay_ms`, so the stream starts at the lowest seq
+    seen by then rather than at whichever packet came first. After that, in-order packets
+    are released at once; a packet behind a gap waits until the gap is filled or until the
+    oldest held packet is `max_delay_ms` old, when missing packets are replaced by silence
+    of the packet duration. Repeated and too-late seqs are dropped. Since release is checked
+    as packets arrive, audio is held at most `max_delay_ms` plus one packet time. A sender
+    that does not number its packets, detected by a run of `window` rejected packets, is
+    passed through unchanged, starting with the packets of that run.
+    """
+    def __init__(self, audio_format, window=8, max_delay_ms=60):
+        self.window = window
+        self.max_delay = max_delay_ms / 1000
+        self.encoding = audio_format.get('encoding', 'PCMU')
+        self.sample_rate = audio_format.get('sample_rate', 8000)
+        self.packet_ms = audio_format.get('ptime') or 20
+        self.next_seq = None
+        self.highest_seq = None
+        self.passthrough = False
+        self._seqs = [None] * window
+        self._payloads = [None] * window
+        self._arrivals = [0.0] * window
+        self._held = 0
+        self._started_at = None  # Arrival of the first packet, until the start seq is settled
+        self._rejected = []  # Payloads of the current run of rejected packets
+        self.counters = {'packets': 0, 'reordered': 0, 'duplicates': 0, 'late': 0, 'concealed': 0, 'resyncs': 0}
+
+    def push(self, seq, payload, duration=0):
+        """Accept one packet and return the payloads now ready, in seq order"""
+        self.counters['packets'] += 1
+        if self.passthrough:
+            return [payload]
+        if duration:
+            self.packet_ms = duration
+        now = time.monotonic()
+        if self.next_seq is None:
+            self.next_seq = self.highest_seq = seq
+            self._started_at = now
+        elif self._started_at is not None:
+            # Still settling the start: an earlier seq that fits in the window leads the stream
+            behind = (self.next_seq - seq) % SEQ_MODULUS
+            if 0 < behind < SEQ_MODULUS // 2 and (self.highest_seq - seq) % SEQ_MODULUS < self.window:
+                self.next_seq = seq
+        out = []
+        slot = seq % self.window
+        if self._seqs[slot] == seq:
+            self.counters['duplicates'] += 1
+            return self._reject(payload)
+        offset = (seq - self.next_seq) % SEQ_MODULUS
+        if offset >= SEQ_MODULUS // 2:  # Behind the playout point: its slot was already skipped
+            self.counters['late'] += 1
+            return self._reject(payload)
+        if offset >= self.window:
+            # Ahead of the window: release what is held, then conceal or resync up to seq
+            self._started_at = None
+            self._release_held(out)
+            gap = (seq - self.next_seq) % SEQ_MODULUS
+            if gap < self.window:
+                self._conceal(gap, out)
+            else:
+                self.counters['resyncs'] += 1
+            self.next_seq = self.highest_seq = seq
+        self._rejected.clear()
+        if (self.highest_seq - seq) % SEQ_MODULUS < SEQ_MODULUS // 2 and seq != self.highest_seq:
+            self.counters['reordered'] += 1  # Arrived after a later packet
+        else:
+            self.highest_seq = seq
+        self._seqs[slot] = seq
+        self._payloads[slot] = payload
+        self._arrivals[slot] = now
+        self._held += 1
+        if self._started_at is not None:
+            if now - self._started_at < self.max_delay:
+                return out
+            self._started_at = None
+        self._release_ready(out)
+        while self._held and now - self._oldest_arrival() >= self.max_delay:
+            self._skip_gap(out)
+            self._release_ready(out)
+        return out
+
+    def flush(self):
+        """Release everything still held, concealing gaps, at the end of the segment"""
+        out = []
+        if not self.passthrough:
+            self._release_held(out)
+        return out
+
+    def _reject(self, payload):
+        self._rejected.append(payload)
+        if len(self._rejected) < self.window:
+            return []
+        logger.info("Audio seq numbers are not advancing, passing packets through in arrival order")
+        out = self.flush() + self._rejected
+        self._rejected = []
+        self.passthrough = True
+        return out
+
+    def _release_ready(self, out):
+        while self._held:
+            slot = self.next_seq % self.window
+            if self._seqs[slot] != self.next_seq or self._payloads[slot] is None:
+                return
+            out.append(self._take(slot))
+
+    def _release_held(self, out):
+        while self._held:
+            self._skip_gap(out)
+            self._release_ready(out)
+
+    def _skip_gap(self, out):
+        """Conceal the missing packets before the next held one"""
+        gap = min((seq - self.next_seq) % SEQ_MODULUS
+                  for seq, payload in zip(self._seqs, self._payloads) if payload is not None)
+        self._conceal(gap, out)
+
+    def _conceal(self, packets, out):
+        for _ in range(packets):
+            out.append(audio_codec.silence(self.encoding, self.sample_rate * self.packet_ms // 1000))
+            self.next_seq = (self.next_seq + 1) % SEQ_MODULUS
+        self.counters['concealed'] += packets
+
+    def _take(self, slot):
+        payload = self._payloads[slot]
+        self._payloads[slot] = None
+        self._held -= 1
+        self.next_seq = (self.next_seq + 1) % SEQ_MODULUS
+        return payload
+
+    def _oldest_arrival(self):
+        return min(arrival for payload, arrival in zip(self._payloads, self._arrivals) if payload is not None)
+
+
+VAD_MODES = ('off', 'measure', 'gate', 'compress')
+
+
+class SilenceGate:
+    """Energy-based voice activity detection for one segment, holding back long silences.
+
+    Each payload is decoded and cut into `frame_ms` analysis frames; a frame is speech when
+    its mean absolute level is above `threshold_db` dBFS. A payload with any speech frame is
+    passed on, as is the audio for `hangover_ms` after it, so pauses inside a sentence are
+    kept. Beyond that audio is held back, and the last `preroll_ms` of it is sent ahead of
+    the next speech so onsets aren't clipped. 'measure' passes everything and only counts;
+    'compress' sends one frame of digital silence every `keepalive_ms` of held back audio,
+    so a recognizer that times out idle streams keeps receiving audio. Loud non-speech such
+    as hold music is above any useful threshold and passes as speech. flush() hands over the
+    pre-roll still held at the end of a segment, so the recognizer hears how it ends.
+    """
+    def __init__(self, audio_format, mode='gate', threshold_db=-45.0, hangover_ms=300, preroll_ms=100,
+                 keepalive_ms=1000, frame_ms=10):
+        self.mode = mode
+        self.encoding = audio_format.get('encoding', 'PCMU')
+        channels = audio_format.get('channels', 1)
+        sample_rate = audio_format.get('sample_rate', 8000)
+        self.sample_width = audio_codec.SAMPLE_WIDTH.get(self.encoding, 2)
+        self.bytes_per_second = sample_rate * channels * self.sample_width
+        self.frame_samples = max(sample_rate * frame_ms // 1000, 1) * channels
+        self.threshold = 32768 * 10 ** (threshold_db / 20)
+        self.hangover = hangover_ms / 1000
+        self.preroll = preroll_ms / 1000
+        self.keepalive = keepalive_ms / 1000
+        self.speech_seconds = 0.0
+        self.silence_seconds = 0.0
+        self.sent_seconds = 0.0  # Passed on, including keepalive silence
+        self._hangover_left = 0.0
+        self._held = collections.deque()  # Pre-roll: the latest held back payloads
+        self._held_seconds = 0.0
+        self._since_keepalive = 0.0
+
+    def push(self, payload):
+        """Analyse one payload and return the payloads to pass on now"""
+        seconds = len(payload) / self.bytes_per_second
+        levels = audio_codec.levels(self.encoding, payload, self.frame_samples)
+        speech = sum(level > self.threshold for level in levels)
+        if levels:
+            self.speech_seconds += seconds * speech / len(levels)
+            self.silence_seconds += seconds * (len(levels) - speech) / len(levels)
+        if self.mode == 'measure' or speech or self._hangover_left > 0:
+            self._hangover_left = self.hangover if speech else self._hangover_left - seconds
+            out = list(self._held) + [payload]
+            self.sent_seconds += self._held_seconds + seconds
+            self._held.clear()
+            self._held_seconds = 0.0
+            self._since_keepalive = 0.0
+            return out
+        self._held.append(payload)
+        self._held_seconds += seconds
+        out = []
+        while self._held_seconds > self.preroll:
+            dropped = len(self._held.popleft()) / self.bytes_per_second
+            self._held_seconds -= dropped
+            if self.mode == 'compress':
+                self._since_keepalive += dropped
+                if self._since_keepalive >= self.keepalive:
+                    self._since_keepalive = 0.0
+                    out.append(audio_codec.silence(self.encoding, self.frame_samples))
+                    self.sent_seconds += self.frame_samples * self.sample_width / self.bytes_per_second
+        return out
+
+    def flush(self):
+        """Return the audio still held back, at the end of the segment"""
+        out = list(self._held)
+        self.sent_seconds += self._held_seconds
+        self._held.clear()
+        self._held_seconds = 0.0
+        self._hangover_left = 0.0
+        self._since_keepalive = 0.0
+        return out
+
+    def stats(self):
+        """Seconds of speech, silence and audio passed on so far, and the share of speech"""
+        total = self.speech_seconds + self.silence_seconds
+        return {
+            'speech_seconds': round(self.speech_seconds, 2),
+            'silence_seconds': round(self.silence_seconds, 2),
+            'sent_seconds': round(self.sent_seconds, 2),
+            'speech_ratio': round(self.speech_seconds / total, 3) if total else None,
+        }
+
+
+BUFFER_POLICIES = ('block', 'drop-oldest', 'drop-newest')
+
+
+class AudioBufferBudgetExhausted(RuntimeError):
+    """No memory is left in the pool's budget for another segment buffer"""
+
+
+class AudioRingBuffer:
+    """Bounded FIFO of audio payloads in a ring of `capacity` bytes, grown once up to `max_capacity`.
+
+    Queue-like: put() adds a payload, get(timeout) returns the next one and None once the
+    buffer is closed and drained. The first payload that doesn't fit grows the ring in one
+    step to `max_capacity`, or to what the owning pool's budget grants, so a segment whose
+    recognizer keeps up holds no more than its first allocation and a lagging one is copied
+    at most once. When a payload still doesn't fit, `policy` decides what gives: 'drop-newest' discards it, 'drop-oldest' evicts queued payloads to make room, and
+    'block' waits up to `block_timeout` for the consumer before dropping it. A consumer
+    that let a block time out is treated as stalled and is not waited for again until it
+    reads. put_nowait() never waits, so under 'block' it drops like 'drop-newest'.
+    Every drop is counted in `overflows` and in the owning pool.
+    """
+    def __init__(self, capacity, policy='drop-oldest', block_timeout=1.0, pool=None, max_capacity=None):
+        if policy not in BUFFER_POLICIES:
+            raise ValueError(f"Unknown audio buffer policy: {policy}")
+        self.capacity = capacity
+        self.max_capacity = max(capacity, max_capacity or capacity)
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.pool = pool
+        self.overflows = 0
+        self.dropped_bytes = 0
+        self._ring = bytearray(capacity)
+        self._view = memoryview(self._ring)
+        self._lengths = collections.deque()  # Size of each queued payload, oldest first
+        self._head = 0  # Offset of the oldest queued byte
+        self._size = 0
+        self._closed = False
+        self._stalled = False
+        self.growth_denied = False  # The budget refused to grow the ring at least once
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._lengths)
+
+    @property
+    def buffered_bytes(self):
+        return self._size
+
+    def put(self, payload, block=True):
+        with self._cond:
+            if self._closed or not payload:
+                return
+            if not self._make_room(len(payload), block):
+                self._overflow(len(payload))
+                return
+            self._push(payload)
+            self._cond.notify()
+
+    def put_nowait(self, payload):
+        """Add a payload without waiting for the consumer, or close the buffer when given None"""
+        if payload is None:
+            self.close()
+        else:
+            self.put(payload, block=False)
+
+    def get(self, timeout=None):
+        """Next payload, None once closed and drained; raises queue.Empty on timeout"""
+        with self._cond:
+            if not self._lengths and not self._closed:
+                self._cond.wait_for(lambda: self._lengths or self._closed, timeout)
+            if self._lengths:
+                payload = self._pop()
+                self._cond.notify()
+                return payload
+            if self._closed:
+                return None
+            raise queue.Empty
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def discard(self):
+        """Close the buffer and free its ring, once its consumer has gone; returns the bytes freed"""
+        with self._cond:
+            freed = self._free()
+            self._cond.notify_all()
+        return freed
+
+    def _free(self):
+        freed = self.capacity
+        self._closed = True
+        self._lengths.clear()
+        self._head = self._size = 0
+        self.capacity = 0
+        self._ring = bytearray()
+        self._view = memoryview(self._ring)
+        return freed
+
+    def _fits(self, size):
+        """Whether `size` more bytes fit, growing the ring within the budget when they don't"""
+        needed = self._size + size
+        if needed > self.capacity and self.capacity < self.max_capacity and not self._closed:
+            self._grow(needed)
+        return needed <= self.capacity
+
+    def _grow(self, needed):
+        minimum = min(needed, self.max_capacity) - self.capacity
+        extra = self.max_capacity - self.capacity
+        if self.pool is not None:
+            extra = self.pool.reserve(extra, minimum)
+        if not extra:
+            if not self.growth_denied and self.pool is not None:
+                self.pool.count_growth_denied()
+            self.growth_denied = True
+            return
+        ring = bytearray(self.capacity + extra)
+        end = self._head + self._size
+        if end <= self.capacity:
+            ring[:self._size] = self._view[self._head:end]
+        else:
+            first = self.capacity - self._head
+            ring[:first] = self._view[self._head:]
+            ring[first:self._size] = self._view[:end - self.capacity]
+        self._ring = ring
+        self._view = memoryview(ring)
+        self._head = 0
+        self.capacity += extra
+        self.max_capacity = self.capacity  # Grown once; a partial grant is not topped up later
+
+    def _make_room(self, size, block=True):
+        if size > self.max_capacity:
+            return False
+        if self._fits(size):
+            return True
+        if size > self.capacity:
+            return False
+        if self.policy == 'drop-oldest':
+            while self._size + size > self.capacity:
+                self._overflow(self._lengths[0])
+                self._pop()
+            return True
+        if self.policy == 'block' and block and not self._stalled:
+            if self._cond.wait_for(lambda: self._size + size <= self.capacity or self._closed, self.block_timeout):
+                return not self._closed
+            self._stalled = True
+        return False
+
+    def _push(self, payload):
+        size = len(payload)
+        start = (self._head + self._size) % self.capacity
+        first = min(size, self.capacity - start)
+        self._view[start:start + first] = payload[:first]
+        if first < size:
+            self._view[:size - first] = payload[first:]
+        self._lengths.append(size)
+        self._size += size
+
+    def _pop(self):
+        size = self._lengths.popleft()
+        end = self._head + size
+        if end <= self.capacity:
+            payload = bytes(self._view[self._head:end])
+        else:
+            payload = bytes(self._view[self._head:]) + bytes(self._view[:end - self.capacity])
+        self._head = end % self.capacity
+        self._size -= size
+        self._stalled = False
+        return payload
+
+    def _overflow(self, size):
+        self.overflows += 1
+        self.dropped_bytes += size
+        if self.pool is not None:
+            self.pool.count_overflow(size)
+
+
+class AsyncAudioRingBuffer(AudioRingBuffer):
+    """AudioRingBuffer for a producer and consumer on the same event loop.
+
+    put() and get() are coroutines; put_nowait() and close() can be called from plain code
+    on the loop. No locks are taken since the loop runs one side at a time.
+    """
+    def __init__(self, capacity, policy='drop-oldest', block_timeout=1.0, pool=None, max_capacity=None):
+        super().__init__(capacity, policy, block_timeout, pool, max_capacity)
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+
+    async def put(self, payload):
+        if self._closed or not payload:
+            return
+        size = len(payload)
+        if self.policy == 'block' and not self._stalled and size <= self.max_capacity:
+            while not self._fits(size) and size <= self.capacity and not self._closed:
+                self._writable.clear()
+                try:
+                    await asyncio.wait_for(self._writable.wait(), self.block_timeout)
+                except asyncio.TimeoutError:
+                    self._stalled = True
+                    break
+        self._put(payload)
+
+    def put_nowait(self, payload):
+        if payload is None:
+            self.close()
+        elif not self._closed and payload:
+            self._put(payload)
+
+    async def get(self):
+        """Next payload, None once closed and drained"""
+        while not self._lengths and not self._closed:
+            self._readable.clear()
+            await self._readable.wait()
+        if self._lengths:
+            payload = self._pop()
+            self._writable.set()
+            return payload
+        return None
+
+    def close(self):
+        self._closed = True
+        self._readable.set()
+        self._writable.set()
+
+    def discard(self):
+        freed = self._free()
+        self._readable.set()
+        self._writable.set()
+        return freed
+
+    def _put(self, payload):
+        if self._make_room_nowait(len(payload)):
+            self._push(payload)
+            self._readable.set()
+        else:
+            self._overflow(len(payload))
+
+    def _make_room_nowait(self, size):
+        if size > self.max_capacity:
+            return False
+        if self._fits(size):
+            return True
+        if size > self.capacity:
+            return False
+        if self.policy == 'drop-oldest':
+            while self._size + size > self.capacity:
+                self._overflow(self._lengths[0])
+                self._pop()
+        return self._size + size <= self.capacity
+
+
+class AudioBufferPool:
+    """Creates per-segment audio ring buffers within a process-wide memory budget.
+
+    Each buffer starts with `initial_bytes` and grows once, on demand, to `segment_bytes`, taking
+    memory from `total_bytes`, so the budget counts audio actually waiting and the audio held
+    for transcription stays capped however many segments stall. A segment that can't get its
+    first allocation is refused with AudioBufferBudgetExhausted. Budget is returned by
+    release() once the buffer's consumer has exited.
+    """
+    def __init__(self, segment_bytes=160 * 1024, total_bytes=256 * 1024 * 1024, policy='drop-oldest', block_timeout=1.0,
+                 initial_bytes=16 * 1024):
+        if policy not in BUFFER_POLICIES:
+            raise ValueError(f"Unknown audio buffer policy: {policy}")
+        self.segment_bytes = segment_bytes
+        self.initial_bytes = min(initial_bytes, segment_bytes)
+        self.total_bytes = total_bytes
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self._allocated = 0
+        self._lock = threading.Lock()
+        self._counters = {'buffers': 0, 'rejected': 0, 'short_buffers': 0, 'overflows': 0, 'dropped_bytes': 0}
+
+    def create(self, use_async=False):
+        """New buffer for a segment; raises AudioBufferBudgetExhausted when the budget is used up"""
+        capacity = self.reserve(self.initial_bytes, 1)
+        with self._lock:
+            self._counters['buffers' if capacity else 'rejected'] += 1
+        if not capacity:
+            raise AudioBufferBudgetExhausted(f"Audio buffer budget of {self.total_bytes} bytes exhausted")
+        buffer_class = AsyncAudioRingBuffer if use_async else AudioRingBuffer
+        return buffer_class(capacity, self.policy, self.block_timeout, pool=self, max_capacity=self.segment_bytes)
+
+    def reserve(self, size, minimum):
+        """Take up to `size` bytes of budget, at least `minimum`; returns the bytes granted, 0 when refused"""
+        with self._lock:
+            granted = min(size, self.total_bytes - self._allocated)
+            if granted < max(minimum, 1):
+                return 0
+            self._allocated += granted
+            return granted
+
+    def release(self, audio_buffer):
+        """Free a buffer and return its memory to the budget, once nothing reads it any more"""
+        freed = audio_buffer.discard()
+        with self._lock:
+            self._allocated -= freed
+
+    def count_growth_denied(self):
+        with self._lock:
+            self._counters['short_buffers'] += 1
+
+    def count_overflow(self, size):
+        with self._lock:
+            self._counters['overflows'] += 1
+            self._counters['dropped_bytes'] += size
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['allocated_bytes'] = self._allocated
+        return stats
+
+
+class AudioBroadcaster:
+    """Single-writer, many-reader window of a segment's latest audio, for live listeners.
+
+    The writer only keeps the payloads as written. Each chunk is decoded to 16-bit linear PCM
+    by the first reader that reaches it, outside the lock, and the decoded chunk is cached for
+    the other readers; every reader keeps its own position in the decoded stream and is handed
+    the shared chunks it has not seen yet, without copying them. Readers never hold the writer
+    up: chunks are dropped oldest first once their decoded size adds up to more than
+    `capacity` bytes, and a reader that fell behind them skips ahead to the oldest chunk still
+    kept, with the skipped bytes counted in `skipped_bytes`. Nothing is kept while nobody
+    listens, and nothing is decoded that nobody reads.
+    """
+    def __init__(self, capacity=64 * 1024, encoding='L16'):
+        self.capacity = capacity
+        self.encoding = encoding  # Of the written payloads; reads are always linear PCM
+        self.listeners = 0
+        self.skipped_bytes = 0
+        self._scale = 2 if encoding in audio_codec.DECODE_TABLES else 1  # Decoded bytes per written byte
+        self._chunks = collections.deque()  # [stream position, payload, decoded bytes or None], oldest first
+        self._kept = 0  # Bytes in _chunks
+        self._written = 0  # Stream position of the next byte written
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def subscribe(self):
+        """Register a listener; returns its starting position, the live edge"""
+        with self._cond:
+            self.listeners += 1
+            return self._written
+
+    def unsubscribe(self):
+        with self._cond:
+            self.listeners -= 1
+
+    def write(self, payload):
+        if not self.listeners or not payload:
+            return
+        size = len(payload) * self._scale
+        with self._cond:
+            if self._closed:
+                return
+            self._chunks.append([self._written, payload, None])
+            self._written += size
+            self._kept += size
+            while self._kept > self.capacity and len(self._chunks) > 1:
+                self._kept -= len(self._chunks.popleft()[1]) * self._scale
+            self._cond.notify_all()
+
+    def read(self, position, timeout=None):
+        """(decoded chunks after `position`, next position); [] on timeout and None once closed"""
+        with self._cond:
+            if position >= self._written and not self._closed:
+                self._cond.wait(timeout)
+            written = self._written
+            if position >= written:
+                return (None if self._closed else []), position
+            entries = []
+            for entry in reversed(self._chunks):  # Readers are usually near the live edge
+                if entry[0] < position:
+                    break
+                entries.append(entry)
+            entries.reverse()
+            oldest = entries[0][0]
+            if oldest > position:
+                self.skipped_bytes += oldest - position
+        return [self._decoded(entry) for entry in entries], written
+
+    def _decoded(self, entry):
+        decoded = entry[2]
+        if decoded is None:  # Two readers may race to decode a chunk; both get the same bytes
+            decoded = entry[2] = audio_codec.decode(self.encoding, entry[1])
+        return decoded
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
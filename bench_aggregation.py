@@ -0,0 +1,58 @@
+import time
+import queue
+import argparse
+from audio_pipeline import FrameAggregator
+from bench_storage import synthesize_chunks
+
+try:
+    from google.cloud import speech
+except ImportError:  # Requests are only counted, not serialized
+    speech = None
+
+# Frame aggregation benchmark: pushes the same telephony audio through FrameAggregator at
+# several coalescing windows and reports recognizer requests per audio second and the CPU
+# spent building and serializing them per audio minute.
+#
+#   python bench_aggregation.py --minutes 2 --windows 0 20 40 100 200 500
+
+
+def run_window(window_ms, chunks, audio_format, minutes):
+    audio_buffer = queue.Queue()
+    for chunk in chunks:
+        audio_buffer.put(chunk)
+    audio_buffer.put(None)
+    aggregator = FrameAggregator(audio_format, target_ms=window_ms, max_latency_ms=max(window_ms, 1000))
+    start = time.process_time()
+    wire_bytes = 0
+    for batch in aggregator.batches(audio_buffer):
+        if speech is not None:
+            wire_bytes += len(speech.StreamingRecognizeRequest.serialize(speech.StreamingRecognizeRequest(audio_content=batch)))
+        else:
+            wire_bytes += len(batch)
+    cpu = time.process_time() - start
+    seconds = minutes * 60
+    print(f"{window_ms:>6}  {aggregator.messages / seconds:>10.1f}  {wire_bytes / seconds / 1024:>10.2f}  {cpu / minutes * 1000:>12.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Frame aggregation benchmark")
+    parser.add_argument('--minutes', type=int, default=2, help="Minutes of audio to send")
+    parser.add_argument('--codec', type=str, default='PCMU', choices=['PCMU', 'PCMA', 'L16'], help="Incoming codec")
+    parser.add_argument('--rate', type=int, default=8000, help="Sample rate in Hz")
+    parser.add_argument('--ptime', type=int, default=20, help="Audio chunk size in msec")
+    parser.add_argument('--windows', type=int, nargs='+', default=[0, 20, 40, 100, 200, 500],
+                        help="Aggregation windows in msec to compare (0 sends every frame)")
+    args = parser.parse_args()
+
+    chunks = synthesize_chunks(args.codec, args.rate, args.ptime, args.minutes)
+    audio_format = {'encoding': args.codec, 'sample_rate': args.rate, 'ptime': args.ptime,
+                    'sample_width': 2 if args.codec == 'L16' else 1, 'channels': 1}
+    print(f"{args.minutes} min of {args.codec} at {args.rate}Hz in {args.ptime}ms chunks"
+          f"{'' if speech else ' (google-cloud-speech not installed, payload bytes only)'}")
+    print(f"{'window':>6}  {'req/s':>10}  {'KiB/s':>10}  {'CPU ms/min':>12}")
+    for window_ms in args.windows:
+        run_window(window_ms, chunks, audio_format, args.minutes)
+
+
+if __name__ == '__main__':
+    main()
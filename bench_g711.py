@@ -0,0 +1,83 @@
+import os
+import time
+import argparse
+import warnings
+import audio_codec
+
+with warnings.catch_warnings():
+    warnings.simplefilter('ignore', DeprecationWarning)
+    try:
+        import audioop  # Removed in Python 3.13, compared against when still available
+    except ImportError:
+        audioop = None
+
+# G.711 decoder micro-benchmark: audioop against the table-driven decoders in audio_codec,
+# one 20 ms chunk per call and batches of chunks per call. Throughput is reported in MB of
+# G.711 input per second and in real-time 8 kHz channels one core can decode.
+#
+#   python bench_g711.py --codec PCMU --seconds 2
+
+
+def measure(decode, chunks, batch, seconds):
+    """Decode chunks `batch` at a time for about `seconds`; return input bytes per CPU second"""
+    batches = [chunks[i:i + batch] for i in range(0, len(chunks), batch)]
+    decoded = 0
+    start = time.process_time()
+    while time.process_time() - start < seconds:
+        for group in batches:
+            decoded += len(decode(group))
+    elapsed = time.process_time() - start
+    return decoded / 2 / elapsed  # Output is 2 bytes per input byte
+
+
+def main():
+    parser = argparse.ArgumentParser(description="G.711 decoder micro-benchmark")
+    parser.add_argument('--codec', type=str, default='PCMU', choices=list(audio_codec.G711_ENCODINGS))
+    parser.add_argument('--chunk_bytes', type=int, default=160, help="Bytes per chunk (160 = 20 ms at 8 kHz)")
+    parser.add_argument('--batch', type=int, default=50, help="Chunks per call for the batched runs")
+    parser.add_argument('--seconds', type=float, default=2.0, help="CPU seconds per measurement")
+    args = parser.parse_args()
+
+    chunks = [os.urandom(args.chunk_bytes) for _ in range(1000)]
+    codec = args.codec
+    numpy = audio_codec.numpy
+
+    decoders = {}
+    if audioop is not None:
+        to_linear = audioop.ulaw2lin if codec == 'PCMU' else audioop.alaw2lin
+        decoders['audioop'] = lambda group: b''.join(to_linear(chunk, 2) for chunk in group)
+        decoders['audioop batched'] = lambda group: to_linear(b''.join(group), 2)
+
+    def translate(group):
+        audio_codec.numpy = None
+        try:
+            return b''.join(audio_codec.decode(codec, chunk) for chunk in group)
+        finally:
+            audio_codec.numpy = numpy
+
+    def translate_batched(group):
+        audio_codec.numpy = None
+        try:
+            return audio_codec.decode_many(codec, group)
+        finally:
+            audio_codec.numpy = numpy
+
+    decoders['translate'] = translate
+    decoders['translate batched'] = translate_batched
+    if numpy is not None:
+        table = audio_codec.NUMPY_DECODE_TABLES[codec]
+        decoders['numpy take'] = lambda group: b''.join(
+            table.take(numpy.frombuffer(chunk, dtype=numpy.uint8)).tobytes() for chunk in group)
+        decoders['numpy take batched'] = lambda group: table.take(
+            numpy.frombuffer(b''.join(group), dtype=numpy.uint8)).tobytes()
+
+    print(f"{codec}, {args.chunk_bytes}-byte chunks, batches of {args.batch}")
+    print(f"{'decoder':>20}  {'MB/s':>8}  {'channels/core':>14}")
+    for name, decode in decoders.items():
+        batch = args.batch if name.endswith('batched') else 1
+        rate = measure(decode, chunks, batch, args.seconds)
+        print(f"{name:>20}  {rate / 1e6:>8.1f}  {rate / 8000:>14,.0f}")
+
+
+if __name__ == '__main__':
+    main()
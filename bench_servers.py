@@ -0,0 +1,86 @@
+import os
+import sys
+import grpc
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import load_test
+
+# Server comparison benchmark: starts each Streaming server in the repository on a local
+# port with the fake recognizer, runs the same load_test steps against it and prints one
+# table per server, with the server's CPU and peak RSS per step.
+#
+#   python bench_servers.py --dialogs 10 50 100 --duration 5
+#   python bench_servers.py --servers file file-async --dialogs 200 --speed 0
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVERS = ('simple', 'transcribe', 'file', 'file-async')
+
+
+def server_command(name, port, workers=1):
+    """argv and extra environment to run a server on `port` with `workers` processes"""
+    if name == 'simple':
+        return [sys.executable, os.path.join(HERE, 'simple_server.py')], {'PORT': str(port), 'METRICS_PORT': str(port + 1),
+                                                                         'WORKERS': str(workers)}
+    if name == 'transcribe':
+        return [sys.executable, os.path.join(HERE, 'transcribe_server.py')], {'PORT': str(port), 'METRICS_PORT': str(port + 1),
+                                                                             'RECOGNIZER': 'fake', 'WORKERS': str(workers)}
+    argv = [sys.executable, os.path.join(HERE, 'file_server.py'), '--recognizer', 'fake', '--log_level', 'WARNING',
+            '--grpc_port', str(port), '--http_port', str(port + 1), '--workers', str(workers)]
+    if name == 'file-async':
+        argv.append('--async')
+    return argv, {}
+
+
+def start_server(name, port, workdir, timeout=15, workers=1):
+    argv, env = server_command(name, port, workers)
+    process = subprocess.Popen(argv, cwd=workdir, env=dict(os.environ, **env),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    with grpc.insecure_channel(f'127.0.0.1:{port}') as channel:
+        try:
+            grpc.channel_ready_future(channel).result(timeout=timeout)
+        except grpc.FutureTimeoutError:
+            process.kill()
+            raise RuntimeError(f"{name} server did not start listening on port {port}")
+    if workers > 1:
+        # The first worker to bind answers the probe; give the others time to start too
+        deadline = time.monotonic() + timeout
+        while len(load_test.ProcessSampler(process.pid).pids()) <= workers and time.monotonic() < deadline:
+            time.sleep(0.2)
+        time.sleep(2)
+    return process
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the Streaming servers under the same load")
+    parser.add_argument('--servers', nargs='+', default=list(SERVERS), choices=SERVERS, help="Servers to benchmark")
+    parser.add_argument('--port', type=int, default=50151, help="gRPC port for the server under test")
+    args, load_args = parser.parse_known_args()
+    options = load_test.parse_args(load_args)
+    load_test.prepare(options)
+
+    for name in args.servers:
+        # Recordings and logs of the file server go to a scratch directory
+        with tempfile.TemporaryDirectory() as workdir:
+            process = start_server(name, args.port, workdir)
+            try:
+                options.target = f'127.0.0.1:{args.port}'
+                load_test.logger.info("%s server (pid %d)", name, process.pid)
+                asyncio.run(load_test.run_load_test(options, load_test.ProcessSampler(process.pid)))
+            finally:
+                stop_server(process)
+        time.sleep(0.5)  # Let the port be released before the next server binds it
+
+
+if __name__ == '__main__':
+    main()
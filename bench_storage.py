@@ -0,0 +1,67 @@
+import os
+import math
+import time
+import random
+import argparse
+import tempfile
+import audio_codec
+from recording import STORAGE_FORMATS, open_recorder
+
+# Storage format benchmark: records the same synthetic telephony audio with every storage
+# format and reports bytes written and CPU seconds per recorded minute.
+#
+#   python bench_storage.py --minutes 5 --codec PCMU
+
+
+def synthesize_chunks(codec, rate, ptime, minutes):
+    """Speech-like test signal (modulated tones plus noise and pauses) as encoded ptime chunks"""
+    rng = random.Random(0)
+    samples_per_chunk = rate * ptime // 1000
+    chunks = []
+    t = 0
+    for i in range(minutes * 60 * 1000 // ptime):
+        talking = (i // 50) % 3 != 2  # 2 s of talk, 1 s of pause
+        frame = bytearray()
+        for _ in range(samples_per_chunk):
+            value = rng.randint(-200, 200)
+            if talking:
+                value += int(6000 * math.sin(2 * math.pi * 220 * t / rate) * (0.6 + 0.4 * math.sin(2 * math.pi * 3 * t / rate)))
+            frame += value.to_bytes(2, 'little', signed=True)
+            t += 1
+        chunks.append(audio_codec.encode(codec, bytes(frame)))
+    return chunks
+
+
+def run_format(storage_format, chunks, audio_format, minutes, directory):
+    start = time.process_time()
+    recorder = open_recorder(os.path.join(directory, f'bench_{storage_format}'), audio_format, storage_format)
+    for chunk in chunks:
+        recorder.write(chunk)
+    recorder.close()
+    cpu = time.process_time() - start
+    size = os.path.getsize(recorder.path)
+    print(f"{storage_format:>8}  {size / minutes / 1024:>10.1f}  {cpu / minutes * 1000:>12.2f}  {os.path.basename(recorder.path)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recording storage format benchmark")
+    parser.add_argument('--minutes', type=int, default=5, help="Minutes of audio to record")
+    parser.add_argument('--codec', type=str, default='PCMU', choices=['PCMU', 'PCMA', 'L16'], help="Incoming codec")
+    parser.add_argument('--rate', type=int, default=8000, help="Sample rate in Hz")
+    parser.add_argument('--ptime', type=int, default=20, help="Audio chunk size in msec")
+    args = parser.parse_args()
+
+    chunks = synthesize_chunks(args.codec, args.rate, args.ptime, args.minutes)
+    audio_format = {'encoding': args.codec, 'sample_rate': args.rate, 'channels': 1}
+    print(f"{args.minutes} min of {args.codec} at {args.rate}Hz in {args.ptime}ms chunks")
+    print(f"{'format':>8}  {'KiB/min':>10}  {'CPU ms/min':>12}  file")
+    with tempfile.TemporaryDirectory() as directory:
+        for storage_format in STORAGE_FORMATS:
+            try:
+                run_format(storage_format, chunks, audio_format, args.minutes, directory)
+            except RuntimeError as e:
+                print(f"{storage_format:>8}  skipped: {e}")
+
+
+if __name__ == '__main__':
+    main()
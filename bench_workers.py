@@ -0,0 +1,84 @@
+import os
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+import multiprocessing
+import load_test
+import bench_servers
+
+# Multi-process scaling benchmark: runs a server with 1, 2, 4... worker processes on one
+# port and drives each from as many load_test client processes, each with its own
+# connections, so neither side is limited to one core. Prints the combined throughput per
+# worker count and the speedup over one worker; with enough cores for server and clients it
+# should grow close to linearly until the cores run out.
+#
+#   python bench_workers.py --workers 1 2 4 --dialogs_per_worker 50 --duration 5 --speed 0
+#   python bench_workers.py --server simple --workers 1 2 4 8 --clients 4 --dialogs_per_worker 100 --speed 0
+
+
+def run_client(options):
+    """One load_test client process; returns its report row"""
+    load_test.logger.setLevel(logging.WARNING)  # Only the combined table is printed
+    load_test.prepare(options)
+    return asyncio.run(load_test.run_load_test(options))[0]
+
+
+def run_clients(options, dialogs, clients):
+    """Split `dialogs` over `clients` processes started together and combine their rows"""
+    shares = [dialogs // clients + (1 if i < dialogs % clients else 0) for i in range(clients)]
+    client_options = []
+    for share in shares:
+        client = argparse.Namespace(**vars(options))
+        client.dialogs = [share]
+        client_options.append(client)
+    with multiprocessing.get_context('spawn').Pool(clients) as pool:
+        rows = pool.map(run_client, [client for client in client_options if client.dialogs[0]])
+    return {
+        'dialogs': dialogs,
+        'completed': sum(row['completed'] for row in rows),
+        'failed': sum(row['failed'] for row in rows),
+        'wall_time': max(row['wall_time'] for row in rows),
+        'events_per_second': sum(row['events_per_second'] for row in rows),
+        'audio_seconds': sum(row['audio_seconds'] for row in rows),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how a server scales with worker processes")
+    parser.add_argument('--server', default='file', choices=bench_servers.SERVERS, help="Server to benchmark")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help="Worker counts to compare")
+    parser.add_argument('--dialogs_per_worker', type=int, default=50, help="Concurrent dialogs per server worker")
+    parser.add_argument('--clients', type=int, default=0,
+                        help="Load generator processes (default: one per server worker)")
+    parser.add_argument('--port', type=int, default=50161, help="gRPC port for the server under test")
+    args, load_args = parser.parse_known_args()
+    options = load_test.parse_args(load_args)
+    options.target = f'127.0.0.1:{args.port}'
+
+    load_test.logger.info("%d CPUs", os.cpu_count())
+    load_test.logger.info("%7s %7s %5s %6s %7s %9s %8s %8s %10s",
+                          'workers', 'dialogs', 'ok', 'failed', 'wall s', 'events/s', 'audio x', 'speedup', 'efficiency')
+    baseline = None
+    for workers in args.workers:
+        clients = args.clients or workers
+        options.channels = max(options.channels, workers * 2)  # Enough connections to reach every worker
+        dialogs = args.dialogs_per_worker * workers
+        with tempfile.TemporaryDirectory() as workdir:
+            process = bench_servers.start_server(args.server, args.port, workdir, workers=workers)
+            try:
+                row = run_clients(options, dialogs, clients)
+            finally:
+                bench_servers.stop_server(process)
+        baseline = baseline or row['events_per_second'] / workers
+        speedup = row['events_per_second'] / baseline
+        load_test.logger.info("%7d %7d %5d %6d %7.1f %9.0f %8.1f %8.2f %9.0f%%",
+                              workers, row['dialogs'], row['completed'], row['failed'], row['wall_time'],
+                              row['events_per_second'], row['audio_seconds'] / row['wall_time'], speedup,
+                              speedup / workers * 100)
+        time.sleep(0.5)  # Let the port be released before the next run binds it
+
+
+if __name__ == '__main__':
+    main()
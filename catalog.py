@@ -0,0 +1,287 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+import contextlib
+
+logger = logging.getLogger(__name__)
+
+# Index of sessions, segments and recorded files under the output folder.
+#
+# The gRPC side records sessions and segments as they start and stop, so the HTTP listing
+# routes answer from SQLite instead of walking the output folder on every request. The
+# database lives next to the recordings; rebuild() reconciles it with what is on disk at
+# startup, picking up files written while the server was down and dropping deleted ones.
+# Several server processes can share one catalog: each opens its own connection, and the
+# listing version lives in the database so every process sees changes made by the others.
+# The database and its WAL files are dot-files, which the HTTP file routes never serve.
+
+DB_NAME = '.catalog.sqlite3'
+AUDIO_KINDS = ('wav', 'flac')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    dialog_id TEXT,
+    created_at REAL
+);
+CREATE INDEX IF NOT EXISTS sessions_created ON sessions (created_at);
+CREATE TABLE IF NOT EXISTS segments (
+    session_id TEXT,
+    segment_id TEXT,
+    participant_type TEXT,
+    participant_id TEXT,
+    codec TEXT,
+    sample_rate INTEGER,
+    started_at REAL,
+    stopped_at REAL,
+    speech_seconds REAL,    -- voice activity, when the segment's audio was analysed
+    silence_seconds REAL,
+    PRIMARY KEY (session_id, segment_id)
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,  -- relative to the output folder
+    session_id TEXT,
+    segment_id TEXT,
+    kind TEXT,              -- wav, flac, bin or log
+    size INTEGER,
+    modified_at REAL
+);
+CREATE INDEX IF NOT EXISTS files_session ON files (session_id);
+CREATE TABLE IF NOT EXISTS meta (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    version INTEGER,        -- bumped whenever the listed files change
+    updated_at REAL
+);
+INSERT OR IGNORE INTO meta VALUES (0, 0, 0);
+"""
+# Columns added since the first schema, for catalogs created before them
+ADDED_COLUMNS = (('segments', 'speech_seconds', 'REAL'), ('segments', 'silence_seconds', 'REAL'))
+
+
+def file_kind(name):
+    """Catalog kind of a file name, or None for files that aren't listed"""
+    if name == 'session.log':
+        return 'log'
+    extension = name.rsplit('.', 1)[-1] if '.' in name else ''
+    return extension if extension in AUDIO_KINDS or extension == 'bin' else None
+
+
+def parse_file_path(relative_path):
+    """(session_id, segment_id) of a file under the output folder, from its name"""
+    parts = relative_path.split(os.sep)
+    name = parts[-1]
+    if len(parts) > 1:
+        return parts[-2], None  # Files organized in session directories
+    stem = name.rsplit('.', 1)[0]
+    if '_' in stem:
+        session_id, segment_id = stem.split('_', 1)
+        return session_id, segment_id
+    return None, None
+
+
+class RecordingsCatalog:
+    """SQLite-backed catalog shared by the gRPC and HTTP threads through one connection per process"""
+    def __init__(self, output_folder, db_path=None):
+        self.output_folder = output_folder
+        os.makedirs(output_folder, exist_ok=True)
+        self.db_path = db_path or os.path.join(output_folder, DB_NAME)
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')  # No fsync per commit; the disk is the source of truth
+        self._db.executescript(SCHEMA)
+        self._migrate()
+        self._lock = threading.Lock()
+
+    def listing_version(self):
+        """(version, time) of the last change to the listed files, made by any process; for cache validation"""
+        with self._lock:
+            return self._db.execute("SELECT version, updated_at FROM meta").fetchone()
+
+    def relative_path(self, path):
+        return os.path.relpath(path, self.output_folder)
+
+    def add_session(self, session_id, dialog_id):
+        # Sessions are only listed once they have files, so this doesn't invalidate listings
+        with self._lock:
+            self._db.execute("INSERT INTO sessions (session_id, dialog_id, created_at) VALUES (?, ?, ?) "
+                             "ON CONFLICT (session_id) DO UPDATE SET dialog_id = excluded.dialog_id",
+                             (session_id, dialog_id, time.time()))
+
+    def add_segment(self, session_id, segment_id, participant_type, participant_id, audio_format, path=None):
+        """Record a started segment and, when it is being recorded, its file"""
+        now = time.time()
+        with self._lock, self._transaction():
+            self._db.execute("INSERT OR IGNORE INTO sessions (session_id, created_at) VALUES (?, ?)", (session_id, now))
+            self._db.execute("INSERT OR REPLACE INTO segments (session_id, segment_id, participant_type, participant_id, "
+                             "codec, sample_rate, started_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (session_id, segment_id, participant_type, participant_id,
+                              audio_format.get('encoding'), audio_format.get('sample_rate'), now))
+            if path:
+                self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, 0, ?)",
+                                 (self.relative_path(path), session_id, segment_id, file_kind(os.path.basename(path)), now))
+                self._changed()
+
+    def finish_segment(self, session_id, segment_id, path=None, speech_seconds=None, silence_seconds=None):
+        """Mark a segment stopped and record the final size of its file and its voice activity"""
+        with self._lock, self._transaction():
+            self._db.execute("UPDATE segments SET stopped_at = ?, speech_seconds = ?, silence_seconds = ? "
+                             "WHERE session_id = ? AND segment_id = ?",
+                             (time.time(), speech_seconds, silence_seconds, session_id, segment_id))
+            if path:
+                self._upsert_file(path, session_id, segment_id)
+                self._changed()
+
+    def update_file(self, path, session_id, segment_id=None):
+        """Add or refresh one file from its current size on disk"""
+        with self._lock:
+            self._upsert_file(path, session_id, segment_id)
+            if file_kind(os.path.basename(path)) != 'log':
+                self._changed()
+
+    def sessions(self, limit=50, cursor=None, **filters):
+        """One page of sessions with recordings, newest first.
+
+        Returns ([{'session_id', 'dialog_id', 'created_at', 'wav_files', 'bin_files'}], next
+        cursor or None), file paths relative to the output folder. Filters are described in
+        _filter_clause().
+        """
+        where, params = self._filter_clause(filters)
+        where.append("EXISTS (SELECT 1 FROM files f WHERE f.session_id = s.session_id AND f.kind != 'log')")
+        if cursor:
+            created_at, session_id = cursor
+            where.append("(s.created_at < ? OR (s.created_at = ? AND s.session_id < ?))")
+            params += [created_at, created_at, session_id]
+        sql = (f"SELECT s.session_id, s.dialog_id, s.created_at FROM sessions s WHERE {' AND '.join(where)} "
+               "ORDER BY s.created_at DESC, s.session_id DESC LIMIT ?")
+        with self._lock:
+            rows = self._db.execute(sql, params + [limit + 1]).fetchall()
+            page = rows[:limit]
+            ids = [row[0] for row in page]
+            files = self._db.execute(
+                f"SELECT session_id, path, kind FROM files WHERE kind != 'log' AND session_id IN ({','.join('?' * len(ids))}) "
+                "ORDER BY path", ids).fetchall() if ids else []
+        sessions = {session_id: {'session_id': session_id, 'dialog_id': dialog_id, 'created_at': created_at,
+                                 'wav_files': [], 'bin_files': []}
+                    for session_id, dialog_id, created_at in page}
+        for session_id, path, kind in files:
+            sessions[session_id]['bin_files' if kind == 'bin' else 'wav_files'].append(path)
+        next_cursor = (page[-1][2], page[-1][0]) if len(rows) > limit else None
+        return list(sessions.values()), next_cursor
+
+    def files(self, kinds=AUDIO_KINDS, limit=None, cursor=None, **filters):
+        """Relative paths of files of the given kinds in path order, and the next cursor"""
+        where, params = self._filter_clause(filters)
+        where.append(f"f.kind IN ({','.join('?' * len(kinds))})")
+        params += list(kinds)
+        if cursor:
+            where.append("f.path > ?")
+            params.append(cursor)
+        sql = (f"SELECT f.path FROM files f LEFT JOIN sessions s ON s.session_id = f.session_id "
+               f"WHERE {' AND '.join(where)} ORDER BY f.path")
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit + 1)
+        with self._lock:
+            paths = [row[0] for row in self._db.execute(sql, params)]
+        if limit and len(paths) > limit:
+            return paths[:limit], paths[limit - 1]
+        return paths, None
+
+    def _filter_clause(self, filters):
+        """SQL conditions on sessions `s` for the listing filters:
+        session_id, dialog_id, participant_type (of any segment), since and until (epoch seconds)"""
+        where = ['1']
+        params = []
+        if filters.get('session_id'):
+            where.append("s.session_id = ?")
+            params.append(filters['session_id'])
+        if filters.get('dialog_id'):
+            where.append("s.dialog_id = ?")
+            params.append(filters['dialog_id'])
+        if filters.get('since') is not None:
+            where.append("s.created_at >= ?")
+            params.append(filters['since'])
+        if filters.get('until') is not None:
+            where.append("s.created_at < ?")
+            params.append(filters['until'])
+        if filters.get('participant_type'):
+            where.append("EXISTS (SELECT 1 FROM segments g WHERE g.session_id = s.session_id AND g.participant_type = ?)")
+            params.append(filters['participant_type'])
+        return where, params
+
+    def rebuild(self):
+        """Reconcile the catalog with the output folder; returns (added or updated, removed)"""
+        start = time.monotonic()
+        with self._lock:
+            known = {path: (size, modified_at) for path, size, modified_at in
+                     self._db.execute("SELECT path, size, modified_at FROM files")}
+        changed = []
+        seen = set()
+        for root, dirs, names in os.walk(self.output_folder):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for name in names:
+                kind = file_kind(name)
+                if kind is None:
+                    continue
+                path = os.path.join(root, name)
+                relative_path = self.relative_path(path)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                seen.add(relative_path)
+                if known.get(relative_path) != (stat.st_size, stat.st_mtime):
+                    session_id, segment_id = parse_file_path(relative_path)
+                    changed.append((relative_path, session_id, segment_id, kind, stat.st_size, stat.st_mtime))
+        # Only rows that existed before the walk can be stale; newer ones belong to live segments
+        removed = [(path,) for path in known if path not in seen]
+        with self._lock, self._transaction():
+            self._db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)", changed)
+            self._db.executemany("DELETE FROM files WHERE path = ?", removed)
+            # Sessions only known from disk are dated by their oldest file
+            self._db.execute(
+                "INSERT OR IGNORE INTO sessions (session_id, created_at) "
+                "SELECT session_id, MIN(modified_at) FROM files WHERE session_id IS NOT NULL GROUP BY session_id")
+            if changed or removed:
+                self._changed()
+        logger.info("Catalog rebuilt in %.2fs: %d files, %d added or updated, %d removed",
+                    time.monotonic() - start, len(seen), len(changed), len(removed))
+        return len(changed), len(removed)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT around the block, rolled back if it or the commit fails; hold the lock"""
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+            self._db.execute('COMMIT')
+        except BaseException:
+            if self._db.in_transaction:
+                self._db.execute('ROLLBACK')
+            raise
+
+    def _migrate(self):
+        for table, column, column_type in ADDED_COLUMNS:
+            if column not in {row[1] for row in self._db.execute(f"PRAGMA table_info({table})")}:
+                try:
+                    self._db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+                except sqlite3.OperationalError:
+                    pass  # Added by another process in the meantime
+
+    def _upsert_file(self, path, session_id, segment_id):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                         (self.relative_path(path), session_id, segment_id, file_kind(os.path.basename(path)),
+                          stat.st_size, stat.st_mtime))
+
+    def _changed(self):
+        self._db.execute("UPDATE meta SET version = version + 1, updated_at = ?", (time.time(),))
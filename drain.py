@@ -0,0 +1,93 @@
+import signal
+import asyncio
+import logging
+import threading
+import contextlib
+
+logger = logging.getLogger(__name__)
+
+# Graceful drain shared by the servers. On SIGINT or SIGTERM the gRPC server stops accepting
+# calls, active dialogs get a budget of seconds to end on their own, and whatever is still
+# running after that is cancelled. Handlers treat a cancelled request stream as the end of
+# the call, so recordings and recognizer streams are still finished and flushed. A second
+# signal while draining falls back to the previous handler and stops the process at once.
+# Signals the process ignores stay ignored, e.g. SIGINT in worker processes.
+
+DRAIN_SIGNALS = (signal.SIGINT, signal.SIGTERM)
+
+
+class StreamTracker:
+    """Stream calls in progress, and how many ended before their client finished them"""
+    def __init__(self):
+        self.active = 0
+        self.cut_off = 0
+        self._cond = threading.Condition()
+
+    @contextlib.contextmanager
+    def track(self):
+        with self._cond:
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.active -= 1
+                self._cond.notify_all()
+
+    def count_cut_off(self):
+        with self._cond:
+            self.cut_off += 1
+
+    def wait_idle(self, timeout):
+        """Wait up to `timeout` for every call to return; True if none is left"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self.active, timeout)
+
+
+def wait_for_signal(signals=DRAIN_SIGNALS):
+    """Block the main thread until one of `signals` arrives; returns its name"""
+    received = []
+    stop = threading.Event()
+
+    def handler(signum, frame):
+        received.append(signum)
+        stop.set()
+
+    previous = {signum: signal.signal(signum, handler) for signum in _handled(signals)}
+    try:
+        while not stop.wait(1.0):
+            pass
+    finally:
+        for signum, old_handler in previous.items():
+            signal.signal(signum, old_handler)
+    return signal.Signals(received[0]).name
+
+
+async def wait_for_signal_async(signals=DRAIN_SIGNALS):
+    """wait_for_signal() for a coroutine on the main thread's event loop"""
+    loop = asyncio.get_running_loop()
+    received = loop.create_future()
+    signals = _handled(signals)
+    for signum in signals:
+        loop.add_signal_handler(signum, lambda signum=signum: received.done() or received.set_result(signum))
+    try:
+        return signal.Signals(await received).name
+    finally:
+        for signum in signals:
+            loop.remove_signal_handler(signum)
+
+
+def stop_server(server, timeout):
+    """Refuse new calls and cancel the active ones after `timeout` seconds; returns once the server stopped"""
+    logger.info("Draining: refusing new calls, active ones have %ss to end", timeout)
+    server.stop(grace=timeout).wait()
+
+
+async def stop_server_async(server, timeout):
+    """stop_server() for a grpc.aio server"""
+    logger.info("Draining: refusing new calls, active ones have %ss to end", timeout)
+    await server.stop(timeout)
+
+
+def _handled(signals):
+    return [signum for signum in signals if signal.getsignal(signum) is not signal.SIG_IGN]
@@ -1,26 +1,90 @@
 import os
 import grpc
+import asyncio
 import logging
 import argparse
+import signal
 import ringcx_streaming_pb2_grpc
 import threading
-import wave
 from pathlib import Path
 from concurrent import futures
 from google.protobuf.empty_pb2 import Empty
-from flask import Flask, send_file, Response, render_template_string, jsonify
+from flask import Flask, send_from_directory, Response, render_template_string, jsonify, request, abort, url_for
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
+from werkzeug.wsgi import LimitedStream, wrap_file
 import time
 import ringcx_streaming_pb2
-import audioop
-# Google Cloud Speech imports
-from google.cloud import speech
-import queue
+from session_log import SessionLogs
+from transcripts import TranscriptStore
+import metrics
+from log_queue import queue_handler
+from segments import MediaSummary, Segment, SegmentIndex, SegmentFinalizer
+from audio_pipeline import (BUFFER_POLICIES, VAD_MODES, AudioBroadcaster, AudioBufferBudgetExhausted, AudioBufferPool,
+                            FrameAggregator, ReorderBuffer, SilenceGate)
+from recording import STORAGE_FORMATS, WAVE_FORMAT_PCM, WavRecorder, can_record, open_recorder, wav_header
+from recognizers import RECOGNIZERS, create_recognizer
+from catalog import RecordingsCatalog
+from workers import REUSEPORT_OPTIONS, run_workers, worker_index
+from drain import StreamTracker, stop_server, stop_server_async, wait_for_signal, wait_for_signal_async
+import grpc_tuning
 import io
 import glob
-from datetime import datetime
+import audio_codec
+import json
+import base64
+import hashlib
+import collections
+from datetime import datetime, timezone
 
 app = Flask(__name__)
+logger = logging.getLogger(__name__)  # Replaced by configure_logger() when run as a script
 OUTPUT_FOLDER = 'saved_audio'
+streaming_service = None  # The running StreamingService, for the status endpoint
+catalog = None  # RecordingsCatalog behind the listing routes
+file_transcripts = None  # TranscriptStore reading the files, for the HTTP process of --workers mode
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+PAGE_CACHE_SIZE = 256
+TRANSCRIPT_MAX_WAIT = 30.0  # Longest long-poll on /api/transcripts, in seconds
+ASYNC_IO_THREADS = 8  # Threads running the disk and catalog work of --async calls
+TRANSCRIPT_KEEPALIVE = 15.0  # Seconds between SSE keepalive comments on an idle call
+LISTING_FILTERS = ('session_id', 'dialog_id', 'participant_type', 'since', 'until')
+page_cache = collections.OrderedDict()  # request path and query -> (catalog version, rendered body)
+page_cache_lock = threading.Lock()
+
+
+def _service_metric(read):
+    """Scrape-time gauge callback reading the running service, 0 before it starts"""
+    return lambda: read(streaming_service) if streaming_service is not None else 0
+
+
+def _queued_audio_bytes(service):
+    if service.segment_index is None:
+        return 0
+    return sum(segment.audio_buffer.buffered_bytes for segment in service.segment_index.segments()
+               if segment.audio_buffer is not None)
+
+
+metrics.REGISTRY.gauge('segments_active', "Segments started and not yet finalized",
+                       callback=_service_metric(lambda service: len(service.segment_index or ())))
+metrics.REGISTRY.gauge('segments_finalizing', "Stopped segments waiting for their transcription to finish",
+                       callback=_service_metric(lambda service: service.finalizer.stats()['pending']))
+metrics.REGISTRY.gauge('audio_buffer_queued_bytes', "Audio waiting in segment buffers for the recognizer",
+                       callback=_service_metric(_queued_audio_bytes))
+metrics.REGISTRY.gauge('audio_buffer_allocated_bytes', "Memory reserved for segment audio buffers",
+                       callback=_service_metric(lambda service: service.audio_buffers.stats()['allocated_bytes']))
+metrics.REGISTRY.gauge('audio_buffer_dropped_bytes', "Audio dropped by full segment buffers since start",
+                       callback=_service_metric(lambda service: service.audio_buffers.stats()['dropped_bytes']))
+metrics.REGISTRY.gauge('recognizer_clients', "Recognizer clients open, each on its own channel",
+                       callback=_service_metric(lambda service: service.recognizer.stats().get('clients', 0)))
+metrics.REGISTRY.gauge('recognizer_streams', "Recognizer streams started since start",
+                       callback=_service_metric(lambda service: service.recognizer.stats().get('streams', 0)))
+metrics.REGISTRY.gauge('recognizer_reused_streams', "Recognizer streams since start that found their client's channel open",
+                       callback=_service_metric(lambda service: service.recognizer.stats().get('reused', 0)))
+FINAL_LATENCY_SECONDS = metrics.REGISTRY.histogram(
+    'transcription_final_latency_seconds',
+    "Time from the end of a segment's audio to its last final transcript, for segments finalized after their audio ended")
 
 # HTML template for the web page
 HTML_TEMPLATE = """
@@ -66,21 +130,36 @@ HTML_TEMPLATE = """
 </head>
 <body>
     <h1>Recorded Audio Files</h1>
-    
+
+    <form method="get">
+        <input name="session_id" placeholder="Session id" value="{{ filters.session_id or '' }}">
+        <input name="dialog_id" placeholder="Dialog id" value="{{ filters.dialog_id or '' }}">
+        <select name="participant_type">
+            <option value="">Any participant</option>
+            {% for participant_type in participant_types %}
+            <option{{ ' selected' if filters.participant_type == participant_type else '' }}>{{ participant_type }}</option>
+            {% endfor %}
+        </select>
+        <input name="since" placeholder="Since (YYYY-MM-DD)" value="{{ filters.since or '' }}">
+        <input name="until" placeholder="Until (YYYY-MM-DD)" value="{{ filters.until or '' }}">
+        <button type="submit">Filter</button>
+    </form>
+
     {% if sessions %}
-        {% for session_id, files in sessions.items() %}
+        {% for files in sessions %}
             <div class="session">
-                <h2>Session: {{ session_id }}</h2>
+                <h2>Session: {{ files.session_id }}</h2>
+                <div class="timestamp">{{ files.created }}{% if files.dialog_id %} &middot; dialog {{ files.dialog_id }}{% endif %}</div>
                 
                 {% if files.wav_files %}
-                    <h3>WAV Files (Playable)</h3>
+                    <h3>Recordings (Playable)</h3>
                     <ul>
                     {% for file_path in files.wav_files %}
                         {% set file_name = file_path.split('/')[-1] %}
                         <li>
                             <div>{{ file_name }}</div>
                             <audio controls>
-                                <source src="/files/{{ file_path }}" type="audio/wav">
+                                <source src="/files/{{ file_path }}" type="audio/{{ 'flac' if file_name.endswith('.flac') else 'wav' }}">
                                 Your browser does not support the audio element.
                             </audio>
                         </li>
@@ -101,6 +180,9 @@ HTML_TEMPLATE = """
                 {% endif %}
             </div>
         {% endfor %}
+        {% if next_url %}
+            <p><a href="{{ next_url }}">Older sessions</a></p>
+        {% endif %}
     {% else %}
         <p>No audio recordings found.</p>
     {% endif %}
@@ -109,213 +191,509 @@ HTML_TEMPLATE = """
 """
 
 class StreamingService(ringcx_streaming_pb2_grpc.StreamingServicer):
-    def __init__(self):
-        self.segments = {}  # Dictionary to track all active segments
-        self.speech_client = speech.SpeechClient()
+    use_async = False  # Segment buffers for pool threads or for the event loop
+    
+    def __init__(self, log_flush_bytes=64 * 1024, log_flush_interval=1.0, log_background_flush=False,
+                 storage_format='linear', index_segments=True, finalize_timeout=5.0,
+                 recognizer='google', recognizer_options=None,
+                 aggregate_ms=100, aggregate_max_bytes=0, aggregate_max_latency_ms=150,
+                 buffer_bytes=160 * 1024, buffer_total_bytes=256 * 1024 * 1024, buffer_policy='drop-oldest',
+                 reorder_window=8, reorder_max_delay_ms=60, media_log_interval=10.0, catalog=None,
+                 tap_bytes=64 * 1024, vad='off', vad_threshold_db=-45.0, vad_hangover_ms=300, vad_preroll_ms=100,
+                 vad_keepalive_ms=1000, vad_recordings=False):
+        # Segment state lives in each Stream call; this index only reports what is active
+        self.segment_index = SegmentIndex() if index_segments else None
+        self.finalizer = SegmentFinalizer(finalize_timeout, on_done=self._segment_finalized)
+        self.recognizer = create_recognizer(recognizer, **(recognizer_options or {}))
+        self.session_logs = SessionLogs(OUTPUT_FOLDER, log_flush_bytes, log_flush_interval, log_background_flush)
+        # Transcripts stay live until the call and its segments' transcriptions have ended
+        self.transcripts = TranscriptStore(OUTPUT_FOLDER, log_flush_bytes, log_flush_interval, log_background_flush)
+        self.storage_format = storage_format
+        self.audio_buffers = AudioBufferPool(buffer_bytes, buffer_total_bytes, buffer_policy)
+        self.reorder_window = reorder_window
+        self.reorder_max_delay_ms = reorder_max_delay_ms
+        self.reorder_totals = collections.Counter()
+        self.media_log_interval = media_log_interval  # 0 logs every media packet
+        self.catalog = catalog  # RecordingsCatalog kept up to date for the HTTP listing
+        self.tap_bytes = tap_bytes  # Ring size of each segment's live audio tap, 0 disables it
+        self.streams = StreamTracker()
+        self.draining = False
+        self.cut_off_segments = []  # Keys of segments whose call the drain cancelled
+        self._drain_started = None  # (monotonic time, finalizer stats) when the drain began
+        self.aggregation = {
+            'target_ms': aggregate_ms,
+            'max_bytes': aggregate_max_bytes,
+            'max_latency_ms': aggregate_max_latency_ms,
+        }
+        self.vad = {
+            'mode': vad,
+            'threshold_db': vad_threshold_db,
+            'hangover_ms': vad_hangover_ms,
+            'preroll_ms': vad_preroll_ms,
+            'keepalive_ms': vad_keepalive_ms,
+        }
+        self.vad_recordings = vad_recordings  # Record only what the silence gate passes on
 
     def Stream(self, request_iterator, context):
+        metrics.ACTIVE_STREAMS.inc()
+        start = time.monotonic()
+        try:
+            with self.streams.track():
+                return self._stream(request_iterator, context)
+        finally:
+            metrics.ACTIVE_STREAMS.dec()
+            metrics.STREAM_SECONDS.observe(time.monotonic() - start)
+    
+    def _stream(self, request_iterator, context):
         
         # Create output directory
         Path(OUTPUT_FOLDER).mkdir(exist_ok=True)
-        
+        session_ids = set()
+        segments = {}  # Active segments of this stream, by segment key
+        completed = False
+        try:
+            self._receive(request_iterator, session_ids, segments)
+            completed = True
+        finally:
+            # Also when the call was cancelled, e.g. by a drain running out of time
+            self._end_stream(session_ids, segments, completed, run_now)
+        return Empty()
+    
+    def _receive(self, request_iterator, session_ids, segments):
+        """Handle the call's events until the client ends its request stream"""
         for event in request_iterator:
-            session_id = event.session_id
-            
-            if event.HasField('dialog_init'):
-                dialog_id = event.dialog_init.dialog.id
-                logger.info(f"{session_id}: DialogInit, dialog_id: {dialog_id}")
-                create_session_dir(session_id)
-                write_session_logs(session_id, f"DialogInit: {event}")
-                
-            elif event.HasField('segment_start'):
-                segment_id = event.segment_start.segment_id
-                logger.info(f"{session_id}: SegmentStart, segment_id: {segment_id}")
-                write_session_logs(session_id, f"SegmentStart: {event}")
-                
-                # Create entry for this segment
-                segment_key = f"{session_id}_{segment_id}"
-                self.segments[segment_key] = {
-                    'session_id': session_id,
-                    'segment_id': segment_id,
-                    'audio_format': {},
-                    'audio_buffer': queue.Queue(),
-                    'transcription_thread': None
-                }
-                
-                # Extract audio format from segment_start if available
-                if event.segment_start.HasField('audio_format'):
-                    fmt = event.segment_start.audio_format
-                    codec_name = ringcx_streaming_pb2.Codec.Name(fmt.codec)
-                    # logger.info(f"Audio format from segment_start: codec={codec_name}, rate={fmt.rate}Hz")
-                    
-                    # Store audio format for this specific segment
-                    self.segments[segment_key]['audio_format'] = {
-                        'encoding': codec_name,
-                        'sample_rate': fmt.rate,
-                        'channels': 1  # Default to mono
-                    }
-                    
-                    # Set sample width based on codec
-                    if codec_name in ['PCMA', 'PCMU']:  # A-law and μ-law are 8-bit
-                        self.segments[segment_key]['audio_format']['sample_width'] = 1
-                    elif codec_name in ['L16', 'LINEAR16']:  # 16-bit PCM
-                        self.segments[segment_key]['audio_format']['sample_width'] = 2
-                    
-                    # Start transcription thread for this segment
-                    transcription_thread = threading.Thread(
-                        target=self.stream_transcript,
-                        args=(segment_key,)
-                    )
-                    transcription_thread.daemon = True
-                    transcription_thread.start()
-                    self.segments[segment_key]['transcription_thread'] = transcription_thread
-                
-            elif event.HasField('segment_media'):
-                segment_id = event.segment_media.segment_id
-                payload = event.segment_media.audio_content.payload
-                seq = event.segment_media.audio_content.seq
-                duration = event.segment_media.audio_content.duration
-                
-                segment_key = f"{session_id}_{segment_id}"
-                logger.info(f"{session_id}: SegmentMedia, segment_id: {segment_id}, payload size: {len(payload)}, seq: {seq}, duration: {duration}")
-                write_session_logs(session_id, f"SegmentMedia, segment_id: {segment_id}, payload size: {len(payload)}, seq: {seq}, duration: {duration}")
-                
-                # Add audio data to the segment's buffer for transcription
-                if segment_key in self.segments:
-                    self.segments[segment_key]['audio_buffer'].put(payload)
-                
-            elif event.HasField('segment_stop'):
-                segment_id = event.segment_stop.segment_id
-                logger.info(f"{session_id}: SegmentStop, segment_id: {segment_id}")
-                write_session_logs(session_id, f"SegmentStop: {event}")
-                
-                # Signal end of audio stream for transcription
-                segment_key = f"{session_id}_{segment_id}"
-                if segment_key in self.segments:
-                    self.segments[segment_key]['audio_buffer'].put(None)  # Signal end of stream
-                    
-                    # Wait for transcription to complete
-                    if self.segments[segment_key]['transcription_thread']:
-                        self.segments[segment_key]['transcription_thread'].join(timeout=5)
-                    
-                    # Clean up
-                    del self.segments[segment_key]
-            
-            logger.debug(f"Event: {event}")
+            segment, payloads = self._handle_event(event, session_ids, segments, run_now)
+            for payload in payloads:
+                if segment.audio_buffer is not None:
+                    segment.audio_buffer.put(payload)
+    
+    def _handle_event(self, event, session_ids, segments, io):
+        """Handle one StreamEvent of a call, shared by the sync and async loops.
+
+        Disk and catalog work goes through `io(function, *args)`: the sync service runs it at
+        once, the async one queues it on the call's CallWriter so the event loop never waits on it.
+        Returns the media event's segment and an iterator of the payloads for its recognizer,
+        which writes the recording and live tap as it is consumed; (None, ()) otherwise.
+        """
+        logger.debug("Event: %s", event)
+        metrics.STREAM_EVENTS.inc(labels=(event.WhichOneof('event'),))
+        session_id = event.session_id
+        if session_id not in session_ids:
+            session_ids.add(session_id)
+            io(self.transcripts.acquire, session_id)
         
-        # Signal end of stream for any remaining segments
-        segments_to_remove = []
-        for segment_key, segment_data in self.segments.items():
-            segment_data['audio_buffer'].put(None)  # Signal end of stream
-            
-            # Wait for transcription to complete
-            if segment_data['transcription_thread']:
-                segment_data['transcription_thread'].join(timeout=5)
-            
-            segments_to_remove.append(segment_key)
+        if event.HasField('dialog_init'):
+            dialog_id = event.dialog_init.dialog.id
+            if self.catalog:
+                io(self.catalog.add_session, session_id, dialog_id)
+            logger.info("%s: DialogInit, dialog_id: %s", session_id, dialog_id)
+            io(create_session_dir, session_id)
+            io(self.session_logs.write, session_id, f"DialogInit: {event}")
         
-        # Clean up processed segments
-        for key in segments_to_remove:
-            del self.segments[key]
-            
-        return Empty()
-    
-    def stream_transcript(self, segment_key):
-        """Stream audio data to Google Speech-to-Text and print transcripts"""
-        if segment_key not in self.segments:
-            logger.error(f"Segment {segment_key} not found for transcription")
-            return
+        elif event.HasField('segment_start'):
+            segment_id = event.segment_start.segment_id
+            logger.info("%s: SegmentStart, segment_id: %s", session_id, segment_id)
+            io(self.session_logs.write, session_id, f"SegmentStart: {event}")
         
-        segment_data = self.segments[segment_key]
-        audio_format = segment_data['audio_format']
-        audio_buffer = segment_data['audio_buffer']
-        session_id = segment_data['session_id']
-        segment_id = segment_data['segment_id']
+            segment = self._start_segment(session_id, event.segment_start, io)
+            segments[segment.key] = segment
         
-        # Get audio format parameters
-        sample_rate = audio_format.get('sample_rate', 8000)
-        encoding = audio_format.get('encoding', 'PCMU')
+            if segment.audio_buffer is not None:
+                self._start_transcription(segment, io)
         
-        # Configure speech recognition
-        config = speech.RecognitionConfig(
-            encoding=self._get_google_encoding(encoding),
-            sample_rate_hertz=sample_rate,
-            language_code="en-US",
-            enable_automatic_punctuation=True,
-            model="phone_call"  # Use phone_call model for better handling of telephony audio
-        )
+        elif event.HasField('segment_media'):
+            segment_id = event.segment_media.segment_id
+            payload = event.segment_media.audio_content.payload
+            seq = event.segment_media.audio_content.seq
+            metrics.MEDIA_BYTES.inc(len(payload))
+            duration = event.segment_media.audio_content.duration
+        
+            if not self.media_log_interval:
+                logger.info("%s: SegmentMedia, segment_id: %s, payload size: %s, seq: %s, duration: %s", session_id, segment_id, len(payload), seq, duration)
+            io(self.session_logs.write, session_id, f"SegmentMedia, segment_id: {segment_id}, payload size: {len(payload)}, seq: {seq}, duration: {duration}")
         
-        streaming_config = speech.StreamingRecognitionConfig(
-            config=config,
-            interim_results=True
+            # Add audio data, in seq order, to the segment's buffer for transcription and to its recording
+            segment = segments.get(f"{session_id}_{segment_id}")
+            if segment:
+                if segment.media.add(seq, len(payload)):
+                    self._log_media(segment)
+                return segment, self._route(segment, segment.reorder.push(seq, payload, duration) if segment.reorder else (payload,), io)
+        
+        elif event.HasField('segment_stop'):
+            segment_id = event.segment_stop.segment_id
+            logger.info("%s: SegmentStop, segment_id: %s", session_id, segment_id)
+            io(self.session_logs.write, session_id, f"SegmentStop: {event}")
+            io(self.session_logs.flush, session_id)
+        
+            segment = segments.pop(f"{session_id}_{segment_id}", None)
+            if segment:
+                self._finish_segment(segment, io)
+        
+        return None, ()
+    
+    def _start_transcription(self, segment, io):
+        """Start the segment's recognizer stream on a thread of its own, which does its own I/O"""
+        transcription_thread = threading.Thread(
+            target=self.stream_transcript,
+            args=(segment,)
         )
+        transcription_thread.daemon = True
+        transcription_thread.start()
+        segment.transcription = transcription_thread
+    
+    def _end_stream(self, session_ids, segments, completed, io):
+        """Finish the segments the call left open and close its sessions"""
+        # grpc.aio ends the request stream of a call the drain cancels as if the client had
+        # ended it, so segments left without SegmentStop while draining were cut off too
+        if not completed or (self.draining and segments):
+            self.streams.count_cut_off()
+            if segments:
+                logger.warning("Stream of %s ended early, finalizing %d open segments with the audio received",
+                               ', '.join(session_ids), len(segments))
+                if self.draining:
+                    self.cut_off_segments.extend(segments)
         
-        # Audio stream generator
-        def audio_stream_generator():
-            while True:
-                chunk = audio_buffer.get()
-                if chunk is None:  # End of stream
-                    break
-                
-                # Convert audio format if needed
-                if encoding == 'PCMA':  # A-law
-                    chunk = audioop.alaw2lin(chunk, 2)
-                elif encoding == 'PCMU':  # μ-law
-                    chunk = audioop.ulaw2lin(chunk, 2)
-                
-                yield speech.StreamingRecognizeRequest(audio_content=chunk)
+        # Signal end of stream for this stream's remaining segments
+        for segment in segments.values():
+            self._finish_segment(segment, io)
+        segments.clear()
+        
+        for session_id in session_ids:
+            io(self.session_logs.close, session_id)
+            io(self.transcripts.release, session_id)
+            if self.catalog:
+                io(self.catalog.update_file, self.session_logs.path(session_id), session_id)
+    
+    def _start_segment(self, session_id, segment_start, io):
+        """Create the segment with its audio buffer, and have `io` open its recording, when the audio format is known"""
+        segment = Segment(session_id, segment_start.segment_id, None)
+        segment.media = MediaSummary(self.media_log_interval)
+        participant = segment_start.participant
+        segment.participant = (ringcx_streaming_pb2.ParticipantType.Name(participant.type), participant.id)
+        io(self.transcripts.acquire, session_id)  # Released once the segment is finalized
+        
+        # Extract audio format from segment_start if available
+        if segment_start.HasField('audio_format'):
+            segment.audio_format = parse_audio_format(segment_start.audio_format)
+            try:
+                segment.audio_buffer = self.audio_buffers.create(self.use_async)
+            except AudioBufferBudgetExhausted as e:
+                logger.error("%s: %s, segment %s is recorded but not transcribed", session_id, e, segment.segment_id)
+            if self.reorder_window > 0:
+                segment.reorder = ReorderBuffer(segment.audio_format, self.reorder_window, self.reorder_max_delay_ms)
+            if self.tap_bytes > 0 and can_record(segment.audio_format):
+                segment.tap = AudioBroadcaster(self.tap_bytes, segment.audio_format['encoding'])
+            if self.vad['mode'] != 'off' and can_record(segment.audio_format):
+                segment.gate = SilenceGate(segment.audio_format, **self.vad)
+        
+        io(self._open_recording, segment)
+        if self.segment_index is not None:
+            self.segment_index.add(segment)
+        return segment
+    
+    def _open_recording(self, segment):
+        """Open the segment's recording, when its audio format is known, and add the segment to the catalog"""
+        if segment.audio_format:
+            segment.recorder = open_segment_recorder(segment.session_id, segment.segment_id, segment.audio_format,
+                                                     self.storage_format)
+        if self.catalog:
+            self.catalog.add_segment(segment.session_id, segment.segment_id, *segment.participant,
+                                     segment.audio_format, segment.recorder.path if segment.recorder else None)
+    
+    def _finish_segment(self, segment, io):
+        """Signal end of audio and hand the segment to the finalizer without waiting for it"""
+        segment.audio_ended_at = time.monotonic()
+        if segment.media.packets and self.media_log_interval:
+            self._log_media(segment)
+        if segment.reorder:
+            for payload in self._route(segment, segment.reorder.flush(), io):
+                if segment.audio_buffer is not None:
+                    segment.audio_buffer.put_nowait(payload)
+        if segment.gate:
+            for payload in segment.gate.flush():  # Before the aggregator sees the end of stream
+                if self.vad_recordings:
+                    io(self._record, segment, payload)
+                if segment.audio_buffer is not None:
+                    segment.audio_buffer.put_nowait(payload)
+        if segment.tap is not None:
+            segment.tap.close()  # Ends the live responses
+        if segment.audio_buffer is not None:
+            segment.audio_buffer.close()  # Signal end of stream
+        io(self.finalizer.submit, segment)  # After the recording's writes, since it closes the recording
+    
+    def _route(self, segment, payloads, io):
+        """Write payloads in seq order to the live tap and the recording, yielding those for the recognizer"""
+        for payload in payloads:
+            if segment.tap is not None:
+                segment.tap.write(payload)
+            if not (segment.gate and self.vad_recordings):
+                io(self._record, segment, payload)
+            for passed in segment.gate.push(payload) if segment.gate else (payload,):
+                if segment.gate and self.vad_recordings:
+                    io(self._record, segment, passed)
+                yield passed
+    
+    def _record(self, segment, payload):
+        if segment.recorder:
+            segment.recorder.write(payload)
+    
+    def _log_media(self, segment):
+        packets, size, gaps, seconds = segment.media.take()
+        logger.info("%s: SegmentMedia, segment_id: %s, %d packets, %d bytes, %d seq gaps in %.1fs",
+                    segment.session_id, segment.segment_id, packets, size, gaps, seconds)
+    
+    def _segment_finalized(self, segment):
+        """Called on the finalizer thread once the recording is closed and transcription has ended"""
+        if self.segment_index is not None:
+            self.segment_index.remove(segment)
+        if segment.audio_buffer is not None:
+            if segment.audio_buffer.overflows:
+                logger.warning("Audio buffer of %s overflowed %s times, %s bytes not transcribed",
+                               segment.key, segment.audio_buffer.overflows, segment.audio_buffer.dropped_bytes)
+        if segment.reorder:
+            counters = segment.reorder.counters
+            self.reorder_totals.update(counters)
+            if counters['duplicates'] or counters['late'] or counters['concealed'] or counters['resyncs']:
+                logger.info("Reordered audio of %s: %s", segment.key, counters)
+        activity = segment.gate.stats() if segment.gate else {}
+        if activity:
+            metrics.VAD_SECONDS.inc(activity['speech_seconds'], labels=('speech',))
+            metrics.VAD_SECONDS.inc(activity['silence_seconds'], labels=('silence',))
+            metrics.VAD_SENT_SECONDS.inc(activity['sent_seconds'])
+            logger.info("Voice activity of %s: %ss speech, %ss silence, %ss sent on", segment.key,
+                        activity['speech_seconds'], activity['silence_seconds'], activity['sent_seconds'])
+        if self.catalog:
+            self.catalog.finish_segment(segment.session_id, segment.segment_id, segment.recorder.path if segment.recorder else None,
+                                        activity.get('speech_seconds'), activity.get('silence_seconds'))
+        self.transcripts.release(segment.session_id)
+        if segment.final_at is not None and segment.audio_ended_at is not None and segment.final_at >= segment.audio_ended_at:
+            FINAL_LATENCY_SECONDS.observe(segment.final_at - segment.audio_ended_at)
+        logger.info("Finalized segment %s", segment.key)
+    
+    def live_segment(self, session_id, segment_id):
+        """An active segment with a live audio tap, or None"""
+        if self.segment_index is None:
+            return None
+        segment = self.segment_index.find(f"{session_id}_{segment_id}")
+        return segment if segment is not None and segment.tap is not None and segment.audio_ended_at is None else None
+
+    def start_drain(self):
+        """Note what is active as the server stops taking new calls"""
+        self.draining = True
+        self._drain_started = (time.monotonic(), self.finalizer.stats())
+        logger.info("Draining %d streams with %s active segments", self.streams.active,
+                    len(self.segment_index) if self.segment_index is not None else 'unknown')
+    
+    def finish_drain(self, timeout=None):
+        """Once the server has stopped: wait for cancelled calls to return and their segments to
+        finalize, then close every writer and report what was lost"""
+        deadline = time.monotonic() + (self.finalizer.timeout + 1.0 if timeout is None else timeout)
+        while self._drain_pending() and time.monotonic() < deadline:
+            time.sleep(self.finalizer.poll_interval)
+        return self._drain_report()
+    
+    def _drain_pending(self):
+        return self.streams.active or self.finalizer.stats()['pending']
+    
+    def _drain_report(self):
+        self.session_logs.close_all()
+        self.transcripts.close_all()
+        started_at, before = self._drain_started
+        after = self.finalizer.stats()
+        report = {
+            'seconds': round(time.monotonic() - started_at, 1),
+            'finalized': after['completed'] - before['completed'],
+            'transcription_timeouts': after['timed_out'] - before['timed_out'],
+            'cut_off': list(self.cut_off_segments),
+            'unfinished_streams': self.streams.active,
+            'unfinished_segments': after['pending'],
+        }
+        logger.info("Drained in %ss: %d segments finalized, %d transcriptions timed out",
+                    report['seconds'], report['finalized'], report['transcription_timeouts'])
+        if report['cut_off']:
+            logger.warning("Segments cut off by the drain timeout: %s", ', '.join(report['cut_off']))
+        if report['unfinished_streams'] or report['unfinished_segments']:
+            logger.warning("Still running at exit: %d streams, %d segments waiting for transcription",
+                           report['unfinished_streams'], report['unfinished_segments'])
+        return report
+    
+    def status(self):
+        """Active segments and finalization backlog, for the HTTP status endpoint"""
+        return {
+            'draining': self.draining,
+            'active_segments': len(self.segment_index) if self.segment_index is not None else None,
+            'finalizer': self.finalizer.stats(),
+            'audio_buffers': self.audio_buffers.stats(),
+            'reorder': dict(self.reorder_totals),
+            'recognizer': self.recognizer.stats(),
+        }
+    
+    def stream_transcript(self, segment):
+        """Stream segment audio to the recognizer backend and store its transcripts"""
+        segment_key = segment.key
+        aggregator = self._create_aggregator(segment)
         
         # Start streaming recognition
         try:
-            streaming_responses = self.speech_client.streaming_recognize(
-                config=streaming_config,
-                requests=audio_stream_generator()
-            )
-            
-            logger.info(f"Started transcription for {segment_key}")
+            logger.info("Started transcription for %s", segment_key)
             
-            # Process streaming responses
-            for response in streaming_responses:
-                if not response.results:
-                    continue
-                
-                for result in response.results:
-                    transcript = result.alternatives[0].transcript if result.alternatives else ""
-                    
-                    if result.is_final:
-                        logger.info(f"Transcript [{segment_key}]: {transcript}")
-                        print(f"FINAL TRANSCRIPT [{segment_key}]: {transcript}")
-                    else:
-                        logger.debug(f"Interim [{segment_key}]: {transcript}")
-                        print(f"INTERIM [{segment_key}]: {transcript}")
+            for result in self.recognizer.streaming_recognize(segment.audio_format, aggregator.batches(segment.audio_buffer)):
+                self._handle_result(segment, result)
             
-            logger.info(f"Completed transcription for {segment_key}")
+            logger.info("Completed transcription for %s: %s frames in %s requests", segment_key, aggregator.frames, aggregator.messages)
             
         except Exception as e:
-            logger.error(f"Error in transcription for {segment_key}: {e}")
-    
-    def _get_google_encoding(self, encoding):
-        """Convert internal encoding names to Google Speech-to-Text encoding enum values"""
-        if encoding == 'LINEAR16' or encoding == 'L16':
-            return speech.RecognitionConfig.AudioEncoding.LINEAR16
-        elif encoding == 'PCMA':
-            return speech.RecognitionConfig.AudioEncoding.MULAW  # Google doesn't have A-law, convert to PCM
-        elif encoding == 'PCMU':
-            return speech.RecognitionConfig.AudioEncoding.MULAW
+            logger.error("Error in transcription for %s: %s", segment_key, e)
+        finally:
+            # Only now nothing reads the buffer any more, even when finalization gave up waiting
+            self.audio_buffers.release(segment.audio_buffer)
+    
+    def _create_aggregator(self, segment):
+        """Frame aggregation stage between a segment's buffer and the recognizer"""
+        return FrameAggregator(segment.audio_format, **self.aggregation)
+    
+    def _handle_result(self, segment, result):
+        """Store and log a final or interim transcript"""
+        segment_key = segment.key
+        self.transcripts.add(segment.session_id, segment.segment_id, result.transcript, result.is_final, *segment.participant)
+        if result.is_final:
+            segment.final_at = time.monotonic()
+            metrics.FINAL_RESULTS.inc()
+            logger.info("Transcript [%s]: %s", segment_key, result.transcript)
         else:
-            # Default to LINEAR16
-            logger.warning(f"Unsupported encoding {encoding} for Google STT, using LINEAR16")
-            return speech.RecognitionConfig.AudioEncoding.LINEAR16
+            logger.debug("Interim [%s]: %s", segment_key, result.transcript)
+
+
+def run_now(function, *args, **kwargs):
+    """The sync service's `io`: blocking work runs on the calling pool thread"""
+    return function(*args, **kwargs)
+
+
+class CallWriter:
+    """The async service's `io`: a call's blocking work, run in submission order on a shared thread pool.
+
+    Recordings, session logs and transcripts write to disk, and the catalog can wait seconds
+    for another process's lock; none of it may stall the other dialogs on the event loop.
+    Work submitted while a batch runs goes out as the next batch, so a call costs one
+    executor hop per batch rather than per packet.
+    """
+    def __init__(self, executor):
+        self._executor = executor
+        self._work = collections.deque()
+        self._task = None
 
+    def __call__(self, function, *args, **kwargs):
+        self._work.append((function, args, kwargs))
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
 
-def serve(server_ip, grpc_port, grpc_secure_port):
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    ringcx_streaming_pb2_grpc.add_StreamingServicer_to_server(StreamingService(), server)
+    async def drain(self):
+        """Wait until everything submitted so far has run"""
+        while self._task is not None:
+            await asyncio.shield(self._task)  # The work goes on if the waiter is cancelled
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self._work:
+                batch = list(self._work)
+                self._work.clear()
+                await loop.run_in_executor(self._executor, _run_batch, batch)
+        finally:
+            self._task = None
+
+
+def _run_batch(batch):
+    for function, args, kwargs in batch:
+        try:
+            function(*args, **kwargs)
+        except Exception as e:
+            logger.error("Error in %s: %s", getattr(function, '__qualname__', function), e)
+
+
+class AsyncStreamingService(StreamingService):
+    """grpc.aio variant of StreamingService: one coroutine per dialog and one task per segment.
+
+    Each call's disk and catalog work runs on `io_threads` shared threads through a CallWriter.
+    """
+    use_async = True
+    
+    def __init__(self, io_threads=ASYNC_IO_THREADS, **options):
+        super().__init__(**options)
+        self.io_executor = futures.ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix='call-io')
     
+    async def Stream(self, request_iterator, context):
+        metrics.ACTIVE_STREAMS.inc()
+        start = time.monotonic()
+        try:
+            with self.streams.track():
+                return await self._stream(request_iterator, context)
+        finally:
+            metrics.ACTIVE_STREAMS.dec()
+            metrics.STREAM_SECONDS.observe(time.monotonic() - start)
+    
+    async def _stream(self, request_iterator, context):
+        io = CallWriter(self.io_executor)
+        # Create output directory
+        io(Path(OUTPUT_FOLDER).mkdir, exist_ok=True)
+        session_ids = set()
+        segments = {}  # Active segments of this stream, by segment key
+        completed = False
+        try:
+            await self._receive(request_iterator, session_ids, segments, io)
+            completed = True
+        finally:
+            # Also when the call was cancelled, e.g. by a drain running out of time
+            self._end_stream(session_ids, segments, completed, io)
+            await io.drain()  # The call counts as active until its files are written
+        return Empty()
+    
+    async def _receive(self, request_iterator, session_ids, segments, io):
+        """Handle the call's events until the client ends its request stream"""
+        async for event in request_iterator:
+            segment, payloads = self._handle_event(event, session_ids, segments, io)
+            for payload in payloads:
+                if segment.audio_buffer is not None:
+                    await segment.audio_buffer.put(payload)
+    
+    def _start_transcription(self, segment, io):
+        segment.transcription = asyncio.create_task(self.stream_transcript(segment, io))
+    
+    async def stream_transcript(self, segment, io):
+        """Stream segment audio to the recognizer backend and store its transcripts"""
+        segment_key = segment.key
+        aggregator = self._create_aggregator(segment)
+        
+        # Start streaming recognition
+        try:
+            logger.info("Started transcription for %s", segment_key)
+            
+            async for result in self.recognizer.streaming_recognize_async(segment.audio_format, aggregator.batches_async(segment.audio_buffer)):
+                io(self._handle_result, segment, result)
+            
+            logger.info("Completed transcription for %s: %s frames in %s requests", segment_key, aggregator.frames, aggregator.messages)
+            
+        except Exception as e:
+            logger.error("Error in transcription for %s: %s", segment_key, e)
+        finally:
+            # Only now nothing reads the buffer any more, even when finalization gave up waiting
+            self.audio_buffers.release(segment.audio_buffer)
+            await io.drain()  # Results are stored before the finalizer sees the task end
+    
+    async def finish_drain(self, timeout=None):
+        """StreamingService.finish_drain() without blocking the event loop the segments finish on"""
+        deadline = time.monotonic() + (self.finalizer.timeout + 1.0 if timeout is None else timeout)
+        while self._drain_pending() and time.monotonic() < deadline:
+            await asyncio.sleep(self.finalizer.poll_interval)
+        return self._drain_report()
+
+
+def add_server_ports(server, server_ip, grpc_port, grpc_secure_port):
+    """Bind the insecure port, plus the SSL port when certificates are configured"""
     # Insecure port
     server_address = f'{server_ip}:{grpc_port}'
     server.add_insecure_port(server_address)
-    logger.info(f'gRPC server started at {server_address} (insecure)')
+    logger.info('gRPC server started at %s (insecure)', server_address)
     
     # Secure port if SSL certificates are available
     cert_file = os.environ.get('SSL_CERT_FILE')
@@ -330,14 +708,48 @@ def serve(server_ip, grpc_port, grpc_secure_port):
             
         server_credentials = grpc.ssl_server_credentials([(key_data, cert_data)])
         server.add_secure_port(secure_address, server_credentials)
-        logger.info(f'gRPC server started with SSL at {secure_address}')
-    
+        logger.info('gRPC server started with SSL at %s', secure_address)
+
+def serve(server_ip, grpc_port, grpc_secure_port, grpc_options=(), grpc_workers=10, max_concurrent_rpcs=None,
+          max_streams=0, retry_after_ms=1000, **service_options):
+    global streaming_service
+    interceptors = [grpc_tuning.AdmissionControl(max_streams, retry_after_ms)] if max_streams else None
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=grpc_tuning.thread_pool_size(grpc_workers, max_streams)),
+                         interceptors=interceptors, options=grpc_options, maximum_concurrent_rpcs=max_concurrent_rpcs)
+    streaming_service = StreamingService(**service_options)
+    streaming_service.recognizer.warm()
+    ringcx_streaming_pb2_grpc.add_StreamingServicer_to_server(streaming_service, server)
+    add_server_ports(server, server_ip, grpc_port, grpc_secure_port)
     server.start()
     return server
 
-def configure_logger(log_level, log_filename):
-    _logger = logging.getLogger(__name__)
-    _logger.setLevel(log_level)
+async def serve_async(server_ip, grpc_port, grpc_secure_port, grpc_options=(), grpc_workers=10, max_concurrent_rpcs=None,
+                      max_streams=0, retry_after_ms=1000, drain_timeout=30.0, **service_options):
+    """Run the grpc.aio server until SIGINT or SIGTERM, then drain it; dialogs are coroutines, not pool threads"""
+    global streaming_service
+    interceptors = [grpc_tuning.AsyncAdmissionControl(max_streams, retry_after_ms)] if max_streams else None
+    server = grpc.aio.server(interceptors=interceptors, options=grpc_options, maximum_concurrent_rpcs=max_concurrent_rpcs)
+    streaming_service = AsyncStreamingService(**service_options)
+    await streaming_service.recognizer.warm_async()
+    ringcx_streaming_pb2_grpc.add_StreamingServicer_to_server(streaming_service, server)
+    add_server_ports(server, server_ip, grpc_port, grpc_secure_port)
+    await server.start()
+    try:
+        logger.info("Received %s, shutting down", await wait_for_signal_async())
+        streaming_service.start_drain()
+        await stop_server_async(server, drain_timeout)
+        await streaming_service.finish_drain()
+    finally:
+        await server.stop(0)
+
+def configure_logger(log_level, log_filename, process_name=False):
+    """Logger writing to the console and log_filename from a listener thread.
+
+    The handler goes on the root logger, so the helper modules' loggers reach the same
+    console and file through propagation.
+    """
+    root_logger = logging.getLogger()
+    root_logger.setLevel(log_level)
 
     console_handler = logging.StreamHandler()
     console_handler.setLevel(log_level)
@@ -345,26 +757,30 @@ def configure_logger(log_level, log_filename):
     file_handler = logging.FileHandler(log_filename)
     file_handler.setLevel(log_level)
 
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    # Processes of --workers mode share the log file, so their lines say whose they are
+    formatter = logging.Formatter('%(asctime)s - %(processName)s - %(levelname)s - %(message)s' if process_name
+                                  else '%(asctime)s - %(levelname)s - %(message)s')
     console_handler.setFormatter(formatter)
     file_handler.setFormatter(formatter)
 
-    _logger.addHandler(console_handler)
-    _logger.addHandler(file_handler)
-    return _logger
+    root_logger.addHandler(queue_handler(console_handler, file_handler))
+    return logging.getLogger(__name__)
 
 
 def create_session_dir(session_id):
     output_folder_path = Path(f"{OUTPUT_FOLDER}/{session_id}")
     output_folder_path.mkdir(parents=True, exist_ok=True)
 
-def write_session_logs(session_id, msg):
-    with open(f'{OUTPUT_FOLDER}/{session_id}/session.log', 'a') as file:
-        file.write(f"{msg}\n")
+def parse_audio_format(fmt):
+    """Build the audio format dict for a segment from its AudioFormat message"""
+    return audio_codec.audio_format(ringcx_streaming_pb2.Codec.Name(fmt.codec), fmt.rate, fmt.ptime)
 
-def write_audio_content(session_id, segment_id, payload):
-    with open(f'{OUTPUT_FOLDER}/{session_id}/{segment_id}.bin', 'ab') as file:
-        file.write(payload)
+def open_segment_recorder(session_id, segment_id, audio_format, storage_format='linear'):
+    """Start recording a segment, or return None when its codec can't be stored"""
+    if not can_record(audio_format):
+        logger.warning("Not recording %s_%s: unsupported codec %s", session_id, segment_id, audio_format.get('encoding'))
+        return None
+    return open_recorder(f'{OUTPUT_FOLDER}/{session_id}_{segment_id}', audio_format, storage_format)
 
 def convert_bin_to_wav(session_id, segment_id, audio_format):
     """Convert binary audio file to WAV format"""
@@ -373,145 +789,362 @@ def convert_bin_to_wav(session_id, segment_id, audio_format):
     
     # Check if binary file exists and has content
     if not os.path.exists(bin_file) or os.path.getsize(bin_file) == 0:
-        logger.warning(f"Binary file {bin_file} is empty or doesn't exist")
+        logger.warning("Binary file %s is empty or doesn't exist", bin_file)
         return
     
     # Ensure we have the minimum required audio format parameters
     if not audio_format or 'sample_rate' not in audio_format:
-        logger.warning(f"Missing audio format information for {session_id}_{segment_id}")
+        logger.warning("Missing audio format information for %s_%s", session_id, segment_id)
         return
     
     # Set default values if not provided
     channels = audio_format.get('channels', 1)  # Default to mono
-    sample_width = audio_format.get('sample_width', 1)  # Default to 8-bit
     sample_rate = audio_format.get('sample_rate', 8000)  # Default to 8kHz
     encoding = audio_format.get('encoding', 'PCMU')  # Default to PCM
     
+    if not can_record(audio_format):
+        logger.warning("Unsupported codec: %s, cannot convert %s", encoding, bin_file)
+        return
+    
     try:
-        # Read binary data
-        with open(bin_file, 'rb') as f:
-            audio_data = f.read()
-        
-        # Convert based on codec type
-        if encoding == 'PCMA':  # A-law
-            # Convert A-law to PCM (2 bytes per sample)
-            audio_data = audioop.alaw2lin(audio_data, 2)
-            sample_width = 2  # A-law conversion results in 16-bit PCM
-        
-        elif encoding == 'PCMU':  # μ-law
-            # Convert μ-law to PCM (2 bytes per sample)
-            audio_data = audioop.ulaw2lin(audio_data, 2)
-            sample_width = 2  # μ-law conversion results in 16-bit PCM
-            
-        elif encoding not in ['L16', 'LINEAR16']:
-            logger.warning(f"Unsupported codec: {encoding}, using raw data")
-        
-        # Create WAV file
-        with wave.open(wav_file, 'wb') as wf:
-            wf.setnchannels(channels)
-            wf.setsampwidth(sample_width)
-            wf.setframerate(sample_rate)
-            wf.writeframes(audio_data)
+        # Stream the binary data through the recorder in fixed-size blocks
+        recorder = WavRecorder(wav_file, audio_format)
+        try:
+            with open(bin_file, 'rb') as f:
+                for block in iter(lambda: f.read(64 * 1024), b''):
+                    recorder.write(block)
+        finally:
+            recorder.close()
         
-        logger.info(f"Converted {bin_file} to WAV format: {wav_file}, format: codec={encoding}, channels={channels}, sample_width={sample_width}, rate={sample_rate}Hz")
+        logger.info("Converted %s to WAV format: %s, format: codec=%s, channels=%s, sample_width=%s, rate=%sHz", bin_file, wav_file, encoding, channels, recorder.sample_width, sample_rate)
     except Exception as e:
-        logger.error(f"Error converting {bin_file} to WAV: {e}")
-
-
-def get_all_files(directory):
-    if not os.path.exists(directory):
-        return []
-        
-    file_list = []
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            file_path = os.path.join(root, file)
-            creation_time = os.path.getctime(file_path)
-            file_list.append((file_path, creation_time))
-
-    file_list.sort(reverse=True, key=lambda x: x[1])
-    return [file[0] for file in file_list]
+        logger.error("Error converting %s to WAV: %s", bin_file, e)
 
 
 def run_flask(http_port):
-    logger.info(f"Starting Flask server on port {http_port}")
+    logger.info("Starting Flask server on port %s", http_port)
     app.run(host="0.0.0.0", port=http_port, threaded=True)
 
 @app.route('/health')
 def healthcheck():
     return '', 200
 
+def encode_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+def parse_time(value):
+    """Epoch seconds from a Unix timestamp or an ISO 8601 date or date and time (local time if naive)"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def listing_query():
+    """(limit, cursor, catalog filters, raw filter values) from the query string; raises ValueError"""
+    raw = {name: request.args[name] for name in LISTING_FILTERS if request.args.get(name)}
+    filters = dict(raw)
+    if 'participant_type' in filters:
+        filters['participant_type'] = filters['participant_type'].upper()
+        if filters['participant_type'] not in ringcx_streaming_pb2.ParticipantType.keys():
+            raise ValueError(f"Unknown participant type: {raw['participant_type']}")
+    for name in ('since', 'until'):
+        if name in filters:
+            filters[name] = parse_time(filters[name])
+    limit = min(max(int(request.args.get('limit', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    cursor = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    return limit, cursor, filters, raw
+
+def cached_listing(render, content_type):
+    """Response for a listing route, rendered once per catalog version and query.
+
+    The ETag and Last-Modified follow the catalog, which changes when recordings land, so
+    polling clients get a 304 and the page is only rendered again after a change.
+    """
+    version, updated_at = catalog.listing_version()
+    last_modified = datetime.fromtimestamp(int(updated_at), timezone.utc)
+    key = request.full_path
+    etag = hashlib.sha1(f"{updated_at}:{version}:{key}".encode()).hexdigest()[:20]
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+    else:
+        with page_cache_lock:
+            cached = page_cache.get(key)
+            if cached is not None and cached[0] == version:
+                page_cache.move_to_end(key)
+        if cached is None or cached[0] != version:
+            cached = (version, render())
+            with page_cache_lock:
+                page_cache[key] = cached
+                page_cache.move_to_end(key)
+                if len(page_cache) > PAGE_CACHE_SIZE:
+                    page_cache.popitem(last=False)
+        response = Response(cached[1], content_type=content_type)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
 @app.route('/')
 def list_files():
-    # Group files by session ID
-    sessions = {}
-    
-    # Get all files
-    all_files = get_all_files(OUTPUT_FOLDER)
-    
-    for file_path in all_files:
-        # Skip session log files from the main listing
-        if file_path.endswith('/session.log'):
-            continue
-            
-        parts = file_path.split('/')
-        file_name = parts[-1]
-        
-        if '_' in file_name:
-            # For session_segment named files
-            session_segment = file_name.split('.')[0]  # Remove extension
-            if session_segment:
-                parts = session_segment.split('_')
-                if len(parts) >= 2:
-                    session_id = parts[0]
-                    if session_id not in sessions:
-                        sessions[session_id] = {'wav_files': [], 'bin_files': []}
-                    
-                    if file_name.endswith('.wav'):
-                        sessions[session_id]['wav_files'].append(file_path)
-                    elif file_name.endswith('.bin'):
-                        sessions[session_id]['bin_files'].append(file_path)
-        elif len(parts) > 2:
-            # For files organized in session directories
-            session_id = parts[-2]
-            if session_id not in sessions:
-                sessions[session_id] = {'wav_files': [], 'bin_files': []}
-                
-            if file_name.endswith('.wav'):
-                sessions[session_id]['wav_files'].append(file_path)
-            elif file_name.endswith('.bin'):
-                sessions[session_id]['bin_files'].append(file_path)
-    
-    # Sort sessions and files
-    sorted_sessions = {}
-    for session_id in sorted(sessions.keys(), reverse=True):
-        sorted_sessions[session_id] = {
-            'wav_files': sorted(sessions[session_id]['wav_files']),
-            'bin_files': sorted(sessions[session_id]['bin_files'])
-        }
-    
-    return render_template_string(HTML_TEMPLATE, sessions=sorted_sessions)
+    # A page of sessions, newest first, with their recordings from the catalog
+    try:
+        limit, cursor, filters, raw = listing_query()
+    except ValueError as e:
+        abort(400, str(e))
+
+    def render():
+        sessions, next_cursor = catalog.sessions(limit, cursor, **filters)
+        for session in sessions:
+            session['created'] = datetime.fromtimestamp(session['created_at']).strftime('%Y-%m-%d %H:%M:%S')
+        next_url = url_for('list_files', cursor=encode_cursor(next_cursor), limit=limit, **raw) if next_cursor else None
+        return render_template_string(HTML_TEMPLATE, sessions=sessions, filters=raw, next_url=next_url,
+                                      participant_types=ringcx_streaming_pb2.ParticipantType.keys())
+    return cached_listing(render, 'text/html; charset=utf-8')
 
 @app.route('/files/<path:filename>')
 def download_file(filename):
+    # Paths are relative to the output folder; older links include the folder name
+    if filename.startswith(OUTPUT_FOLDER + '/'):
+        filename = filename[len(OUTPUT_FOLDER) + 1:]
+    # Dot-files, like the catalog database and its WAL files, are never served
+    if any(part.startswith('.') for part in filename.split('/')):
+        abort(404)
     if filename.endswith('.log'):
-        with open(filename, 'r') as f:
-            file_content = f.read()
-        return Response(file_content, content_type='text/plain')
-    return send_file(filename)
+        return stream_log(filename)
+    # Conditional: ETag/Last-Modified validation and Range requests (206) for seeking in the player.
+    # The file goes through wsgi.file_wrapper, which servers like gunicorn send with sendfile(),
+    # or is left to the front end with --x_sendfile.
+    return send_from_directory(os.path.abspath(OUTPUT_FOLDER), filename, conditional=True, etag=True)
+
+def stream_log(filename):
+    """A session log as text, streamed in chunks and cut at its size when the request came in.
+
+    Logs of running sessions keep growing, so the response is bounded to match its
+    Content-Length and ETag instead of reading to whatever the end is by then.
+    """
+    path = safe_join(os.path.abspath(OUTPUT_FOLDER), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    stat = os.stat(path)
+    etag = hashlib.sha1(f"{path}:{stat.st_size}:{stat.st_mtime}".encode()).hexdigest()[:20]
+    last_modified = datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+    else:
+        log_file = open(path, 'rb')
+        response = Response(wrap_file(request.environ, LimitedStream(log_file, stat.st_size)),
+                            content_type='text/plain; charset=utf-8', direct_passthrough=True)
+        response.call_on_close(log_file.close)
+        response.content_length = stat.st_size
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/live/<session_id>/<segment_id>')
+def live_audio(session_id, segment_id):
+    """Audio of a segment still being received, as a WAV stream that ends with the segment"""
+    segment = streaming_service.live_segment(session_id, segment_id) if streaming_service is not None else None
+    if segment is None:
+        abort(404)
+    tap = segment.tap
+    channels = segment.audio_format['channels']
+    sample_rate = segment.audio_format['sample_rate']
+
+    def generate():
+        position = tap.subscribe()
+        try:
+            # Open-ended data chunk; players read a live stream until it ends
+            yield wav_header(WAVE_FORMAT_PCM, channels, 2, sample_rate, 0x7FFFFFFF)
+            while True:
+                chunks, position = tap.read(position, timeout=1.0)
+                if chunks is None:
+                    break
+                yield from chunks  # Decoded once by the writer and shared by every listener
+        finally:
+            tap.unsubscribe()
+    logger.info("Live listener on %s_%s", session_id, segment_id)
+    response = Response(generate(), content_type='audio/wav', direct_passthrough=True)
+    response.cache_control.no_store = True
+    return response
+
+def transcript_store():
+    """The service's transcripts, or only what is on disk when gRPC runs in worker processes"""
+    return streaming_service.transcripts if streaming_service is not None else file_transcripts
+
+def transcript_filter():
+    """Predicate for the segment_id and final=1 query filters of the transcript routes"""
+    segment_id = request.args.get('segment_id')
+    final_only = request.args.get('final') in ('1', 'true')
+    return lambda record: (not segment_id or record['segment_id'] == segment_id) and (record['is_final'] or not final_only)
+
+@app.route('/api/transcripts/<session_id>')
+def api_transcripts(session_id):
+    """Transcript results of a session after ?after=<seq>; ?wait=<seconds> long-polls a live call for the next ones"""
+    transcripts = transcript_store()
+    if transcripts is None:
+        return jsonify({"error": "gRPC service not running"}), 503
+    try:
+        after = max(int(request.args.get('after', 0)), 0)
+        wait = min(float(request.args.get('wait', 0)), TRANSCRIPT_MAX_WAIT)
+    except ValueError:
+        return jsonify({"error": "after must be an integer and wait a number of seconds"}), 400
+    records, live = transcripts.wait(session_id, after, wait) if wait > 0 else transcripts.records(session_id, after)
+    if records is None:
+        return jsonify({"error": f"No transcripts for session {session_id}"}), 404
+    return jsonify({
+        "session_id": session_id,
+        "live": live,
+        "last_seq": records[-1]['seq'] if records else after,  # Pass as ?after= to get what follows
+        "results": list(filter(transcript_filter(), records)),
+    })
+
+@app.route('/api/transcripts/<session_id>/events')
+def transcript_events(session_id):
+    """Server-sent events of a session's transcript results, ending with an 'end' event once the call is over"""
+    transcripts = transcript_store()
+    if transcripts is None:
+        return jsonify({"error": "gRPC service not running"}), 503
+    try:
+        after = max(int(request.headers.get('Last-Event-ID') or request.args.get('after', 0)), 0)
+    except ValueError:
+        return jsonify({"error": "after must be an integer"}), 400
+    if transcripts.records(session_id, after)[0] is None:
+        return jsonify({"error": f"No transcripts for session {session_id}"}), 404
+    matches = transcript_filter()
+
+    def generate():
+        position = after
+        while True:
+            records, live = transcripts.wait(session_id, position, TRANSCRIPT_KEEPALIVE)
+            for record in records or ():
+                position = record['seq']
+                if matches(record):
+                    yield f"id: {position}\nevent: transcript\ndata: {json.dumps(record)}\n\n"
+            if not live:
+                yield "event: end\ndata: {}\n\n"
+                return
+            if not records:
+                yield ": keepalive\n\n"
+    response = Response(generate(), content_type='text/event-stream')
+    response.cache_control.no_cache = True
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let a proxy hold events back
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/status')
+def api_status():
+    """Active segments and pending finalizations of the gRPC service"""
+    if streaming_service is None:
+        return jsonify({"error": "gRPC service not running"}), 503
+    return jsonify(streaming_service.status())
 
 @app.route('/api/files')
 def api_list_files():
-    """API endpoint to list all audio files"""
-    wav_files = []
-    for root, _, files in os.walk(OUTPUT_FOLDER):
-        for file in files:
-            if file.endswith('.wav'):
-                file_path = os.path.join(root, file)
-                relative_path = os.path.relpath(file_path, OUTPUT_FOLDER)
-                wav_files.append(relative_path)
-                
-    return jsonify({"files": wav_files})
+    """API endpoint to list audio files a page at a time, with the same filters as the listing"""
+    try:
+        limit, cursor, filters, raw = listing_query()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def render():
+        files, next_cursor = catalog.files(limit=limit, cursor=cursor, **filters)
+        return json.dumps({"files": files, "next_cursor": encode_cursor(next_cursor) if next_cursor else None})
+    return cached_listing(render, 'application/json')
+
+def service_options(args):
+    """StreamingService keyword arguments from the command line"""
+    return {
+        'log_flush_bytes': args.log_flush_bytes,
+        'log_flush_interval': args.log_flush_interval,
+        'log_background_flush': args.log_background_flush,
+        'storage_format': args.storage_format,
+        'index_segments': args.index_segments,
+        'finalize_timeout': args.finalize_timeout,
+        'recognizer': args.recognizer,
+        'recognizer_options': recognizer_options(args),
+        'aggregate_ms': args.aggregate_ms,
+        'aggregate_max_bytes': args.aggregate_max_bytes,
+        'aggregate_max_latency_ms': args.aggregate_max_latency_ms,
+        'buffer_bytes': args.buffer_bytes,
+        'buffer_total_bytes': args.buffer_total_bytes,
+        'buffer_policy': args.buffer_policy,
+        'reorder_window': args.reorder_window,
+        'reorder_max_delay_ms': args.reorder_max_delay_ms,
+        'media_log_interval': args.media_log_interval,
+        'tap_bytes': args.tap_bytes,
+        'vad': args.vad,
+        'vad_threshold_db': args.vad_threshold_db,
+        'vad_hangover_ms': args.vad_hangover_ms,
+        'vad_preroll_ms': args.vad_preroll_ms,
+        'vad_keepalive_ms': args.vad_keepalive_ms,
+        'vad_recordings': args.vad_recordings,
+        'catalog': catalog,
+    }
+
+def server_settings(args, grpc_options=()):
+    """serve() keyword arguments for the gRPC server itself"""
+    return {
+        'grpc_options': grpc_tuning.channel_options(grpc_tuning.tuning_from_args(args)) + list(grpc_options),
+        'grpc_workers': args.grpc_workers,
+        'max_concurrent_rpcs': args.max_concurrent_rpcs,
+        'max_streams': args.max_streams,
+        'retry_after_ms': args.retry_after_ms,
+    }
+
+def run_grpc(args, grpc_options=()):
+    """Serve gRPC on the main thread until SIGINT or SIGTERM, then drain active dialogs"""
+    if args.use_async:
+        # The event loop owns the main thread until the server has drained
+        try:
+            asyncio.run(serve_async(args.server_ip, args.grpc_port, args.grpc_secure_port,
+                                    drain_timeout=args.drain_timeout,
+                                    **server_settings(args, grpc_options), **service_options(args)))
+        except KeyboardInterrupt:
+            logger.warning("Interrupted again, stopped without finishing the drain")
+    else:
+        # Start gRPC server
+        grpc_server = serve(args.server_ip, args.grpc_port, args.grpc_secure_port,
+                            **server_settings(args, grpc_options), **service_options(args))
+        
+        try:
+            logger.info("Received %s, shutting down", wait_for_signal())
+            streaming_service.start_drain()
+            stop_server(grpc_server, args.drain_timeout)
+            streaming_service.finish_drain()
+        except KeyboardInterrupt:
+            logger.warning("Interrupted again, stopped without finishing the drain")
+            grpc_server.stop(0)
+
+def drain_budget(args):
+    """Longest a drain can take: active dialogs, then the transcriptions of their last segments"""
+    return args.drain_timeout + args.finalize_timeout + 1.0
+
+def run_worker(args):
+    """Worker process of --workers mode: a gRPC server on the shared port, recording into the shared catalog"""
+    global logger, catalog
+    logger = configure_logger(args.log_level, args.log_filename, process_name=True)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)  # Stopped by the launcher like Ctrl-C
+    catalog = RecordingsCatalog(OUTPUT_FOLDER)
+    if args.worker_metrics_port:
+        metrics.start_http_server(args.worker_metrics_port + worker_index())
+    run_grpc(args, REUSEPORT_OPTIONS)
+
+def recognizer_options(args):
+    if args.recognizer == 'fake':
+        return {'latency': args.fake_latency, 'transcripts_file': args.fake_transcripts}
+    # Use phone_call model for better handling of telephony audio
+    return {'model': 'phone_call', 'pool_size': args.speech_pool_size}
 
 def parse_args():
     parser = argparse.ArgumentParser(description="gRPC Streaming Server")
@@ -522,28 +1155,99 @@ def parse_args():
     parser.add_argument('--grpc_port', type=int, default=10080, help="Port for gRPC server")
     parser.add_argument('--grpc_secure_port', type=int, default=443, help="Port for gRPC server with ssl")
     parser.add_argument('--http_port', type=int, default=8080, help="Port for http server to download outputs")
+    grpc_tuning.add_arguments(parser)
+    parser.add_argument('--workers', type=int, default=1,
+                        help="gRPC worker processes sharing the port through SO_REUSEPORT; this process then only serves HTTP")
+    parser.add_argument('--worker_metrics_port', type=int, default=0,
+                        help="With --workers, worker N serves its own /metrics on this port + N (0 disables)")
+    parser.add_argument('--drain_timeout', type=float, default=30.0,
+                        help="On SIGINT or SIGTERM, seconds active dialogs get to end before they are cut off")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="Serve gRPC with grpc.aio (one coroutine per dialog) instead of a thread pool")
+    parser.add_argument('--log_flush_bytes', type=int, default=64 * 1024,
+                        help="Flush a session.log once this many bytes are buffered")
+    parser.add_argument('--log_flush_interval', type=float, default=1.0,
+                        help="Flush a session.log once its last flush is this many seconds old")
+    parser.add_argument('--log_background_flush', action='store_true',
+                        help="Flush idle session logs from a background thread")
+    parser.add_argument('--no_segment_index', dest='index_segments', action='store_false',
+                        help="Don't keep the process-wide index of active segments")
+    parser.add_argument('--finalize_timeout', type=float, default=5.0,
+                        help="Seconds to wait for a stopped segment's transcription before giving up on it")
+    parser.add_argument('--recognizer', type=str, default='google', choices=RECOGNIZERS,
+                        help="Speech recognition backend; 'fake' replays canned transcripts offline")
+    parser.add_argument('--fake_latency', type=float, default=0.2,
+                        help="Seconds between audio and each result of the fake recognizer")
+    parser.add_argument('--fake_transcripts', type=str, default=None,
+                        help="Text file of utterances, one per line, for the fake recognizer to replay")
+    parser.add_argument('--speech_pool_size', type=int, default=1,
+                        help="Number of pooled Speech client channels shared by all segments")
+    parser.add_argument('--aggregate_ms', type=int, default=100,
+                        help="Coalesce media frames into recognizer requests of this many msec (0 disables)")
+    parser.add_argument('--aggregate_max_bytes', type=int, default=0,
+                        help="Upper bound on a coalesced recognizer request in bytes (0 for no limit)")
+    parser.add_argument('--aggregate_max_latency_ms', type=int, default=150,
+                        help="Longest a frame waits for aggregation before being sent")
+    parser.add_argument('--buffer_bytes', type=int, default=160 * 1024,
+                        help="Audio held per segment while waiting for the recognizer, in bytes")
+    parser.add_argument('--buffer_total_bytes', type=int, default=256 * 1024 * 1024,
+                        help="Cap on audio buffer memory across all segments, in bytes")
+    parser.add_argument('--buffer_policy', type=str, default='drop-oldest', choices=BUFFER_POLICIES,
+                        help="What to do when a segment's audio buffer is full")
+    parser.add_argument('--reorder_window', type=int, default=8,
+                        help="Packets a segment's reorder buffer can hold to restore seq order (0 disables)")
+    parser.add_argument('--reorder_max_delay_ms', type=int, default=60,
+                        help="Longest a packet waits behind a missing one before the gap is filled with silence")
+    parser.add_argument('--media_log_interval', type=float, default=10.0,
+                        help="Log one media summary per segment every this many seconds (0 logs every packet)")
+    parser.add_argument('--vad', type=str, default='off', choices=VAD_MODES,
+                        help="Voice activity detection per segment: 'measure' only records speech and silence, "
+                             "'gate' holds silence back from the recognizer, 'compress' also sends sparse silence "
+                             "frames to keep its stream alive")
+    parser.add_argument('--vad_threshold_db', type=float, default=-45.0,
+                        help="Mean level in dBFS above which a 10 ms frame counts as speech")
+    parser.add_argument('--vad_hangover_ms', type=int, default=300,
+                        help="Audio still passed on after the last speech, so pauses inside sentences are kept")
+    parser.add_argument('--vad_preroll_ms', type=int, default=100,
+                        help="Held back audio sent ahead of the next speech so its onset isn't clipped")
+    parser.add_argument('--vad_keepalive_ms', type=int, default=1000,
+                        help="With --vad compress, one frame of silence is sent per this much held back audio")
+    parser.add_argument('--vad_recordings', action='store_true',
+                        help="Apply the silence gate to recordings too, instead of storing the full audio")
+    parser.add_argument('--tap_bytes', type=int, default=64 * 1024,
+                        help="Decoded audio kept per segment for /live listeners, in bytes (0 disables live audio)")
+    parser.add_argument('--x_sendfile', action='store_true',
+                        help="Leave file downloads to a front-end server through the X-Sendfile header")
+    parser.add_argument('--storage_format', type=str, default='linear', choices=STORAGE_FORMATS,
+                        help="Recording format: 16-bit PCM WAV, G.711 passthrough WAV (half the size, "
+                             "not playable in every browser) or FLAC (needs soundfile)")
 
     return parser.parse_args()
 
 if __name__ == '__main__':
     args = parse_args()
-    logger = configure_logger(args.log_level, args.log_filename)
+    logger = configure_logger(args.log_level, args.log_filename, process_name=args.workers > 1)
     
     # Create output folders if they don't exist
     Path(OUTPUT_FOLDER).mkdir(exist_ok=True)
     
-    # Start gRPC server
-    grpc_server = serve(args.server_ip, args.grpc_port, args.grpc_secure_port)
+    # Open the recordings catalog and catch up with the output folder in the background
+    catalog = RecordingsCatalog(OUTPUT_FOLDER)
+    catalog_rebuild = threading.Thread(target=catalog.rebuild, name='catalog-rebuild')
+    catalog_rebuild.daemon = True
+    catalog_rebuild.start()
     
+    app.config['USE_X_SENDFILE'] = args.x_sendfile
+
     # Start Flask server in a separate thread
     flask_thread = threading.Thread(target=run_flask, args=(args.http_port,))
     flask_thread.daemon = True
     flask_thread.start()
     
-    # Keep the main thread running
-    try:
-        while True:
-            time.sleep(86400)  # Sleep for a day
-    except KeyboardInterrupt:
-        logger.info("Server shutdown initiated")
-        grpc_server.stop(0)
\ No newline at end of file
+    if args.workers > 1:
+        # gRPC runs in worker processes sharing the port; this one serves HTTP from the shared
+        # catalog and the files they write
+        file_transcripts = TranscriptStore(OUTPUT_FOLDER)
+        run_workers(args.workers, run_worker, (args,), stop_timeout=drain_budget(args) + 5.0)
+    else:
+        run_grpc(args)
@@ -0,0 +1,150 @@
+import os
+import logging
+import threading
+import grpc
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# gRPC server tuning shared by the servers: HTTP/2 and transport settings passed as channel
+# arguments, thread pool sizing, and admission control.
+#
+# Admission control caps concurrent Stream calls at `max_streams` and answers the next one at
+# once with RESOURCE_EXHAUSTED and a retry pushback, so the streamer can fail over to another
+# server instead of waiting. The slot is taken when the handler starts, so calls gRPC itself
+# refuses (--max_concurrent_rpcs) or that are cancelled before they run never hold one, and
+# it is released by the call's termination callback however the call ends. With a thread
+# pool server rejections run on the pool too: the pool gets ADMISSION_SPARE_THREADS beyond
+# `max_streams` so they never queue behind admitted dialogs.
+
+ADMISSION_SPARE_THREADS = 4
+RETRY_PUSHBACK_KEY = 'grpc-retry-pushback-ms'  # Honoured by gRPC client retry policies
+
+# Tuning name -> gRPC core channel argument. Unset values keep gRPC's defaults.
+CHANNEL_ARGS = {
+    'max_receive_message_bytes': 'grpc.max_receive_message_length',
+    'max_concurrent_streams': 'grpc.max_concurrent_streams',  # Per HTTP/2 connection
+    'keepalive_time_ms': 'grpc.keepalive_time_ms',
+    'keepalive_timeout_ms': 'grpc.keepalive_timeout_ms',
+    'keepalive_permit_without_calls': 'grpc.keepalive_permit_without_calls',
+    'min_ping_interval_ms': 'grpc.http2.min_recv_ping_interval_without_data_ms',
+    'max_ping_strikes': 'grpc.http2.max_ping_strikes',
+    'flow_control_window': 'grpc.http2.lookahead_bytes',  # Per-stream receive window
+    'bdp_probe': 'grpc.http2.bdp_probe',  # 0 keeps the window fixed instead of growing it with the link's BDP
+}
+
+REJECTED_STREAMS = metrics.REGISTRY.counter('stream_rejected_total', "Stream calls refused by admission control")
+
+
+def channel_options(tuning):
+    """gRPC server options for the tuning values that are set"""
+    return [(CHANNEL_ARGS[name], int(value)) for name, value in tuning.items() if value is not None]
+
+
+def tuning_from_env():
+    """Tuning values from GRPC_<NAME> environment variables, e.g. GRPC_KEEPALIVE_TIME_MS"""
+    return {name: int(os.environ[f'GRPC_{name.upper()}']) for name in CHANNEL_ARGS if f'GRPC_{name.upper()}' in os.environ}
+
+
+def thread_pool_size(workers, max_streams):
+    """Pool threads for a sync server: at least `max_streams` plus the spares rejections run on"""
+    if max_streams and workers < max_streams + ADMISSION_SPARE_THREADS:
+        logger.info("Raising the gRPC thread pool from %d to %d threads for %d streams",
+                    workers, max_streams + ADMISSION_SPARE_THREADS, max_streams)
+        return max_streams + ADMISSION_SPARE_THREADS
+    return workers
+
+
+def add_arguments(parser):
+    """Command line options for the tuning values, named after them"""
+    parser.add_argument('--grpc_workers', type=int, default=10,
+                        help="gRPC thread pool size; each dialog holds a thread for its whole call")
+    parser.add_argument('--max_concurrent_rpcs', type=int, default=None,
+                        help="Hard limit on RPCs in progress, enforced by gRPC without retry hints")
+    parser.add_argument('--max_streams', type=int, default=0,
+                        help="Admission control: refuse Stream calls beyond this many with RESOURCE_EXHAUSTED (0 disables)")
+    parser.add_argument('--retry_after_ms', type=int, default=1000,
+                        help="Retry pushback sent with admission control rejections")
+    for name, channel_arg in CHANNEL_ARGS.items():
+        parser.add_argument(f'--{name}', type=int, default=None, help=f"Sets {channel_arg} (default: gRPC's)")
+
+
+def tuning_from_args(args):
+    return {name: getattr(args, name) for name in CHANNEL_ARGS}
+
+
+def _handler_field(handler):
+    return ('stream_' if handler.request_streaming else 'unary_') + ('stream' if handler.response_streaming else 'unary')
+
+
+def _rejection_message(max_streams, retry_after_ms):
+    return f"Server at capacity ({max_streams} streams), retry in {retry_after_ms} ms"
+
+
+class AdmissionControl(grpc.ServerInterceptor):
+    """Admits up to `max_streams` concurrent calls on a thread pool server and refuses the rest"""
+    def __init__(self, max_streams, retry_after_ms=1000):
+        self.max_streams = max_streams
+        self.retry_after_ms = retry_after_ms
+        self._slots = threading.BoundedSemaphore(max_streams)
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None:
+            return None
+        field = _handler_field(handler)
+        behavior = getattr(handler, field)
+        if handler.response_streaming:
+            def admitted(request, context):
+                self._admit(context)
+                yield from behavior(request, context)
+        else:
+            def admitted(request, context):
+                self._admit(context)
+                return behavior(request, context)
+        return handler._replace(**{field: admitted})
+
+    def _admit(self, context):
+        """Take a slot for the call until it terminates, or refuse it"""
+        if not self._slots.acquire(blocking=False):
+            REJECTED_STREAMS.inc()
+            context.set_trailing_metadata(((RETRY_PUSHBACK_KEY, str(self.retry_after_ms)),))
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, _rejection_message(self.max_streams, self.retry_after_ms))
+        if not context.add_callback(self._slots.release):
+            self._slots.release()  # Already terminated, e.g. cancelled while waiting for a thread
+
+
+class AsyncAdmissionControl(grpc.aio.ServerInterceptor):
+    """AdmissionControl for grpc.aio servers, where calls are coroutines on one event loop"""
+    def __init__(self, max_streams, retry_after_ms=1000):
+        self.max_streams = max_streams
+        self.retry_after_ms = retry_after_ms
+        self.active = 0
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None:
+            return None
+        field = _handler_field(handler)
+        behavior = getattr(handler, field)
+        if handler.response_streaming:
+            async def admitted(request, context):
+                await self._admit(context)
+                async for response in behavior(request, context):
+                    yield response
+        else:
+            async def admitted(request, context):
+                await self._admit(context)
+                return await behavior(request, context)
+        return handler._replace(**{field: admitted})
+
+    async def _admit(self, context):
+        if self.active >= self.max_streams:
+            REJECTED_STREAMS.inc()
+            context.set_trailing_metadata(((RETRY_PUSHBACK_KEY, str(self.retry_after_ms)),))
+            await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, _rejection_message(self.max_streams, self.retry_after_ms))
+        self.active += 1
+        context.add_done_callback(self._release)
+
+    def _release(self, context):
+        self.active -= 1
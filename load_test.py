@@ -0,0 +1,362 @@
+import os
+import grpc
+import wave
+import struct
+import asyncio
+import argparse
+import time
+import uuid
+import logging
+import sys
+import audio_codec
+from grpc_tuning import RETRY_PUSHBACK_KEY
+import ringcx_streaming_pb2
+import ringcx_streaming_pb2_grpc
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+logger = logging.getLogger('load-test')
+
+# Load generator for the Streaming service.
+#
+# Opens N concurrent dialogs, each sending DialogInit, SegmentStart, `duration` seconds of
+# segment_media at `ptime` cadence and SegmentStop. Audio is synthesized silence, a WAV file
+# cut into ptime chunks (--replay_wav) or a captured event stream (--replay_events, written
+# with --save_events) replayed with its own timing. --speed 1 paces media in real time,
+# --speed 10 ten times faster and --speed 0 sends as fast as the server reads.
+#
+# Stream returns nothing until the call ends, so per-event latency is the time each write
+# waits to be accepted: it stays near zero while the server keeps up and grows when flow
+# control pushes back. "Finish" is the time from the last write to the call completing, and
+# "audio x" is seconds of audio streamed per wall-clock second across all dialogs.
+# With --server_pid the server's CPU and peak RSS, children included, are sampled from /proc
+# for each step. Dialogs share one HTTP/2 connection unless --channels spreads them over
+# several, as needed to reach every worker of a server running in multi-process mode.
+# Several --dialogs values run one after another to show how the server scales.
+#
+#   python file_server.py --recognizer fake &          # thread pool mode
+#   python load_test.py --dialogs 50 100 200 --server_pid $!
+#   python file_server.py --recognizer fake --async &  # grpc.aio mode
+#   python load_test.py --dialogs 200 --speed 0
+#
+# bench_servers.py runs the same steps against every server in the repository.
+
+SILENCE = {'PCMU': b'\xff', 'PCMA': b'\xd5', 'L16': b'\x00\x00'}
+
+
+def build_events(session_id, codec, rate, ptime, duration, chunks=None):
+    """Yield the StreamEvent sequence for one dialog with a single segment"""
+    segment_id = f"seg-{session_id[:8]}"
+    yield ringcx_streaming_pb2.StreamEvent(
+        session_id=session_id,
+        dialog_init=ringcx_streaming_pb2.DialogInitEvent(
+            dialog=ringcx_streaming_pb2.Dialog(id=f"dialog-{session_id[:8]}", type=ringcx_streaming_pb2.INBOUND)
+        )
+    )
+    yield ringcx_streaming_pb2.StreamEvent(
+        session_id=session_id,
+        segment_start=ringcx_streaming_pb2.SegmentStartEvent(
+            segment_id=segment_id,
+            participant=ringcx_streaming_pb2.Participant(id='contact', type=ringcx_streaming_pb2.CONTACT),
+            audio_format=ringcx_streaming_pb2.AudioFormat(
+                codec=ringcx_streaming_pb2.Codec.Value(codec), rate=rate, ptime=ptime
+            )
+        )
+    )
+    chunks = chunks or [SILENCE[codec] * (rate * ptime // 1000)]
+    for seq in range(duration * 1000 // ptime):
+        yield ringcx_streaming_pb2.StreamEvent(
+            session_id=session_id,
+            segment_media=ringcx_streaming_pb2.SegmentMediaEvent(
+                segment_id=segment_id,
+                audio_content=ringcx_streaming_pb2.AudioContent(payload=chunks[seq % len(chunks)], seq=seq, duration=ptime)
+            )
+        )
+    yield ringcx_streaming_pb2.StreamEvent(
+        session_id=session_id,
+        segment_stop=ringcx_streaming_pb2.SegmentStopEvent(segment_id=segment_id)
+    )
+
+
+def load_wav_chunks(path, codec, ptime):
+    """Read a 16-bit PCM WAV file as (rate, encoded ptime chunks) to stream as segment audio"""
+    with wave.open(path, 'rb') as wav:
+        if wav.getsampwidth() != 2:
+            raise ValueError(f"{path}: only 16-bit PCM WAV files can be replayed")
+        rate = wav.getframerate()
+        channels = wav.getnchannels()
+        frames = wav.readframes(wav.getnframes())
+    if channels > 1:
+        frames = b''.join(frames[i:i + 2] for i in range(0, len(frames), 2 * channels))  # First channel only
+    encoding = 'LINEAR16' if codec == 'L16' else codec
+    data = audio_codec.encode(encoding, frames)
+    chunk_size = rate * ptime // 1000 * audio_codec.SAMPLE_WIDTH[encoding]
+    return rate, [data[i:i + chunk_size] for i in range(0, len(data) - chunk_size + 1, chunk_size)]
+
+
+def save_events(path, events):
+    """Write StreamEvents as length-prefixed protobuf messages"""
+    with open(path, 'wb') as f:
+        for event in events:
+            data = event.SerializeToString()
+            f.write(struct.pack('>I', len(data)))
+            f.write(data)
+
+
+def read_events(path):
+    """Read StreamEvents written by save_events()"""
+    events = []
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(4)
+            if len(header) < 4:
+                return events
+            (size,) = struct.unpack('>I', header)
+            events.append(ringcx_streaming_pb2.StreamEvent.FromString(f.read(size)))
+
+
+def replay_events(events, session_id, default_ptime):
+    """Captured events under a new session id, each with its offset in msec from the start"""
+    offset_ms = 0
+    for captured in events:
+        event = ringcx_streaming_pb2.StreamEvent()
+        event.CopyFrom(captured)
+        event.session_id = session_id
+        yield offset_ms, event
+        if event.HasField('segment_media'):
+            offset_ms += event.segment_media.audio_content.duration or default_ptime
+
+
+def timed_events(session_id, args):
+    """(offset msec, event) pairs of one dialog"""
+    if args.replay_events:
+        return replay_events(args.captured_events, session_id, args.ptime)
+    events = build_events(session_id, args.codec, args.rate, args.ptime, args.duration, args.chunks)
+    return ((0 if not event.HasField('segment_media') else event.segment_media.audio_content.seq * args.ptime, event)
+            for event in events)
+
+
+async def run_dialog(stub, args, stats):
+    """Send one dialog at the configured pace, timing every write and the call's completion"""
+    session_id = uuid.uuid4().hex
+    call = stub.Stream(timeout=args.timeout)
+    start = time.monotonic()
+    try:
+        for offset_ms, event in timed_events(session_id, args):
+            if args.speed > 0:
+                delay = start + offset_ms / 1000 / args.speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            write_start = time.monotonic()
+            await call.write(event)
+            stats['write_latency'].append(time.monotonic() - write_start)
+            stats['events'] += 1
+        finish_start = time.monotonic()
+        await call.done_writing()
+        await call
+        stats['finish_latency'].append(time.monotonic() - finish_start)
+        stats['dialog_time'].append(time.monotonic() - start)
+    except (grpc.aio.AioRpcError, asyncio.InvalidStateError):
+        # A write to a call the server already ended, e.g. refused by admission control, raises
+        # a generic error; the call itself has the status the server sent
+        code, details = await server_status(call)
+        if code == grpc.StatusCode.RESOURCE_EXHAUSTED:
+            pushback = dict(await call.trailing_metadata() or ()).get(RETRY_PUSHBACK_KEY)
+            logger.info("Dialog %s rejected: %s (retry pushback %s ms)", session_id, details, pushback)
+            stats['rejected'] += 1
+        else:
+            logger.warning("Dialog %s failed: %s %s", session_id, code.name, details)
+            stats['failed'] += 1
+
+
+async def server_status(call, settle=1.0):
+    """(code, details) the server ended `call` with.
+
+    A write that races the server's trailers makes the client library mark the call
+    INTERNAL ('Internal error from Core') until it has read them, a loop pass or so later.
+    """
+    deadline = time.monotonic() + settle
+    code = await call.code()
+    while code == grpc.StatusCode.INTERNAL and time.monotonic() < deadline:
+        await asyncio.sleep(0.001)
+        code = await call.code()
+    return code, await call.details()
+
+
+class ProcessSampler:
+    """CPU time and peak RSS of a local process and its children, read from /proc while a step runs"""
+    def __init__(self, pid, interval=0.25):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self._task = None
+
+    def pids(self):
+        pids = [self.pid]
+        for pid in pids:
+            try:
+                with open(f'/proc/{pid}/task/{pid}/children') as f:
+                    pids.extend(int(child) for child in f.read().split())
+            except OSError:
+                pass
+        return pids
+
+    def cpu_seconds(self):
+        total = 0
+        for pid in self.pids():
+            try:
+                with open(f'/proc/{pid}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+            except OSError:
+                continue  # Exited since it was listed
+            total += int(fields[11]) + int(fields[12])  # utime + stime
+        return total / os.sysconf('SC_CLK_TCK')
+
+    def rss_bytes(self):
+        total = 0
+        for pid in self.pids():
+            try:
+                with open(f'/proc/{pid}/status') as f:
+                    for line in f:
+                        if line.startswith('VmRSS:'):
+                            total += int(line.split()[1]) * 1024
+            except OSError:
+                pass
+        return total
+
+    async def _sample(self):
+        while True:
+            self.peak_rss = max(self.peak_rss, self.rss_bytes())
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.peak_rss = 0
+        self._cpu_start = self.cpu_seconds()
+        self._task = asyncio.create_task(self._sample())
+
+    def stop(self):
+        self._task.cancel()
+        self.peak_rss = max(self.peak_rss, self.rss_bytes())
+        return self.cpu_seconds() - self._cpu_start
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+async def run_step(stubs, args, dialogs, sampler=None):
+    """Run `dialogs` concurrent dialogs, spread over the stubs' connections, and return the report row for them"""
+    stats = {'events': 0, 'failed': 0, 'rejected': 0, 'write_latency': [], 'finish_latency': [], 'dialog_time': []}
+    if sampler:
+        sampler.start()
+    start = time.monotonic()
+    await asyncio.gather(*(run_dialog(stubs[i % len(stubs)], args, stats) for i in range(dialogs)))
+    wall_time = time.monotonic() - start
+    cpu = sampler.stop() if sampler else None
+
+    writes = sorted(stats['write_latency'])
+    finishes = sorted(stats['finish_latency'])
+    completed = len(stats['dialog_time'])
+    return {
+        'dialogs': dialogs,
+        'completed': completed,
+        'failed': stats['failed'],
+        'rejected': stats['rejected'],
+        'wall_time': wall_time,
+        'events_per_second': stats['events'] / wall_time,
+        'write_p50_ms': percentile(writes, 0.5) * 1000,
+        'write_p99_ms': percentile(writes, 0.99) * 1000,
+        'finish_p50_ms': percentile(finishes, 0.5) * 1000,
+        'finish_p99_ms': percentile(finishes, 0.99) * 1000,
+        'audio_seconds': args.audio_seconds * completed,
+        'cpu_percent': cpu / wall_time * 100 if cpu is not None else None,
+        'peak_rss_mib': sampler.peak_rss / 1024 / 1024 if sampler else None,
+    }
+
+
+def format_header():
+    return (f"{'dialogs':>7} {'ok':>5} {'failed':>6} {'rejected':>8} {'wall s':>7} {'events/s':>9} {'write p50/p99 ms':>17} "
+            f"{'finish p50/p99 ms':>18} {'audio x':>7} {'CPU %':>6} {'RSS MiB':>8}")
+
+
+def format_row(row):
+    cpu = f"{row['cpu_percent']:>6.0f}" if row['cpu_percent'] is not None else f"{'-':>6}"
+    rss = f"{row['peak_rss_mib']:>8.1f}" if row['peak_rss_mib'] is not None else f"{'-':>8}"
+    return (f"{row['dialogs']:>7} {row['completed']:>5} {row['failed']:>6} {row['rejected']:>8} {row['wall_time']:>7.1f} "
+            f"{row['events_per_second']:>9.0f} {row['write_p50_ms']:>8.2f}/{row['write_p99_ms']:<8.2f} "
+            f"{row['finish_p50_ms']:>9.1f}/{row['finish_p99_ms']:<8.1f} "
+            f"{row['audio_seconds'] / row['wall_time']:>7.1f} {cpu} {rss}")
+
+
+def prepare(args):
+    """Load replay inputs once and work out how much audio each dialog carries"""
+    args.chunks = None
+    args.captured_events = None
+    if args.replay_wav:
+        args.rate, args.chunks = load_wav_chunks(args.replay_wav, args.codec, args.ptime)
+    if args.replay_events:
+        args.captured_events = read_events(args.replay_events)
+        args.audio_seconds = sum(event.segment_media.audio_content.duration or args.ptime
+                                 for event in args.captured_events if event.HasField('segment_media')) / 1000
+    else:
+        args.audio_seconds = args.duration * 1000 // args.ptime * args.ptime / 1000
+    if args.save_events:
+        save_events(args.save_events, build_events(uuid.uuid4().hex, args.codec, args.rate, args.ptime, args.duration, args.chunks))
+        logger.info("Saved one dialog's events to %s", args.save_events)
+
+
+async def run_load_test(args, sampler=None):
+    """Run every step in args.dialogs against args.target and return the report rows"""
+    rows = []
+    # A local subchannel pool per channel, or gRPC would share one connection between them
+    channels = [grpc.aio.insecure_channel(args.target, options=[('grpc.use_local_subchannel_pool', 1)])
+                for _ in range(max(args.channels, 1))]
+    try:
+        stubs = [ringcx_streaming_pb2_grpc.StreamingStub(channel) for channel in channels]
+        logger.info(format_header())
+        for dialogs in args.dialogs:
+            row = await run_step(stubs, args, dialogs, sampler)
+            rows.append(row)
+            logger.info(format_row(row))
+    finally:
+        for channel in channels:
+            await channel.close()
+    return rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent dialog load generator for the gRPC Streaming service")
+    parser.add_argument('--target', type=str, default='localhost:10080', help="Server address")
+    parser.add_argument('--dialogs', type=int, nargs='+', default=[100],
+                        help="Concurrent dialogs; several values run as successive steps")
+    parser.add_argument('--duration', type=int, default=10, help="Seconds of audio per dialog")
+    parser.add_argument('--codec', type=str, default='PCMU', choices=list(SILENCE), help="Audio codec")
+    parser.add_argument('--rate', type=int, default=8000, help="Sample rate in Hz")
+    parser.add_argument('--ptime', type=int, default=20, help="Audio chunk size in msec")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="Media pace relative to real time; 0 sends as fast as possible")
+    parser.add_argument('--replay_wav', type=str, default=None,
+                        help="16-bit PCM WAV file to stream (looped) instead of silence")
+    parser.add_argument('--replay_events', type=str, default=None,
+                        help="Captured event file to replay for every dialog")
+    parser.add_argument('--save_events', type=str, default=None,
+                        help="Write one synthesized dialog to this file for later --replay_events runs")
+    parser.add_argument('--server_pid', type=int, default=None,
+                        help="Local server process to sample CPU and RSS from")
+    parser.add_argument('--channels', type=int, default=1,
+                        help="Connections to spread dialogs over, e.g. one per worker of a multi-process server")
+    parser.add_argument('--timeout', type=float, default=600, help="Per-dialog RPC timeout in seconds")
+    return parser.parse_args(argv)
+
+
+async def main():
+    args = parse_args()
+    prepare(args)
+    await run_load_test(args, ProcessSampler(args.server_pid) if args.server_pid else None)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,23 @@
+import queue
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+# Logging through a queue: gRPC threads and the event loop only enqueue records, a listener
+# thread formats them and does the console and file I/O. QueueHandler merges each message
+# with its arguments, and renders any traceback, before enqueueing, so arguments that
+# change later (events, counter dicts) are logged as they were and no frames are kept alive.
+# It formats with a bare message formatter of its own, since basicConfig would otherwise give
+# it the default format and the listener's handlers would add their prefix a second time.
+# Records below a logger's level never get that far.
+
+
+def queue_handler(*handlers):
+    """Handler that forwards records to `handlers` on a listener thread, stopped at exit"""
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    handler = QueueHandler(records)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    return handler
@@ -0,0 +1,238 @@
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Prometheus text-format metrics without the client library.
+#
+# Hot paths only touch state owned by the calling thread: every counter, gauge and
+# histogram keeps one cell per thread and label set, and the cells are summed when
+# /metrics is scraped. Cells of threads that have exited are folded into a retired total at
+# scrape time, and whenever the thread list has doubled since it was last pruned, so thread
+# churn doesn't grow the per-metric state even when nothing scrapes.
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+PRUNE_MIN_THREADS = 64  # Thread list length below which registration doesn't prune
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+class _PerThreadMetric:
+    """Base for metrics whose values live in per-thread dicts keyed by label values"""
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._threads = []  # (thread, its cells)
+        self._retired = {}
+        self._prune_at = PRUNE_MIN_THREADS
+        self._lock = threading.Lock()
+
+    def _cells(self):
+        try:
+            return self._local.cells
+        except AttributeError:
+            cells = self._local.cells = {}
+            with self._lock:
+                self._threads.append((threading.current_thread(), cells))
+                if len(self._threads) >= self._prune_at:
+                    self._retire_locked()
+                    self._prune_at = max(PRUNE_MIN_THREADS, 2 * len(self._threads))
+            return cells
+
+    def _retire_locked(self):
+        """Fold the cells of finished threads into the retired total"""
+        live = []
+        for thread, cells in self._threads:
+            if thread.is_alive():
+                live.append((thread, cells))
+            else:
+                self._merge(self._retired, cells)
+        self._threads = live
+
+    def _collect(self):
+        """Snapshot of every thread's cells, retiring those of finished threads"""
+        with self._lock:
+            self._retire_locked()
+            snapshots = [cells.copy() for thread, cells in self._threads]
+            snapshots.append(self._retired)
+            total = {}
+            for cells in snapshots:
+                self._merge(total, cells)
+        return total
+
+    def _merge(self, total, cells):
+        for labels, value in cells.items():
+            total[labels] = total.get(labels, 0) + value
+
+    def _label_text(self, labels, extra=()):
+        pairs = list(zip(self.labelnames, labels)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self._collect().items()):
+            lines.append(f"{self.name}{self._label_text(labels)} {_number(value)}")
+        return lines
+
+
+class Counter(_PerThreadMetric):
+    kind = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        cells = self._cells()
+        cells[labels] = cells.get(labels, 0) + amount
+
+
+class Gauge(_PerThreadMetric):
+    """Up/down value, or one computed at scrape time when given a callback"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback  # Returns a number, or a {label tuple: number} dict
+
+    def inc(self, amount=1, labels=()):
+        cells = self._cells()
+        cells[labels] = cells.get(labels, 0) + amount
+
+    def dec(self, amount=1, labels=()):
+        self.inc(-amount, labels)
+
+    def _collect(self):
+        if self.callback is None:
+            return super()._collect()
+        value = self.callback()
+        return value if isinstance(value, dict) else {(): value}
+
+
+class Histogram(_PerThreadMetric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        cells = self._cells()
+        cell = cells.get(labels)
+        if cell is None:
+            cell = cells[labels] = [0] * (len(self.buckets) + 3)  # bucket counts, +Inf, sum, count
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+    def _merge(self, total, cells):
+        for labels, cell in cells.items():
+            merged = total.get(labels)
+            if merged is None:
+                total[labels] = list(cell)
+            else:
+                for i, value in enumerate(cell):
+                    merged[i] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, cell in sorted(self._collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), cell):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _number(bound)
+                lines.append(f"{self.name}_bucket{self._label_text(labels, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(labels)} {_number(cell[-2])}")
+            lines.append(f"{self.name}_count{self._label_text(labels)} {cell[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logger.error("Error collecting metric %s: %s", metric.name, e)
+        return '\n'.join(lines) + '\n'
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REGISTRY = Registry()
+
+# Instruments shared by every server in the repository
+STREAM_EVENTS = REGISTRY.counter('stream_events_total', "StreamEvents received, by event type", ('type',))
+MEDIA_BYTES = REGISTRY.counter('stream_media_bytes_total', "Audio payload bytes received in segment_media events")
+ACTIVE_STREAMS = REGISTRY.gauge('stream_active_calls', "Stream calls in progress, one per dialog")
+STREAM_SECONDS = REGISTRY.histogram('stream_duration_seconds', "Duration of Stream calls",
+                                    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600))
+DISK_WRITE_SECONDS = REGISTRY.histogram('disk_write_seconds', "Time spent in file writes, by what was written", ('kind',))
+FINAL_RESULTS = REGISTRY.counter('transcription_final_results_total', "Final transcription results received")
+VAD_SECONDS = REGISTRY.counter('vad_audio_seconds_total', "Analysed segment audio, by voice activity", ('activity',))
+VAD_SENT_SECONDS = REGISTRY.counter('vad_sent_seconds_total', "Analysed audio passed on to the recognizer by the silence gate")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes are not worth a log line each
+
+
+def start_http_server(port, host='0.0.0.0', registry=REGISTRY):
+    """Serve /metrics from a daemon thread, for servers without a web app of their own"""
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics-http')
+    thread.daemon = True
+    thread.start()
+    logger.info("Serving metrics on http://%s:%s/metrics", host, port)
+    return server
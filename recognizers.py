@@ -0,0 +1,353 @@
+import time
+import grpc
+import asyncio
+import logging
+import threading
+import audio_codec
+
+try:
+    from google.cloud import speech
+    from google.cloud.speech_v1.services.speech.transports import SpeechGrpcAsyncIOTransport, SpeechGrpcTransport
+except ImportError:  # Only the Google backend needs the client library
+    speech = None
+
+logger = logging.getLogger(__name__)
+
+# Speech recognition backends.
+#
+# A backend turns the raw payloads of one segment, in the codec described by the segment's
+# audio_format dict, into RecognitionResults. Both servers only talk to this interface, so
+# the Google backend can be swapped for FakeRecognizer to measure the transcription
+# pipeline offline. Each backend lists the wire encodings it accepts, cheapest first, and
+# negotiate() picks how a segment's audio is sent: passed through when possible,
+# transcoded only when the backend can't take the source codec.
+RECOGNIZERS = ('google', 'fake')
+
+
+class RecognitionResult:
+    __slots__ = ('transcript', 'is_final')
+
+    def __init__(self, transcript, is_final):
+        self.transcript = transcript
+        self.is_final = is_final
+
+
+class Recognizer:
+    """Base class for speech recognition backends"""
+    accepted_encodings = ('PCMU', 'PCMA', 'LINEAR16')
+
+    def negotiate(self, audio_format):
+        """Wire audio format for a segment and the function converting its chunks to it"""
+        source = audio_format.get('encoding', 'PCMU')
+        encoding, convert = audio_codec.negotiate(source, self.accepted_encodings)
+        if encoding != source:
+            logger.debug("Transcoding %s to %s for %s", source, encoding, type(self).__name__)
+        return dict(audio_format, encoding=encoding, sample_width=audio_codec.SAMPLE_WIDTH[encoding]), convert
+
+    def streaming_recognize(self, audio_format, audio_chunks):
+        """Yield RecognitionResults for an iterator of audio payloads"""
+        raise NotImplementedError
+
+    async def streaming_recognize_async(self, audio_format, audio_chunks):
+        """Async variant: consume an async iterator of payloads, yield RecognitionResults"""
+        raise NotImplementedError
+
+    def warm(self):
+        """Open connections ahead of the first stream"""
+
+    async def warm_async(self):
+        """warm() for the async variant, run inside the event loop its streams will use"""
+
+    def stats(self):
+        return {}
+
+
+class SpeechClientPool:
+    """Round-robin pool of Speech clients, each on its own long-lived gRPC channel.
+
+    Clients are created once per process, so streams skip credential loading, channel setup
+    and the TLS handshake. Keepalive pings keep idle channels open between calls. Async
+    clients sit on grpc.aio channels of their own, created on the event loop that uses them.
+    """
+    def __init__(self, size=1, keepalive_ms=30000, keepalive_timeout_ms=10000):
+        self.size = max(1, size)
+        self.channel_options = [
+            ('grpc.keepalive_time_ms', keepalive_ms),
+            ('grpc.keepalive_timeout_ms', keepalive_timeout_ms),
+            ('grpc.keepalive_permit_without_calls', 1),
+            ('grpc.http2.max_pings_without_data', 0),
+            ('grpc.use_local_subchannel_pool', 1),  # One connection per pooled channel
+            ('grpc.max_send_message_length', -1),
+            ('grpc.max_receive_message_length', -1),
+        ]
+        self._clients = []  # [client, channel, streams served]
+        self._async_clients = []
+        self._next = 0
+        self._next_async = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Client for the next stream"""
+        with self._lock:
+            if len(self._clients) < self.size:
+                self._clients.append(self._create_client())
+                entry = self._clients[-1]
+            else:
+                entry = self._clients[self._next % self.size]
+                self._next += 1
+            entry[2] += 1
+            return entry[0]
+
+    def acquire_async(self):
+        """SpeechAsyncClient for the next stream; call from the event loop"""
+        with self._lock:
+            if len(self._async_clients) < self.size:
+                self._async_clients.append(self._create_async_client())
+                entry = self._async_clients[-1]
+            else:
+                entry = self._async_clients[self._next_async % self.size]
+                self._next_async += 1
+            entry[2] += 1
+            return entry[0]
+
+    def warm(self, timeout=10):
+        """Create every client and wait for its channel to connect"""
+        with self._lock:
+            while len(self._clients) < self.size:
+                self._clients.append(self._create_client())
+            channels = [entry[1] for entry in self._clients]
+        for channel in channels:
+            try:
+                grpc.channel_ready_future(channel).result(timeout=timeout)
+            except grpc.FutureTimeoutError:
+                logger.warning("Speech channel not ready after %ss, it will connect on first use", timeout)
+        logger.info("Warmed %d Speech client channel(s)", len(channels))
+
+    async def warm_async(self, timeout=10):
+        """warm() for the async clients"""
+        with self._lock:
+            while len(self._async_clients) < self.size:
+                self._async_clients.append(self._create_async_client())
+            channels = [entry[1] for entry in self._async_clients]
+        for channel in channels:
+            try:
+                await asyncio.wait_for(channel.channel_ready(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Speech channel not ready after %ss, it will connect on first use", timeout)
+        logger.info("Warmed %d async Speech client channel(s)", len(channels))
+
+    def stats(self):
+        with self._lock:
+            streams = [entry[2] for entry in self._clients + self._async_clients]
+        return {
+            'clients': len(streams),
+            'streams': sum(streams),
+            'reused': sum(max(0, count - 1) for count in streams),  # Streams that found an open channel
+        }
+
+    def _create_client(self):
+        channel = SpeechGrpcTransport.create_channel(options=self.channel_options)
+        client = speech.SpeechClient(transport=SpeechGrpcTransport(channel=channel))
+        return [client, channel, 0]
+
+    def _create_async_client(self):
+        channel = SpeechGrpcAsyncIOTransport.create_channel(options=self.channel_options)
+        client = speech.SpeechAsyncClient(transport=SpeechGrpcAsyncIOTransport(channel=channel))
+        return [client, channel, 0]
+
+
+class GoogleRecognizer(Recognizer):
+    """Google Cloud Speech-to-Text streaming recognition"""
+    # μ-law is sent as is at 8 bits per sample; there is no A-law encoding, so PCMA is
+    # transcoded to μ-law byte for byte
+    accepted_encodings = ('PCMU', 'LINEAR16')
+
+    def __init__(self, language_code="en-US", model=None, interim_results=True, wire_encodings=None,
+                 pool_size=1, keepalive_ms=30000):
+        if speech is None:
+            raise RuntimeError("The google backend requires the google-cloud-speech package")
+        self.language_code = language_code
+        self.model = model
+        self.interim_results = interim_results
+        if wire_encodings:
+            self.accepted_encodings = tuple(wire_encodings)  # e.g. ('LINEAR16',) to always send linear PCM
+        self.pool = SpeechClientPool(pool_size, keepalive_ms)
+
+    def streaming_recognize(self, audio_format, audio_chunks):
+        client = self.pool.acquire()
+        wire_format, convert = self.negotiate(audio_format)
+        requests = (speech.StreamingRecognizeRequest(audio_content=convert(chunk)) for chunk in audio_chunks)
+        responses = client.streaming_recognize(config=self.build_streaming_config(wire_format), requests=requests)
+        for response in responses:
+            yield from self._results(response)
+
+    async def streaming_recognize_async(self, audio_format, audio_chunks):
+        client = self.pool.acquire_async()
+        wire_format, convert = self.negotiate(audio_format)
+        streaming_config = self.build_streaming_config(wire_format)
+
+        # The async client expects the config as the first request
+        async def requests():
+            yield speech.StreamingRecognizeRequest(streaming_config=streaming_config)
+            async for chunk in audio_chunks:
+                yield speech.StreamingRecognizeRequest(audio_content=convert(chunk))
+
+        responses = await client.streaming_recognize(requests=requests())
+        async for response in responses:
+            for result in self._results(response):
+                yield result
+
+    def warm(self):
+        self.pool.warm()
+
+    async def warm_async(self):
+        await self.pool.warm_async()
+
+    def stats(self):
+        return self.pool.stats()
+
+    def build_streaming_config(self, audio_format):
+        """Build the Google streaming recognition config for the negotiated wire format"""
+        # Get audio format parameters
+        sample_rate = audio_format.get('sample_rate', 8000)
+        encoding = audio_format.get('encoding', 'PCMU')
+
+        # Configure speech recognition
+        config = speech.RecognitionConfig(
+            encoding=self._get_google_encoding(encoding),
+            sample_rate_hertz=sample_rate,
+            language_code=self.language_code,
+            enable_automatic_punctuation=True,
+        )
+        if self.model:
+            config.model = self.model
+
+        return speech.StreamingRecognitionConfig(
+            config=config,
+            interim_results=self.interim_results
+        )
+
+    def _results(self, response):
+        for result in response.results:
+            transcript = result.alternatives[0].transcript if result.alternatives else ""
+            yield RecognitionResult(transcript, result.is_final)
+
+    def _get_google_encoding(self, encoding):
+        """Convert internal encoding names to Google Speech-to-Text encoding enum values"""
+        if encoding == 'LINEAR16' or encoding == 'L16':
+            return speech.RecognitionConfig.AudioEncoding.LINEAR16
+        elif encoding == 'PCMU':
+            return speech.RecognitionConfig.AudioEncoding.MULAW
+        else:
+            # Default to LINEAR16
+            logger.warning("Unsupported encoding %s for Google STT, using LINEAR16", encoding)
+            return speech.RecognitionConfig.AudioEncoding.LINEAR16
+
+
+class FakeRecognizer(Recognizer):
+    """Offline stand-in that replays canned transcripts at configurable latencies.
+
+    Every `interim_interval` seconds of received audio it emits a growing interim prefix of
+    the current utterance, and every `final_interval` seconds the full utterance as final.
+    Each result becomes available `latency` seconds after the audio that triggered it.
+    """
+    DEFAULT_TRANSCRIPTS = (
+        "thank you for calling how can I help you today",
+        "I would like to check the status of my order",
+        "sure let me look that up for you",
+    )
+
+    def __init__(self, transcripts=None, interim_interval=0.5, final_interval=3.0, latency=0.2):
+        self.transcripts = list(transcripts or self.DEFAULT_TRANSCRIPTS)
+        self.interim_interval = interim_interval
+        self.final_interval = final_interval
+        self.latency = latency
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        """Load replay transcripts from a text file, one utterance per line"""
+        with open(path) as f:
+            transcripts = [line.strip() for line in f if line.strip()]
+        return cls(transcripts, **kwargs)
+
+    def streaming_recognize(self, audio_format, audio_chunks):
+        wire_format, convert = self.negotiate(audio_format)
+        stream = _FakeStream(self, wire_format)
+        for chunk in audio_chunks:
+            stream.feed(convert(chunk))
+            yield from stream.due()
+        for delay, result in stream.remaining():
+            if delay > 0:
+                time.sleep(delay)
+            yield result
+
+    async def streaming_recognize_async(self, audio_format, audio_chunks):
+        wire_format, convert = self.negotiate(audio_format)
+        stream = _FakeStream(self, wire_format)
+        async for chunk in audio_chunks:
+            stream.feed(convert(chunk))
+            for result in stream.due():
+                yield result
+        for delay, result in stream.remaining():
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield result
+
+
+class _FakeStream:
+    """Audio clock and pending results of one FakeRecognizer stream"""
+    def __init__(self, recognizer, audio_format):
+        self.recognizer = recognizer
+        self.bytes_per_second = audio_format.get('sample_rate', 8000) * audio_format['sample_width'] * audio_format.get('channels', 1)
+        self.audio_bytes = 0
+        self.utterance = 0
+        self.utterance_start = 0.0
+        self.next_interim = recognizer.interim_interval
+        self.pending = []  # (due monotonic time, RecognitionResult)
+
+    def feed(self, chunk):
+        self.audio_bytes += len(chunk)
+        audio_seconds = self.audio_bytes / self.bytes_per_second
+        recognizer = self.recognizer
+        while audio_seconds - self.utterance_start >= recognizer.final_interval:
+            self._emit(self._utterance_text(), True)
+            self.utterance += 1
+            self.utterance_start += recognizer.final_interval
+            self.next_interim = self.utterance_start + recognizer.interim_interval
+        while audio_seconds >= self.next_interim:
+            progress = (self.next_interim - self.utterance_start) / recognizer.final_interval
+            words = self._utterance_text().split()
+            self._emit(' '.join(words[:max(1, int(len(words) * progress))]), False)
+            self.next_interim += recognizer.interim_interval
+
+    def due(self):
+        now = time.monotonic()
+        while self.pending and self.pending[0][0] <= now:
+            yield self.pending.pop(0)[1]
+
+    def remaining(self):
+        """Results still pending at end of audio, with the delay before each is due"""
+        if self.audio_bytes / self.bytes_per_second > self.utterance_start:
+            self._emit(self._utterance_text(), True)  # Final result for the last partial utterance
+        while self.pending:
+            due_at, result = self.pending.pop(0)
+            yield due_at - time.monotonic(), result
+
+    def _emit(self, transcript, is_final):
+        self.pending.append((time.monotonic() + self.recognizer.latency, RecognitionResult(transcript, is_final)))
+
+    def _utterance_text(self):
+        transcripts = self.recognizer.transcripts
+        return transcripts[self.utterance % len(transcripts)]
+
+
+def create_recognizer(name='google', **options):
+    """Create a recognizer backend by name"""
+    if name == 'google':
+        return GoogleRecognizer(**options)
+    elif name == 'fake':
+        transcripts_file = options.pop('transcripts_file', None)
+        if transcripts_file:
+            return FakeRecognizer.from_file(transcripts_file, **options)
+        return FakeRecognizer(**options)
+    raise ValueError(f"Unknown recognizer backend: {name}")
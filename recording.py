@@ -0,0 +1,168 @@
+import time
+import struct
+import logging
+import metrics
+import audio_codec
+
+try:
+    import soundfile  # Optional, only needed for FLAC storage
+except ImportError:
+    soundfile = None
+
+logger = logging.getLogger(__name__)
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_ALAW = 6
+WAVE_FORMAT_MULAW = 7
+
+# Storage formats for recordings:
+#   linear - 16-bit PCM WAV, plays everywhere
+#   g711   - PCMU/PCMA payloads stored as is in a mu-law/A-law WAV, half the size of linear
+#   flac   - lossless compressed 16-bit, needs the soundfile package
+STORAGE_FORMATS = ('linear', 'g711', 'flac')
+
+WRITE_LABELS = ('recording',)
+G711_FORMAT_TAGS = {'PCMU': WAVE_FORMAT_MULAW, 'PCMA': WAVE_FORMAT_ALAW}
+RECORDABLE_ENCODINGS = ('PCMU', 'PCMA', 'L16', 'LINEAR16')
+
+
+def wav_header(format_tag, channels, sample_width, sample_rate, data_size):
+    """RIFF/WAVE header for a single data chunk.
+
+    PCM gets the canonical 44-byte header; other format tags get the extended fmt chunk
+    and the fact chunk that non-PCM WAV files are required to carry. An odd-sized data
+    chunk is followed by a pad byte, counted in the RIFF size but not in the data size.
+    """
+    block_align = channels * sample_width
+    fmt = struct.pack('<HHIIHH', format_tag, channels, sample_rate, sample_rate * block_align, block_align, sample_width * 8)
+    if format_tag == WAVE_FORMAT_PCM:
+        chunks = struct.pack('<4sI', b'fmt ', len(fmt)) + fmt
+    else:
+        fmt += struct.pack('<H', 0)  # cbSize
+        chunks = struct.pack('<4sI', b'fmt ', len(fmt)) + fmt
+        chunks += struct.pack('<4sII', b'fact', 4, data_size // block_align)
+    chunks += struct.pack('<4sI', b'data', data_size)
+    return struct.pack('<4sI4s', b'RIFF', 4 + len(chunks) + data_size + data_size % 2, b'WAVE') + chunks
+
+
+class WavRecorder:
+    """Streams one segment's audio into a WAV file as it arrives.
+
+    The header is written with zero sizes when the file is opened and patched on close, so
+    memory stays at one write buffer regardless of how long the segment runs. Payloads are
+    buffered as received and decoded a whole buffer at a time. With the g711 storage format
+    PCMU/PCMA payloads are written untouched as mu-law/A-law WAV.
+    """
+    extension = '.wav'
+
+    def __init__(self, path, audio_format, storage_format='linear', buffer_bytes=64 * 1024):
+        self.path = path
+        self.encoding = audio_format.get('encoding', 'PCMU')
+        self.channels = audio_format.get('channels', 1)
+        self.sample_rate = audio_format.get('sample_rate', 8000)
+        if storage_format == 'g711' and self.encoding in G711_FORMAT_TAGS:
+            self.format_tag = G711_FORMAT_TAGS[self.encoding]
+            self.sample_width = 1
+            self.passthrough = True
+        else:
+            self.format_tag = WAVE_FORMAT_PCM
+            self.sample_width = 2  # G.711 is expanded to 16-bit PCM, L16 is stored as is
+            self.passthrough = False
+        self.buffer_bytes = buffer_bytes
+        self.data_size = 0
+        self._buffer = bytearray()
+        self._file = open(path, 'wb')
+        self._file.write(self._header())
+
+    def write(self, payload):
+        """Buffer one media payload, writing out once the buffer is full"""
+        if self._file is None:
+            return
+        self._buffer += payload
+        if len(self._buffer) >= self.buffer_bytes:
+            self._write_buffer()
+
+    def close(self):
+        """Write any buffered audio and patch the chunk sizes in the header"""
+        if self._file is None:
+            return
+        try:
+            self._write_buffer()
+            if self.data_size % 2:
+                self._file.write(b'\0')  # RIFF chunks are word aligned
+            self._file.seek(0)
+            self._file.write(self._header())
+        finally:
+            self._file.close()
+            self._file = None
+        logger.info("Recorded %s: codec=%s, format_tag=%s, rate=%sHz, %d bytes",
+                    self.path, self.encoding, self.format_tag, self.sample_rate, self.data_size)
+
+    def _header(self):
+        return wav_header(self.format_tag, self.channels, self.sample_width, self.sample_rate, self.data_size)
+
+    def _write_buffer(self):
+        if self._buffer:
+            data = self._buffer if self.passthrough else audio_codec.decode(self.encoding, self._buffer)
+            start = time.monotonic()
+            self._file.write(data)
+            metrics.DISK_WRITE_SECONDS.observe(time.monotonic() - start, WRITE_LABELS)
+            self.data_size += len(data)
+            self._buffer.clear()
+
+
+class FlacRecorder:
+    """Streams one segment's audio into a FLAC file through libsndfile"""
+    extension = '.flac'
+
+    def __init__(self, path, audio_format, buffer_bytes=64 * 1024):
+        if soundfile is None:
+            raise RuntimeError("FLAC storage requires the soundfile package")
+        self.path = path
+        self.encoding = audio_format.get('encoding', 'PCMU')
+        self.channels = audio_format.get('channels', 1)
+        self.sample_rate = audio_format.get('sample_rate', 8000)
+        self.sample_width = 2
+        self.buffer_bytes = buffer_bytes
+        self.data_size = 0  # Decoded PCM bytes handed to the encoder
+        self._buffer = bytearray()
+        self._file = soundfile.SoundFile(path, 'w', samplerate=self.sample_rate, channels=self.channels,
+                                         format='FLAC', subtype='PCM_16')
+
+    def write(self, payload):
+        if self._file is None:
+            return
+        self._buffer += payload
+        if len(self._buffer) >= self.buffer_bytes:
+            self._write_buffer()
+
+    def close(self):
+        if self._file is None:
+            return
+        try:
+            self._write_buffer()
+        finally:
+            self._file.close()
+            self._file = None
+        logger.info("Recorded %s: codec=%s, rate=%sHz, %d PCM bytes encoded",
+                    self.path, self.encoding, self.sample_rate, self.data_size)
+
+    def _write_buffer(self):
+        if self._buffer:
+            data = audio_codec.decode(self.encoding, bytes(self._buffer))
+            start = time.monotonic()
+            self._file.buffer_write(data, dtype='int16')
+            metrics.DISK_WRITE_SECONDS.observe(time.monotonic() - start, WRITE_LABELS)
+            self.data_size += len(data)
+            self._buffer.clear()
+
+
+def can_record(audio_format):
+    return audio_format.get('encoding') in RECORDABLE_ENCODINGS
+
+
+def open_recorder(base_path, audio_format, storage_format='linear'):
+    """Open a recorder for base_path (without extension) in the requested storage format"""
+    if storage_format == 'flac':
+        return FlacRecorder(base_path + FlacRecorder.extension, audio_format)
+    return WavRecorder(base_path + WavRecorder.extension, audio_format, storage_format)
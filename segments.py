@@ -0,0 +1,196 @@
+import time
+import queue
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Segment:
+    """State of one active segment, owned by the Stream call that received its SegmentStart"""
+    __slots__ = ('session_id', 'segment_id', 'key', 'audio_format', 'audio_buffer', 'reorder', 'transcription', 'recorder',
+                 'audio_ended_at', 'final_at', 'media', 'tap', 'participant', 'gate')
+
+    def __init__(self, session_id, segment_id, audio_buffer):
+        self.session_id = session_id
+        self.segment_id = segment_id
+        self.key = f"{session_id}_{segment_id}"
+        self.audio_format = {}
+        self.audio_buffer = audio_buffer
+        self.reorder = None  # ReorderBuffer restoring seq order, when enabled
+        self.transcription = None  # Transcription thread or task
+        self.recorder = None
+        self.audio_ended_at = None  # monotonic time of SegmentStop or the end of the call
+        self.final_at = None  # monotonic time of the latest final transcript
+        self.media = None  # MediaSummary of received packets
+        self.tap = None  # AudioBroadcaster feeding live listeners
+        self.participant = (None, None)  # Participant type name and id
+        self.gate = None  # SilenceGate in front of the recognizer, when voice activity detection is on
+
+
+class MediaSummary:
+    """Packet, byte and seq gap counts of a media stream, logged as one line per interval
+    instead of one line per packet"""
+    __slots__ = ('interval', 'packets', 'bytes', 'gaps', 'last_seq', 'window_start')
+
+    def __init__(self, interval=10.0):
+        self.interval = interval
+        self.last_seq = None
+        self._reset(time.monotonic())
+
+    def add(self, seq, size):
+        """Count one packet; True when the interval is up and a summary should be logged"""
+        if self.last_seq is not None and seq != self.last_seq + 1:
+            self.gaps += 1
+        self.last_seq = seq
+        self.packets += 1
+        self.bytes += size
+        return self.interval > 0 and time.monotonic() - self.window_start >= self.interval
+
+    def take(self):
+        """(packets, bytes, gaps, seconds) since the last summary, starting a new interval"""
+        now = time.monotonic()
+        summary = (self.packets, self.bytes, self.gaps, now - self.window_start)
+        self._reset(now)
+        return summary
+
+    def _reset(self, now):
+        self.packets = 0
+        self.bytes = 0
+        self.gaps = 0
+        self.window_start = now
+
+
+class SegmentIndex:
+    """Process-wide, lock-protected index of active segments for observability.
+
+    Streams never look segments up here; each Stream keeps its own segments, so ending one
+    call cannot touch the segments of another.
+    """
+    def __init__(self):
+        self._segments = {}
+        self._lock = threading.Lock()
+
+    def add(self, segment):
+        with self._lock:
+            self._segments[id(segment)] = segment
+
+    def remove(self, segment):
+        with self._lock:
+            self._segments.pop(id(segment), None)
+
+    def __len__(self):
+        return len(self._segments)
+
+    def snapshot(self):
+        """Keys of all active segments"""
+        with self._lock:
+            return [segment.key for segment in self._segments.values()]
+
+    def segments(self):
+        with self._lock:
+            return list(self._segments.values())
+
+    def find(self, key):
+        """The active segment with this key, or None"""
+        with self._lock:
+            for segment in self._segments.values():
+                if segment.key == key:
+                    return segment
+        return None
+
+
+class SegmentFinalizer:
+    """Finalizes stopped segments on a background thread so Stream keeps reading at line rate.
+
+    Stream signals end of audio and hands the segment over; this thread closes the recording,
+    waits for the transcription worker to drain the recognizer stream and then runs the
+    completion callback. One thread polls every pending segment, so thousands of slow
+    recognizers cost no extra threads.
+    """
+    def __init__(self, timeout=5.0, poll_interval=0.05, on_done=None):
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.on_done = on_done
+        self._submitted = queue.Queue()
+        self._pending = []  # (segment, submitted_at) waiting for their transcription to end
+        self._lock = threading.Lock()
+        self._counters = {'submitted': 0, 'completed': 0, 'timed_out': 0, 'failed': 0}
+        self._total_seconds = 0.0
+        self._max_seconds = 0.0
+        self._thread = threading.Thread(target=self._run, name='segment-finalizer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, segment):
+        with self._lock:
+            self._counters['submitted'] += 1
+        self._submitted.put((segment, time.monotonic()))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            finished = stats['completed'] + stats['timed_out'] + stats['failed']
+            stats['pending'] = stats['submitted'] - finished
+            stats['avg_seconds'] = round(self._total_seconds / finished, 3) if finished else 0.0
+            stats['max_seconds'] = round(self._max_seconds, 3)
+        return stats
+
+    def _run(self):
+        while True:
+            timeout = self.poll_interval if self._pending else None
+            try:
+                segment, submitted_at = self._submitted.get(timeout=timeout)
+                self._close_recorder(segment, submitted_at)
+                # Drain whatever else was submitted before polling transcriptions again
+                while True:
+                    segment, submitted_at = self._submitted.get_nowait()
+                    self._close_recorder(segment, submitted_at)
+            except queue.Empty:
+                pass
+            self._poll_pending()
+
+    def _close_recorder(self, segment, submitted_at):
+        try:
+            if segment.recorder:
+                segment.recorder.close()
+        except Exception as e:
+            logger.error("Error closing recording for %s: %s", segment.key, e)
+            self._complete(segment, submitted_at, 'failed')
+            return
+        self._pending.append((segment, submitted_at))
+
+    def _poll_pending(self):
+        now = time.monotonic()
+        still_pending = []
+        for segment, submitted_at in self._pending:
+            if not transcription_running(segment):
+                self._complete(segment, submitted_at, 'completed')
+            elif now - submitted_at >= self.timeout:
+                logger.warning("Transcription for %s did not finish within %ss", segment.key, self.timeout)
+                self._complete(segment, submitted_at, 'timed_out')
+            else:
+                still_pending.append((segment, submitted_at))
+        self._pending = still_pending
+
+    def _complete(self, segment, submitted_at, outcome):
+        elapsed = time.monotonic() - submitted_at
+        with self._lock:
+            self._counters[outcome] += 1
+            self._total_seconds += elapsed
+            self._max_seconds = max(self._max_seconds, elapsed)
+        if self.on_done:
+            try:
+                self.on_done(segment)
+            except Exception as e:
+                logger.error("Error completing finalization of %s: %s", segment.key, e)
+
+
+def transcription_running(segment):
+    """Whether the segment's transcription thread or task is still running"""
+    transcription = segment.transcription
+    if transcription is None:
+        return False
+    if isinstance(transcription, threading.Thread):
+        return transcription.is_alive()
+    return not transcription.done()
@@ -0,0 +1,126 @@
+import os
+import time
+import logging
+import threading
+import metrics
+
+logger = logging.getLogger(__name__)
+
+WRITE_LABELS = ('session_log',)
+
+
+class SessionLogWriter:
+    """Append-only session.log writer that keeps the file open and batches lines in memory"""
+    def __init__(self, path, max_buffer_bytes=64 * 1024, flush_interval=1.0):
+        self.path = path
+        self.max_buffer_bytes = max_buffer_bytes
+        self.flush_interval = flush_interval
+        self._file = open(path, 'a', buffering=max_buffer_bytes)
+        self._lines = []
+        self._buffered_bytes = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def write(self, msg):
+        """Buffer one line; flush when the size or time threshold is crossed"""
+        line = f"{msg}\n"
+        with self._lock:
+            if self._file is None:
+                return
+            self._lines.append(line)
+            self._buffered_bytes += len(line)
+            if self._buffered_bytes >= self.max_buffer_bytes or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._flush_locked()
+
+    def flush_if_stale(self):
+        """Flush lines older than the time threshold (used by the background flusher)"""
+        with self._lock:
+            if self._file is not None and self._lines and time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush_locked()
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._flush_locked()
+            self._file.close()
+            self._file = None
+
+    def _flush_locked(self):
+        start = time.monotonic()
+        if self._lines:
+            self._file.write(''.join(self._lines))
+            self._lines.clear()
+            self._buffered_bytes = 0
+        self._file.flush()
+        self._last_flush = time.monotonic()
+        metrics.DISK_WRITE_SECONDS.observe(self._last_flush - start, WRITE_LABELS)
+
+
+class SessionLogs:
+    """Per-session log writers for one server, with an optional background flusher thread"""
+    def __init__(self, output_folder, max_buffer_bytes=64 * 1024, flush_interval=1.0, background_flush=False,
+                 file_name='session.log'):
+        self.output_folder = output_folder
+        self.file_name = file_name
+        self.max_buffer_bytes = max_buffer_bytes
+        self.flush_interval = flush_interval
+        self._writers = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._flusher = None
+        if background_flush:
+            self._flusher = threading.Thread(target=self._flush_loop, name='session-log-flusher')
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def path(self, session_id):
+        return os.path.join(self.output_folder, session_id, self.file_name)
+
+    def write(self, session_id, msg):
+        self._get_writer(session_id).write(msg)
+
+    def flush(self, session_id):
+        writer = self._writers.get(session_id)
+        if writer:
+            writer.flush()
+
+    def close(self, session_id):
+        """Flush and close a session's log; the next write reopens it in append mode"""
+        with self._lock:
+            writer = self._writers.pop(session_id, None)
+        if writer:
+            writer.close()
+
+    def close_all(self):
+        self._stop_event.set()
+        with self._lock:
+            writers = list(self._writers.values())
+            self._writers.clear()
+        for writer in writers:
+            writer.close()
+
+    def _get_writer(self, session_id):
+        writer = self._writers.get(session_id)
+        if writer is None:
+            with self._lock:
+                writer = self._writers.get(session_id)
+                if writer is None:
+                    writer = SessionLogWriter(self.path(session_id), self.max_buffer_bytes, self.flush_interval)
+                    self._writers[session_id] = writer
+        return writer
+
+    def _flush_loop(self):
+        while not self._stop_event.wait(self.flush_interval):
+            with self._lock:
+                writers = list(self._writers.values())
+            for writer in writers:
+                try:
+                    writer.flush_if_stale()
+                except Exception as e:
+                    logger.error("Error flushing session log %s: %s", writer.path, e)
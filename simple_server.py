@@ -1,36 +1,71 @@
 import grpc
 import concurrent.futures
-import signal
 import sys
 import traceback
 import os
+import time
+import metrics
 import ringcx_streaming_pb2_grpc
+from log_queue import queue_handler
+from workers import REUSEPORT_OPTIONS, run_workers, worker_index
+import grpc_tuning
+from drain import StreamTracker, stop_server, wait_for_signal
+from segments import MediaSummary
 from google.protobuf.empty_pb2 import Empty
 import logging
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[logging.StreamHandler(sys.stdout)]
-)
+# Console output is written by a listener thread, off the gRPC worker threads
+console_handler = logging.StreamHandler(sys.stdout)
+console_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+logging.basicConfig(level=logging.INFO, handlers=[queue_handler(console_handler)])
 logger = logging.getLogger('simple-speech-server')
 
+# Seconds between media summary lines per stream; 0 logs every packet
+MEDIA_LOG_INTERVAL = float(os.environ.get('MEDIA_LOG_INTERVAL', 10))
+# Seconds active streams get to end after SIGINT or SIGTERM before they are cancelled
+DRAIN_TIMEOUT = float(os.environ.get('DRAIN_TIMEOUT', 30))
+
 class StreamingService(ringcx_streaming_pb2_grpc.StreamingServicer):
+    def __init__(self):
+        self.streams = StreamTracker()
+
     def Stream(self, request_iterator, context):
+        metrics.ACTIVE_STREAMS.inc()
+        start = time.monotonic()
+        try:
+            with self.streams.track():
+                return self._stream(request_iterator, context)
+        finally:
+            metrics.ACTIVE_STREAMS.dec()
+            metrics.STREAM_SECONDS.observe(time.monotonic() - start)
+
+    def _stream(self, request_iterator, context):
         logger.info("Server started, waiting for audio stream...")
         
+        media = MediaSummary(MEDIA_LOG_INTERVAL)
         try:
             for stream_event in request_iterator:
+                metrics.STREAM_EVENTS.inc(labels=(stream_event.WhichOneof('event'),))
                 if stream_event.HasField('segment_media'):
                     payload_size = len(stream_event.segment_media.audio_content.payload)
-                    logger.info(f"Received segment media with payload size: {payload_size} bytes")
+                    metrics.MEDIA_BYTES.inc(payload_size)
+                    if not MEDIA_LOG_INTERVAL:
+                        logger.info("Received segment media with payload size: %s bytes", payload_size)
+                    if media.add(stream_event.segment_media.audio_content.seq, payload_size):
+                        logger.info("Received segment media: %d packets, %d bytes, %d seq gaps in %.1fs", *media.take())
                 else:
-                    logger.info(f"Received other stream event type")
+                    logger.info("Received other stream event type")
             
+            if media.packets and MEDIA_LOG_INTERVAL:
+                logger.info("Received segment media: %d packets, %d bytes, %d seq gaps in %.1fs", *media.take())
             logger.info("Stream completed.")
             
+        except grpc.RpcError:
+            # The call was cancelled, by the client or by the drain timeout
+            self.streams.count_cut_off()
+            logger.warning("Stream cancelled before the client ended it")
         except Exception as e:
-            logger.error(f"Error during stream processing: {e}")
+            logger.error("Error during stream processing: %s", e)
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(f"Stream processing error: {str(e)}")
             
@@ -41,9 +76,19 @@ should_restart = True
 def serve():
     global should_restart
     
-    server = grpc.server(concurrent.futures.ThreadPoolExecutor(max_workers=10))
+    # Transport settings from GRPC_* variables; MAX_STREAMS turns on admission control
+    max_streams = int(os.environ.get('MAX_STREAMS', 0))
+    max_concurrent_rpcs = int(os.environ.get('MAX_CONCURRENT_RPCS', 0)) or None
+    workers = grpc_tuning.thread_pool_size(int(os.environ.get('GRPC_WORKERS', 10)), max_streams)
+    options = grpc_tuning.channel_options(grpc_tuning.tuning_from_env())
+    if worker_index() is not None:
+        options += REUSEPORT_OPTIONS  # Processes started with WORKERS share the port
+    interceptors = [grpc_tuning.AdmissionControl(max_streams, int(os.environ.get('RETRY_AFTER_MS', 1000)))] if max_streams else None
+    server = grpc.server(concurrent.futures.ThreadPoolExecutor(max_workers=workers), interceptors=interceptors,
+                         options=options, maximum_concurrent_rpcs=max_concurrent_rpcs)
+    service = StreamingService()
     ringcx_streaming_pb2_grpc.add_StreamingServicer_to_server(
-        StreamingService(), server
+        service, server
     )
     
     port = int(os.environ.get("PORT", 443))
@@ -61,44 +106,46 @@ def serve():
             
         server_credentials = grpc.ssl_server_credentials([(key_data, cert_data)])
         server.add_secure_port(server_address, server_credentials)
-        logger.info(f"Server started with SSL at {server_address}")
+        logger.info("Server started with SSL at %s", server_address)
     else:
         server.add_insecure_port(server_address)
-        logger.info(f"Server started without SSL at {server_address} (insecure)")
+        logger.info("Server started without SSL at %s (insecure)", server_address)
     
     server.start()
     
-    def graceful_shutdown(signum, frame):
-        global should_restart
-        logger.info("Received signal to terminate. Shutting down server gracefully...")
-        should_restart = False
-        server.stop(grace=5)
-        logger.info("Server stopped successfully")
-        sys.exit(0)
-    
-    signal.signal(signal.SIGINT, graceful_shutdown)
-    signal.signal(signal.SIGTERM, graceful_shutdown)
+    metrics_port = int(os.environ.get('METRICS_PORT', 9090))
+    if metrics_port:
+        metrics.start_http_server(metrics_port + (worker_index() or 0))  # One port per worker
     
     try:
-        server.wait_for_termination()
+        logger.info("Received %s. Shutting down server gracefully...", wait_for_signal())
+        should_restart = False
+        active, cut_off = service.streams.active, service.streams.cut_off
+        stop_server(server, DRAIN_TIMEOUT)
+        service.streams.wait_idle(5)
+        cut_off = service.streams.cut_off - cut_off
+        logger.info("Server stopped successfully: %d streams drained, %d cut off", active - cut_off, cut_off)
     except KeyboardInterrupt:
         should_restart = False
-        logger.info("Keyboard interrupt received. Shutting down server gracefully...")
-        server.stop(grace=5)
-        logger.info("Server stopped successfully")
+        logger.warning("Interrupted again, stopping without finishing the drain")
+        server.stop(0)
     except Exception as e:
-        logger.error(f"Server error: {e}")
+        logger.error("Server error: %s", e)
         traceback.print_exc()
 
 if __name__ == '__main__':
     try:
         logger.info("Starting simple server")
-        serve()
+        workers = int(os.environ.get('WORKERS', 1))
+        if workers > 1:
+            run_workers(workers, serve)
+        else:
+            serve()
     except KeyboardInterrupt:
         logger.info("Keyboard interrupt received. Exiting...")
         should_restart = False
         sys.exit(0)
     except Exception as e:
-        logger.error(f"Critical error in main loop: {e}")
+        logger.error("Critical error in main loop: %s", e)
         traceback.print_exc()
         sys.exit(1) 
\ No newline at end of file
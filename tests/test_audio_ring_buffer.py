@@ -0,0 +1,135 @@
+import time
+import queue
+import asyncio
+import threading
+import pytest
+from audio_pipeline import AudioBufferBudgetExhausted, AudioBufferPool, AudioRingBuffer
+
+
+def fill(audio_buffer, count, size=10):
+    for index in range(count):
+        audio_buffer.put(bytes([index]) * size)
+
+
+def drain(audio_buffer):
+    payloads = []
+    audio_buffer.close()
+    while (payload := audio_buffer.get()) is not None:
+        payloads.append(payload)
+    return payloads
+
+
+def test_payloads_wrap_around_the_ring():
+    audio_buffer = AudioRingBuffer(30)
+    fill(audio_buffer, 2)
+    assert audio_buffer.get() == bytes([0]) * 10
+    audio_buffer.put(b'ab' * 10)  # Starts at offset 20, continues at the front
+    assert drain(audio_buffer) == [bytes([1]) * 10, b'ab' * 10]
+
+
+def test_get_times_out_on_an_open_empty_buffer():
+    with pytest.raises(queue.Empty):
+        AudioRingBuffer(30).get(timeout=0.01)
+
+
+def test_drop_newest_discards_the_payload_that_does_not_fit():
+    audio_buffer = AudioRingBuffer(30, policy='drop-newest')
+    fill(audio_buffer, 4)
+    assert (audio_buffer.overflows, audio_buffer.dropped_bytes) == (1, 10)
+    assert drain(audio_buffer) == [bytes([index]) * 10 for index in range(3)]
+
+
+def test_drop_oldest_evicts_queued_payloads():
+    audio_buffer = AudioRingBuffer(30, policy='drop-oldest')
+    fill(audio_buffer, 3)
+    audio_buffer.put(b'x' * 20)
+    assert (audio_buffer.overflows, audio_buffer.dropped_bytes) == (2, 20)
+    assert drain(audio_buffer) == [bytes([2]) * 10, b'x' * 20]
+
+
+def test_block_waits_for_the_consumer():
+    audio_buffer = AudioRingBuffer(20, policy='block', block_timeout=5)
+    fill(audio_buffer, 2)
+    reader = threading.Timer(0.05, audio_buffer.get)
+    reader.start()
+    audio_buffer.put(b'x' * 10)
+    reader.join()
+    assert audio_buffer.overflows == 0
+    assert drain(audio_buffer) == [bytes([1]) * 10, b'x' * 10]
+
+
+def test_block_gives_up_on_a_stalled_consumer():
+    audio_buffer = AudioRingBuffer(20, policy='block', block_timeout=0.05)
+    fill(audio_buffer, 3)
+    start = time.monotonic()
+    audio_buffer.put(b'x' * 10)  # Not waited for again until the consumer reads
+    assert time.monotonic() - start < 0.05
+    assert audio_buffer.overflows == 2
+    audio_buffer.get()
+    assert not audio_buffer._stalled
+
+
+def test_put_nowait_never_blocks():
+    audio_buffer = AudioRingBuffer(20, policy='block', block_timeout=5)
+    fill(audio_buffer, 2)
+    start = time.monotonic()
+    audio_buffer.put_nowait(b'x' * 10)
+    assert time.monotonic() - start < 1
+    assert audio_buffer.overflows == 1
+    audio_buffer.put_nowait(None)
+    assert drain(audio_buffer) == [bytes([0]) * 10, bytes([1]) * 10]
+
+
+def test_ring_grows_once_to_the_segment_cap():
+    pool = AudioBufferPool(segment_bytes=100, total_bytes=1000, initial_bytes=20)
+    audio_buffer = pool.create()
+    fill(audio_buffer, 3)
+    assert audio_buffer.capacity == 100
+    assert pool.stats()['allocated_bytes'] == 100
+    fill(audio_buffer, 8)
+    assert audio_buffer.capacity == 100
+    assert audio_buffer.overflows == 1
+    assert len(drain(audio_buffer)) == 10
+
+
+def test_growth_takes_what_the_budget_grants():
+    pool = AudioBufferPool(segment_bytes=100, total_bytes=50, policy='drop-newest', initial_bytes=20)
+    audio_buffer = pool.create()
+    fill(audio_buffer, 6)
+    assert audio_buffer.capacity == 50
+    assert audio_buffer.overflows == 1
+    assert pool.stats()['allocated_bytes'] == 50
+
+
+def test_exhausted_budget_refuses_new_buffers_until_released():
+    pool = AudioBufferPool(segment_bytes=100, total_bytes=40, initial_bytes=20)
+    first = pool.create()
+    second = pool.create()
+    with pytest.raises(AudioBufferBudgetExhausted):
+        pool.create()
+    fill(first, 3)  # No budget left to grow
+    assert first.growth_denied
+    assert first.overflows == 1
+    stats = pool.stats()
+    assert (stats['buffers'], stats['rejected'], stats['short_buffers']) == (2, 1, 1)
+    pool.release(second)
+    assert pool.stats()['allocated_bytes'] == 20
+    assert second.get() is None
+    pool.create()
+
+
+def test_async_buffer_block_waits_for_the_consumer():
+    async def run():
+        pool = AudioBufferPool(segment_bytes=20, total_bytes=1000, policy='block', initial_bytes=20)
+        audio_buffer = pool.create(use_async=True)
+        for index in range(2):
+            await audio_buffer.put(bytes([index]) * 10)
+        writer = asyncio.create_task(audio_buffer.put(b'x' * 10))
+        await asyncio.sleep(0.01)
+        assert not writer.done()
+        assert await audio_buffer.get() == bytes([0]) * 10
+        await writer
+        audio_buffer.close()
+        return [await audio_buffer.get() for _ in range(3)], audio_buffer.overflows
+
+    assert asyncio.run(run()) == ([bytes([1]) * 10, b'x' * 10, None], 0)
@@ -0,0 +1,87 @@
+import os
+import types
+import pytest
+import catalog
+from catalog import RecordingsCatalog
+
+PCMU_8K = {'encoding': 'PCMU', 'sample_rate': 8000}
+
+
+@pytest.fixture
+def recordings(tmp_path):
+    recordings = RecordingsCatalog(str(tmp_path))
+    yield recordings
+    recordings.close()
+
+
+def add_recorded_segment(recordings, session_id, segment_id='seg'):
+    session_dir = os.path.join(recordings.output_folder, session_id)
+    os.makedirs(session_dir, exist_ok=True)
+    path = os.path.join(session_dir, f'{segment_id}.wav')
+    with open(path, 'wb') as recording:
+        recording.write(b'RIFF')
+    recordings.add_segment(session_id, segment_id, 'CUSTOMER', 'p1', PCMU_8K, path)
+    return path
+
+
+def all_pages(list_page, limit):
+    pages = []
+    cursor = None
+    while True:
+        page, cursor = list_page(limit=limit, cursor=cursor)
+        pages.append(page)
+        if cursor is None:
+            return pages
+
+
+def test_sessions_are_paged_newest_first(recordings, monkeypatch):
+    for index in range(5):
+        monkeypatch.setattr(catalog, 'time', types.SimpleNamespace(time=lambda: 1000.0 + index))
+        add_recorded_segment(recordings, f'session{index}')
+    pages = all_pages(recordings.sessions, 2)
+    assert [[session['session_id'] for session in page] for page in pages] == [
+        ['session4', 'session3'], ['session2', 'session1'], ['session0']]
+    assert pages[0][0]['wav_files'] == [os.path.join('session4', 'seg.wav')]
+
+
+def test_session_cursor_breaks_ties_on_session_id(recordings, monkeypatch):
+    monkeypatch.setattr(catalog, 'time', types.SimpleNamespace(time=lambda: 1000.0))
+    for session_id in ('b', 'd', 'a', 'c'):
+        add_recorded_segment(recordings, session_id)
+    pages = all_pages(recordings.sessions, 3)
+    assert [[session['session_id'] for session in page] for page in pages] == [['d', 'c', 'b'], ['a']]
+
+
+def test_sessions_without_files_are_not_listed(recordings):
+    recordings.add_session('empty', 'dialog')
+    add_recorded_segment(recordings, 'recorded')
+    sessions, cursor = recordings.sessions()
+    assert [session['session_id'] for session in sessions] == ['recorded']
+    assert cursor is None
+
+
+def test_files_are_paged_in_path_order(recordings):
+    for index in range(5):
+        add_recorded_segment(recordings, 'session', f'seg{index}')
+    pages = all_pages(recordings.files, 2)
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert sum(pages, []) == [os.path.join('session', f'seg{index}.wav') for index in range(5)]
+
+
+def test_exact_last_page_has_no_cursor(recordings):
+    for index in range(4):
+        add_recorded_segment(recordings, f'session{index}')
+    assert len(all_pages(recordings.files, 2)) == 2
+    assert len(all_pages(recordings.sessions, 2)) == 2
+
+
+def test_failed_write_is_rolled_back(recordings):
+    version = recordings.listing_version()[0]
+    with pytest.raises(AttributeError):
+        recordings.add_segment('session', 'seg', 'CUSTOMER', 'p1', None)  # Fails after inserting the session
+    assert not recordings._db.in_transaction
+    assert recordings._db.execute("SELECT COUNT(*) FROM sessions").fetchone() == (0,)
+    assert recordings.listing_version()[0] == version
+    add_recorded_segment(recordings, 'session')  # The lock was released and the catalog still works
+    assert recordings.listing_version()[0] == version + 1
+    assert [session['session_id'] for session in recordings.sessions()[0]] == ['session']
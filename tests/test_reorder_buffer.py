@@ -0,0 +1,81 @@
+import types
+import pytest
+import audio_codec
+import audio_pipeline
+from audio_pipeline import SEQ_MODULUS, ReorderBuffer
+
+PCMU_8K = audio_codec.audio_format('PCMU', 8000)
+SILENT_PACKET = audio_codec.silence('PCMU', 160)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(audio_pipeline, 'time', types.SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def packet(seq):
+    return b'seq%d' % seq
+
+
+def test_start_waits_for_the_settle_window(clock):
+    buffer = ReorderBuffer(PCMU_8K)
+    assert buffer.push(11, packet(11)) == []
+    clock.now = 0.01
+    assert buffer.push(10, packet(10)) == []  # Earlier seq within the window leads the stream
+    clock.now = 0.07
+    assert buffer.push(12, packet(12)) == [packet(10), packet(11), packet(12)]
+    assert buffer.counters['reordered'] == 1
+
+
+def test_gap_is_concealed_once_the_oldest_packet_is_too_old(clock):
+    buffer = ReorderBuffer(PCMU_8K)
+    buffer.push(1, packet(1))
+    clock.now = 0.1
+    assert buffer.push(3, packet(3)) == [packet(1)]
+    clock.now = 0.2
+    assert buffer.push(4, packet(4)) == [SILENT_PACKET, packet(3), packet(4)]
+    assert buffer.counters['concealed'] == 1
+
+
+def test_seq_wraps_around(clock):
+    buffer = ReorderBuffer(PCMU_8K)
+    last = SEQ_MODULUS - 1
+    buffer.push(last - 1, packet(last - 1))
+    clock.now = 0.1
+    assert buffer.push(last, packet(last)) == [packet(last - 1), packet(last)]
+    assert buffer.push(1, packet(1)) == []
+    assert buffer.push(0, packet(0)) == [packet(0), packet(1)]
+    assert buffer.push(0, packet(0)) == []
+    assert buffer.counters['duplicates'] == 1
+    assert buffer.counters['concealed'] == 0
+    assert buffer.counters['resyncs'] == 0
+
+
+def test_flush_releases_held_packets_in_order(clock):
+    buffer = ReorderBuffer(PCMU_8K)
+    buffer.push(5, packet(5))
+    buffer.push(7, packet(7))
+    assert buffer.flush() == [packet(5), SILENT_PACKET, packet(7)]
+
+
+def test_run_of_rejected_packets_switches_to_passthrough(clock):
+    buffer = ReorderBuffer(PCMU_8K, window=4)
+    assert buffer.push(0, b'first') == []
+    clock.now = 0.01
+    for index in range(3):
+        assert buffer.push(0, b'repeat%d' % index) == []
+    # The run's last packet releases what is held, then the whole run in arrival order
+    assert buffer.push(0, b'repeat3') == [b'first', b'repeat0', b'repeat1', b'repeat2', b'repeat3']
+    assert buffer.passthrough
+    assert buffer.push(0, b'next') == [b'next']
+    assert buffer.flush() == []
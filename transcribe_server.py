@@ -1,72 +1,191 @@
 import grpc
 import concurrent.futures
-import signal
 import sys
 import traceback
 import os
-from google.cloud import speech
+import time
+import itertools
+import metrics
+import audio_codec
+import ringcx_streaming_pb2
 import ringcx_streaming_pb2_grpc
+from log_queue import queue_handler
+from workers import REUSEPORT_OPTIONS, run_workers, worker_index
+import grpc_tuning
+from drain import StreamTracker, stop_server, wait_for_signal
+from recognizers import create_recognizer
+from audio_pipeline import FrameAggregator, SilenceGate
+from transcripts import TranscriptStore
 from google.protobuf.empty_pb2 import Empty
 import logging
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[logging.StreamHandler(sys.stdout)]
-)
+# Console output is written by a listener thread, off the gRPC worker threads
+console_handler = logging.StreamHandler(sys.stdout)
+console_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+logging.basicConfig(level=logging.INFO, handlers=[queue_handler(console_handler)])
 logger = logging.getLogger('speech-server')
 
+# Format assumed for audio that arrives before any SegmentStart with an AudioFormat
+DEFAULT_AUDIO_FORMAT = audio_codec.audio_format('PCMU', 8000)
+# Seconds active calls get to end after SIGINT or SIGTERM before they are cancelled, and then
+# for the recognizer to return the last results of the cancelled ones
+DRAIN_TIMEOUT = float(os.environ.get('DRAIN_TIMEOUT', 30))
+FINALIZE_TIMEOUT = float(os.environ.get('FINALIZE_TIMEOUT', 5))
+# Voice activity detection in front of the recognizer: VAD=measure, gate or compress (see SilenceGate)
+VAD = os.environ.get('VAD', 'off')
+
+def recognizer_from_env():
+    """Recognizer backend selected by RECOGNIZER (google or fake)"""
+    name = os.environ.get('RECOGNIZER', 'google')
+    if name == 'fake':
+        return create_recognizer('fake', latency=float(os.environ.get('FAKE_RECOGNIZER_LATENCY', 0.2)),
+                                 transcripts_file=os.environ.get('FAKE_RECOGNIZER_TRANSCRIPTS'))
+    return create_recognizer(name,
+                             pool_size=int(os.environ.get('SPEECH_POOL_SIZE', 4)),
+                             keepalive_ms=int(os.environ.get('SPEECH_KEEPALIVE_MS', 30000)))
+
 class StreamingService(ringcx_streaming_pb2_grpc.StreamingServicer):
+    def __init__(self, recognizer, transcripts=None):
+        self.recognizer = recognizer  # Shared by all calls, its client channels are reused
+        self.transcripts = transcripts  # TranscriptStore, when TRANSCRIPT_FOLDER is set
+        self.streams = StreamTracker()
+
     def Stream(self, request_iterator, context):
+        metrics.ACTIVE_STREAMS.inc()
+        start = time.monotonic()
+        try:
+            with self.streams.track():
+                return self._stream(request_iterator, context)
+        finally:
+            metrics.ACTIVE_STREAMS.dec()
+            metrics.STREAM_SECONDS.observe(time.monotonic() - start)
+
+    def _stream(self, request_iterator, context):
         logger.info("Server started, waiting for audio stream...")
         
-        client = speech.SpeechClient()
-        config = speech.RecognitionConfig(
-            encoding=speech.RecognitionConfig.AudioEncoding.MULAW,
-            sample_rate_hertz=8000,
-            language_code="en-US",
-            enable_automatic_punctuation=True,
-        )
-        streaming_config = speech.StreamingRecognitionConfig(
-            config=config,
-            interim_results=True,
-        )
+        recognizer = self.recognizer
+        # Latest ids seen, for stored results, and how the call's audio is sent to the recognizer
+        call = {'session_id': None, 'segment_id': None, 'participant': (None, None), 'audio_format': None, 'converters': {}}
+        events = self._events(request_iterator, call)
+        # The recognizer stream takes the format of the call's first SegmentStart
+        head = []
+        for stream_event in events:
+            head.append(stream_event)
+            if call['audio_format'] or stream_event.HasField('segment_media'):
+                break
+        audio_format = call['audio_format'] = call['audio_format'] or DEFAULT_AUDIO_FORMAT
+        aggregator = FrameAggregator(audio_format, target_ms=int(os.environ.get('AGGREGATE_MS', 100)))
+        gate = SilenceGate(audio_format, VAD, float(os.environ.get('VAD_THRESHOLD_DB', -45)),
+                           int(os.environ.get('VAD_HANGOVER_MS', 300))) if VAD != 'off' else None
         
         def audio_generator():
-            for stream_event in request_iterator:
+            for stream_event in itertools.chain(head, events):
                 if stream_event.HasField('segment_media'):
-                    yield speech.StreamingRecognizeRequest(
-                        audio_content=stream_event.segment_media.audio_content.payload
-                    )
+                    payload = stream_event.segment_media.audio_content.payload
+                    metrics.MEDIA_BYTES.inc(len(payload))
+                    convert = call['converters'].get(stream_event.segment_media.segment_id)
+                    if convert:
+                        payload = convert(payload)
+                    if gate:
+                        yield from gate.push(payload)
+                    else:
+                        yield payload
+                elif gate and stream_event.HasField('segment_stop'):
+                    yield from gate.flush()
+            if gate:
+                yield from gate.flush()
         
         try:            
-            responses = client.streaming_recognize(
-                config=streaming_config,
-                requests=audio_generator()
-            )
-            
-            for response in responses:
-                if not response.results:
-                    continue
-                    
-                result = response.results[0]
+            for result in recognizer.streaming_recognize(audio_format, aggregator.coalesce(audio_generator())):
+                if self.transcripts and call['session_id']:
+                    self.transcripts.add(call['session_id'], call['segment_id'], result.transcript, result.is_final,
+                                         *call['participant'])
                 if result.is_final:
-                    transcript = result.alternatives[0].transcript
-                    logger.info(f"Transcription: {transcript}")
+                    metrics.FINAL_RESULTS.inc()
+                    logger.info("Transcription: %s", result.transcript)
             
-            logger.info("Transcription completed.")
+            logger.info("Transcription completed: %s frames in %s requests. Recognizer connections: %s",
+                        aggregator.frames, aggregator.messages, recognizer.stats())
             
         except Exception as e:
-            logger.error(f"Error during transcription: {e}")
+            logger.error("Error during transcription: %s", e)
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(f"Transcription error: {str(e)}")
+        finally:
+            if self.transcripts and call['session_id']:
+                self.transcripts.release(call['session_id'])
+            if gate:
+                activity = gate.stats()
+                metrics.VAD_SECONDS.inc(activity['speech_seconds'], labels=('speech',))
+                metrics.VAD_SECONDS.inc(activity['silence_seconds'], labels=('silence',))
+                metrics.VAD_SENT_SECONDS.inc(activity['sent_seconds'])
+                logger.info("Voice activity: %ss speech, %ss silence, %ss sent on",
+                            activity['speech_seconds'], activity['silence_seconds'], activity['sent_seconds'])
             
         return Empty()
 
+    def _events(self, request_iterator, call):
+        """The call's events, keeping `call` up to date with its session, segment and audio format"""
+        try:
+            for stream_event in request_iterator:
+                metrics.STREAM_EVENTS.inc(labels=(stream_event.WhichOneof('event'),))
+                if self.transcripts and stream_event.session_id != call['session_id']:
+                    if call['session_id']:
+                        self.transcripts.release(call['session_id'])
+                    call['session_id'] = stream_event.session_id
+                    self.transcripts.acquire(call['session_id'])
+                if stream_event.HasField('segment_start'):
+                    segment_start = stream_event.segment_start
+                    call['segment_id'] = segment_start.segment_id
+                    call['participant'] = (ringcx_streaming_pb2.ParticipantType.Name(segment_start.participant.type),
+                                           segment_start.participant.id)
+                    if segment_start.HasField('audio_format'):
+                        self._set_audio_format(call, segment_start.audio_format)
+                yield stream_event
+        except grpc.RpcError:
+            # Cancelled, by the client or by the drain timeout: end the audio here so the
+            # recognizer still returns the results for what was received
+            self.streams.count_cut_off()
+            logger.warning("Call %s cancelled before the client ended it", call['session_id'])
+
+    def _set_audio_format(self, call, fmt):
+        """Take the first segment's format for the call; later segments in another codec are converted to it"""
+        audio_format = audio_codec.audio_format(ringcx_streaming_pb2.Codec.Name(fmt.codec), fmt.rate, fmt.ptime)
+        if call['audio_format'] is None:
+            call['audio_format'] = audio_format
+            return
+        stream_format = call['audio_format']
+        if audio_format['sample_rate'] != stream_format['sample_rate']:
+            logger.warning("Segment %s is at %s Hz, the call's recognizer stream at %s Hz", call['segment_id'],
+                           audio_format['sample_rate'], stream_format['sample_rate'])
+        if audio_format['encoding'] == stream_format['encoding']:
+            return
+        try:
+            call['converters'][call['segment_id']] = audio_codec.negotiate(audio_format['encoding'], (stream_format['encoding'],))[1]
+        except ValueError as e:
+            logger.warning("Segment %s: %s, passing its audio through", call['segment_id'], e)
+
 def serve():
-    server = grpc.server(concurrent.futures.ThreadPoolExecutor(max_workers=10))
+    # Transport settings from GRPC_* variables; MAX_STREAMS turns on admission control
+    max_streams = int(os.environ.get('MAX_STREAMS', 0))
+    max_concurrent_rpcs = int(os.environ.get('MAX_CONCURRENT_RPCS', 0)) or None
+    workers = grpc_tuning.thread_pool_size(int(os.environ.get('GRPC_WORKERS', 10)), max_streams)
+    options = grpc_tuning.channel_options(grpc_tuning.tuning_from_env())
+    if worker_index() is not None:
+        options += REUSEPORT_OPTIONS  # Processes started with WORKERS share the port
+    interceptors = [grpc_tuning.AdmissionControl(max_streams, int(os.environ.get('RETRY_AFTER_MS', 1000)))] if max_streams else None
+    server = grpc.server(concurrent.futures.ThreadPoolExecutor(max_workers=workers), interceptors=interceptors,
+                         options=options, maximum_concurrent_rpcs=max_concurrent_rpcs)
+    
+    # One recognizer for the process, connected before the first dialog arrives
+    recognizer = recognizer_from_env()
+    recognizer.warm()
+    # Transcripts are only kept when TRANSCRIPT_FOLDER is set, as <folder>/<session_id>/transcripts.jsonl
+    transcript_folder = os.environ.get('TRANSCRIPT_FOLDER')
+    transcripts = TranscriptStore(transcript_folder) if transcript_folder else None
+    service = StreamingService(recognizer, transcripts)
     ringcx_streaming_pb2_grpc.add_StreamingServicer_to_server(
-        StreamingService(), server
+        service, server
     )
     
     port = int(os.environ.get("PORT", 443)) # We only support 443 port at the moment
@@ -84,40 +203,47 @@ def serve():
             
         server_credentials = grpc.ssl_server_credentials([(key_data, cert_data)])
         server.add_secure_port(server_address, server_credentials)
-        logger.info(f"Server started with SSL at {server_address}")
+        logger.info("Server started with SSL at %s", server_address)
     else:
         server.add_insecure_port(server_address)
-        logger.info(f"Server started without SSL at {server_address} (insecure)")
+        logger.info("Server started without SSL at %s (insecure)", server_address)
     
     server.start()
     
-    def graceful_shutdown(signum, frame):
-        logger.info("Received signal to terminate. Shutting down server gracefully...")
-        server.stop(grace=5)
-        logger.info("Server stopped successfully")
-        sys.exit(0)
-    
-    signal.signal(signal.SIGINT, graceful_shutdown)
-    signal.signal(signal.SIGTERM, graceful_shutdown)
+    metrics_port = int(os.environ.get('METRICS_PORT', 9090))
+    if metrics_port:
+        metrics.start_http_server(metrics_port + (worker_index() or 0))  # One port per worker
     
     try:
-        server.wait_for_termination()
+        logger.info("Received %s. Shutting down server gracefully...", wait_for_signal())
+        active, cut_off = service.streams.active, service.streams.cut_off
+        stop_server(server, DRAIN_TIMEOUT)
+        # Cancelled calls are still waiting for their recognizer's last results
+        if not service.streams.wait_idle(FINALIZE_TIMEOUT):
+            logger.warning("%d recognizer streams did not finish within %ss", service.streams.active, FINALIZE_TIMEOUT)
+        if transcripts:
+            transcripts.close_all()
+        cut_off = service.streams.cut_off - cut_off
+        logger.info("Server stopped successfully: %d calls drained, %d cut off", active - cut_off, cut_off)
     except KeyboardInterrupt:
-        logger.info("Keyboard interrupt received. Shutting down server gracefully...")
-        server.stop(grace=5)
-        logger.info("Server stopped successfully")
+        logger.warning("Interrupted again, stopping without finishing the drain")
+        server.stop(0)
     except Exception as e:
-        logger.error(f"Server error: {e}")
+        logger.error("Server error: %s", e)
         traceback.print_exc()
 
 if __name__ == '__main__':
     try:
         logger.info("Starting server")
-        serve()
+        workers = int(os.environ.get('WORKERS', 1))
+        if workers > 1:
+            run_workers(workers, serve)
+        else:
+            serve()
     except KeyboardInterrupt:
         logger.info("Keyboard interrupt received. Exiting...")
         sys.exit(0)
     except Exception as e:
-        logger.error(f"Critical error in main loop: {e}")
+        logger.error("Critical error in main loop: %s", e)
         traceback.print_exc()
         sys.exit(1) 
\ No newline at end of file
@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import logging
+import threading
+from session_log import SessionLogs
+
+logger = logging.getLogger(__name__)
+
+# Transcription results per session, appended to <output folder>/<session_id>/transcripts.jsonl
+# through the buffered session log writers. Results of live sessions are also kept in
+# memory, so readers of a call in progress are answered without touching the file and can
+# wait for the next result instead of polling. A session is live while something holds it:
+# its Stream call, and each segment until its transcription has been finalized, since
+# final results keep arriving after the call ends.
+
+FILE_NAME = 'transcripts.jsonl'
+
+
+class _LiveTranscript:
+    __slots__ = ('records', 'holds', 'closed', 'cond')
+
+    def __init__(self, records):
+        self.records = records  # Record n has seq n + 1
+        self.holds = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+
+class TranscriptStore:
+    """JSONL transcript files with in-memory results and waiting readers for live sessions"""
+    def __init__(self, output_folder, max_buffer_bytes=64 * 1024, flush_interval=1.0, background_flush=False):
+        self.output_folder = output_folder
+        self.writers = SessionLogs(output_folder, max_buffer_bytes, flush_interval, background_flush, FILE_NAME)
+        self._live = {}
+        self._lock = threading.Lock()
+
+    def path(self, session_id):
+        return self.writers.path(session_id)
+
+    def acquire(self, session_id):
+        """Keep a session live until the matching release()"""
+        while True:
+            live = self._live_transcript(session_id)
+            with live.cond:
+                if not live.closed:  # Else it was closed since the lookup; take the new one
+                    live.holds += 1
+                    return
+
+    def release(self, session_id):
+        """Drop a hold; the session is closed when none is left"""
+        live = self._live.get(session_id)
+        if live is None:
+            return
+        with live.cond:
+            live.holds -= 1
+            if live.holds <= 0:
+                self._close_locked(session_id, live)
+
+    def add(self, session_id, segment_id, transcript, is_final, participant_type=None, participant_id=None):
+        """Append one result; returns the stored record"""
+        while True:
+            live = self._live.get(session_id)
+            if live is None:
+                # Late result of a closed session, e.g. after a finalization timeout: append and close again
+                self.acquire(session_id)
+                try:
+                    return self.add(session_id, segment_id, transcript, is_final, participant_type, participant_id)
+                finally:
+                    self.release(session_id)
+            with live.cond:
+                if live.closed:
+                    continue
+                record = {
+                    'seq': len(live.records) + 1,
+                    'time': round(time.time(), 3),
+                    'session_id': session_id,
+                    'segment_id': segment_id,
+                    'participant_type': participant_type,
+                    'participant_id': participant_id,
+                    'is_final': is_final,
+                    'transcript': transcript,
+                }
+                live.records.append(record)
+                # Written under the session's lock so the file keeps seq order
+                self.writers.write(session_id, json.dumps(record))
+                live.cond.notify_all()
+                return record
+
+    def records(self, session_id, after=0):
+        """(results with seq > `after`, whether the session is live); None results for unknown sessions"""
+        live = self._live.get(session_id)
+        if live is None:
+            records = self._read(session_id)
+            return (records[after:] if records is not None else None), False
+        with live.cond:
+            return live.records[after:], not live.closed
+
+    def wait(self, session_id, after=0, timeout=None):
+        """Like records(), but waits up to `timeout` for a result after `after` while the session is live"""
+        live = self._live.get(session_id)
+        if live is None:
+            return self.records(session_id, after)
+        with live.cond:
+            live.cond.wait_for(lambda: len(live.records) > after or live.closed, timeout)
+            return live.records[after:], not live.closed
+
+    def close(self, session_id):
+        """Flush a session's file and release its waiting readers"""
+        live = self._live.get(session_id)
+        if live is not None:
+            with live.cond:
+                self._close_locked(session_id, live)
+
+    def close_all(self):
+        with self._lock:
+            session_ids = list(self._live)
+        for session_id in session_ids:
+            self.close(session_id)
+        self.writers.close_all()
+
+    def _close_locked(self, session_id, live):
+        if live.closed:
+            return
+        with self._lock:
+            if self._live.get(session_id) is live:
+                del self._live[session_id]
+        live.closed = True
+        self.writers.close(session_id)
+        live.cond.notify_all()
+
+    def _live_transcript(self, session_id):
+        live = self._live.get(session_id)
+        if live is None:
+            with self._lock:
+                live = self._live.get(session_id)
+                if live is None:
+                    # A session that comes back continues its numbering
+                    os.makedirs(os.path.dirname(self.path(session_id)), exist_ok=True)
+                    live = self._live[session_id] = _LiveTranscript(self._read(session_id) or [])
+        return live
+
+    def _read(self, session_id):
+        """Records from a session's file, or None when there is none"""
+        if not session_id or session_id in ('.', '..') or os.sep in session_id:
+            return None
+        try:
+            with open(self.path(session_id)) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return None
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                logger.warning("Skipping a malformed line in %s", self.path(session_id))
+        return records
@@ -0,0 +1,81 @@
+import os
+import time
+import signal
+import logging
+import multiprocessing
+from multiprocessing.connection import wait
+
+logger = logging.getLogger(__name__)
+
+# Multi-process mode for the servers: N worker processes each run their own gRPC server on
+# the same port with SO_REUSEPORT, and the kernel spreads incoming connections, and so
+# dialogs, across them. Every worker has its own GIL, so protobuf parsing, audio decoding
+# and logging scale with cores instead of contending in one interpreter.
+#
+# Workers are spawned, not forked: gRPC does not support fork() once it has started, and a
+# fresh interpreter imports nothing the parent had open. Each worker knows its index from
+# WORKER_INDEX_ENV, e.g. to pick its own metrics port.
+
+WORKER_INDEX_ENV = 'SERVER_WORKER_INDEX'
+REUSEPORT_OPTIONS = (('grpc.so_reuseport', 1),)
+
+
+def worker_index():
+    """Index of this worker process, or None outside multi-process mode"""
+    index = os.environ.get(WORKER_INDEX_ENV)
+    return int(index) if index is not None else None
+
+
+def _run_worker(index, target, args):
+    os.environ[WORKER_INDEX_ENV] = str(index)
+    # Ctrl-C reaches the whole process group: workers leave it to the launcher, which stops them with SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    target(*args)
+
+
+def _terminate(processes, timeout):
+    for process in processes:
+        process.terminate()  # SIGTERM: the worker's own shutdown path
+    deadline = time.monotonic() + timeout
+    for process in processes:
+        process.join(max(deadline - time.monotonic(), 0))
+        if process.is_alive():
+            logger.warning("%s did not stop within %ss, killing it", process.name, timeout)
+            process.kill()
+            process.join()
+
+
+def run_workers(count, target, args=(), restart_delay=1.0, stop_timeout=30.0):
+    """Run target(*args) in `count` worker processes until SIGINT or SIGTERM, restarting any that exit.
+
+    On shutdown every worker gets SIGTERM and `stop_timeout` seconds to drain before it is killed.
+    """
+    context = multiprocessing.get_context('spawn')
+    processes = {}
+    stopping = []
+
+    def start(index):
+        process = context.Process(target=_run_worker, args=(index, target, args), name=f'worker-{index}')
+        process.start()
+        processes[index] = process
+        logger.info("Started %s (pid %d)", process.name, process.pid)
+
+    def stop(signum, frame):
+        stopping.append(signum)
+
+    previous = {signum: signal.signal(signum, stop) for signum in (signal.SIGINT, signal.SIGTERM)}
+    try:
+        for index in range(count):
+            start(index)
+        while not stopping:
+            wait([process.sentinel for process in processes.values()], timeout=1.0)
+            for index, process in list(processes.items()):
+                if process.exitcode is not None and not stopping:
+                    logger.error("%s (pid %d) exited with code %s, restarting it", process.name, process.pid, process.exitcode)
+                    time.sleep(restart_delay)
+                    start(index)
+    finally:
+        logger.info("Stopping %d workers", len(processes))
+        _terminate(list(processes.values()), stop_timeout)
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)